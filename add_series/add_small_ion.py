@@ -2,9 +2,8 @@ import subprocess
 import sys
 import os
 import re
-from config_params.config import Config
+from core_utils import structure_io, tool_runner
 import numpy as np
-import random
 def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_params, ion_params, solvent_name):
     """
     Runs the GROMACS genion tool to add ions and neutralize the system.
@@ -23,13 +22,14 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
     output_dir = sim_params['output_dir']
     gmx_exec_path = sim_params.get('gromacs_executable_path', 'gmx_mpi')
     gmx_include_path = sim_params.get('gromacs_include_path')
+    gmx_timeout = tool_runner.timeout_for(sim_params, 'gmx')
 
     # 2. Run gmx grompp to create a .tpr file
     env = os.environ.copy()
     if gmx_include_path:
         env['GMX_INCLUDE'] = gmx_include_path
 
-    ion_list = ion_params.get('ions')
+    ion_list = [dict(ion) for ion in ion_params.get('ions')]
     cation_list = []
     anion_list = []
     additional_cation_list = []
@@ -54,86 +54,16 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
         additional_cation_list.append(cation_list.pop(0))
     if not additional_anion_list:
         if len(anion_list) == 0:
-            print("Check cation list!")
+            print("Check anion list!")
             return 1
-        additional_anion_list.append(cation_list.pop(0))
-    if abs(total_charge) > 1e-6 and total_charge>0:
-        additional_ion_ratio = []
-        additional_ion_charge = []
-        for i in range(len(additional_anion_list)):
-            additional_ion_ratio.append(additional_anion_list[i].get("number"))
-            additional_ion_charge.append(additional_anion_list[i].get("charge"))
-        additional_ion_ratio = np.array(additional_ion_ratio)
-        additional_ion_charge = np.array(additional_ion_charge)
-        basic_charge = np.dot(additional_ion_ratio,additional_ion_charge)
-        total_mul = np.abs(total_charge / basic_charge)
-        first_solution = np.floor(additional_ion_ratio * total_mul)
-        first_charge = np.abs(np.dot(first_solution,additional_ion_charge))
-        remained_charge = np.abs(total_charge) - first_charge
-        if abs(remained_charge)>1e-6:
-            max_checker= np.max(np.abs(additional_ion_charge))
-            final_solution = []
-            if len(additional_ion_charge) == 1:
-                for i in range(max_checker):
-                    if abs(abs(np.dot(np.array([i]),additional_ion_charge)) - remained_charge)<1e-6:
-                        final_solution.append([i])
-            elif len(additional_ion_charge) == 2:
-                for i in range(max_checker):
-                    for j in range(max_checker):
-                        if abs(abs(np.dot(np.array([i,j]),additional_ion_charge)) - remained_charge)<1e-6:
-                            final_solution.append([i,j])
-            else:
-                for i in range(max_checker):
-                    for j in range(max_checker):
-                        for k in range(max_checker):
-                            if abs(abs(np.dot(np.array([i,j,k]),additional_ion_charge[:3])) - remained_charge)<1e-6:
-                                final_solution.append([i,j,k])
-            random.seed(Config.get_param("simulation_parameters").get("random_seed",0))
-            if len(final_solution) != 0:
-                selected_solution = random.choice(final_solution)
-                for i in range(len(selected_solution)):
-                    first_solution[i] += selected_solution[i]
-        for i in range(len(first_solution)):
-            additional_anion_list[i]['number'] += first_solution[i]
-
-    elif abs(total_charge) > 1e-6 and total_charge<0:
-        additional_ion_ratio = []
-        additional_ion_charge = []
-        for i in range(len(additional_cation_list)):
-            additional_ion_ratio.append(additional_cation_list[i].get("number"))
-            additional_ion_charge.append(additional_cation_list[i].get("charge"))
-        additional_ion_ratio = np.array(additional_ion_ratio)
-        additional_ion_charge = np.array(additional_ion_charge)
-        basic_charge = np.dot(additional_ion_ratio,additional_ion_charge)
-        total_mul = np.abs(total_charge / basic_charge)
-        first_solution = np.floor(np.additional_ion_ratio * total_mul)
-        first_charge = np.abs(np.dot(first_solution,additional_ion_charge))
-        remained_charge = np.abs(total_charge) - first_charge
-        if abs(remained_charge)>1e-6:
-            max_checker= np.max(np.abs(additional_ion_charge))
-            final_solution = []
-            if len(additional_ion_charge) == 1:
-                for i in range(max_checker):
-                    if abs(abs(np.dot(np.array([i]),additional_ion_charge)) - remained_charge)<1e-6:
-                        final_solution.append([i])
-            elif len(additional_ion_charge) == 2:
-                for i in range(max_checker):
-                    for j in range(max_checker):
-                        if abs(abs(np.dot(np.array([i,j]),additional_ion_charge)) - remained_charge)<1e-6:
-                            final_solution.append([i,j])
-            else:
-                for i in range(max_checker):
-                    for j in range(max_checker):
-                        for k in range(max_checker):
-                            if abs(abs(np.dot(np.array([i,j,k]),additional_ion_charge[:3])) - remained_charge)<1e-6:
-                                final_solution.append([i,j,k])
-            random.seed(Config.get_param("simulation_parameters").get("random_seed",0))
-            if len(final_solution) != 0:
-                selected_solution = random.choice(final_solution)
-                for i in range(len(selected_solution)):
-                    first_solution[i] += selected_solution[i]
-        for i in range(len(first_solution)):
-            additional_cation_list[i]['number'] += first_solution[i]
+        additional_anion_list.append(anion_list.pop(0))
+    if abs(total_charge) > 1e-6:
+        # Extra neutralizing ions in the ratio of the requested numbers; genion -neutral
+        # then cancels the charge of the rest of the system.
+        neutralizers = additional_anion_list if total_charge > 0 else additional_cation_list
+        extra = neutralizing_counts(int(round(total_charge)), neutralizers, sim_params.get('random_seed', 0))
+        for ion in neutralizers:
+            ion['number'] += extra.get(ion['ion_name'], 0)
     additional_anion_list.reverse()
     additional_cation_list.reverse()
     anion_list.extend(additional_anion_list)
@@ -159,7 +89,7 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
         ]
         print(f"\nRunning grompp: {' '.join(grompp_command)}")
         try:
-            subprocess.run(grompp_command, check=True, capture_output=True, text=True, cwd=output_dir, env=env)
+            tool_runner.run_tool(grompp_command, cwd=output_dir, env=env, log_path=os.path.join(output_dir, "grompp.log"), timeout=gmx_timeout)
         except subprocess.CalledProcessError as e:
             print("--- GROMACS grompp command failed ---", file=sys.stderr)
             print(f"Return code: {e.returncode}", file=sys.stderr)
@@ -183,7 +113,7 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
 
         print(f"\nRunning genion: {' '.join(map(str, genion_command))}")
         # Provide the replacement group (e.g., 'W') to stdin
-        result = subprocess.run(genion_command, check=True, cwd=output_dir, capture_output=True, text=True, input=solvent_name)
+        result = tool_runner.run_tool(genion_command, cwd=output_dir, input=solvent_name, log_path=os.path.join(output_dir, "genion.log"), timeout=gmx_timeout)
         print(result.stdout)
         if result.stderr:
             print("genion stderr:", result.stderr, file=sys.stderr)
@@ -213,7 +143,7 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
         ]
         print(f"\nRunning grompp: {' '.join(grompp_command)}")
         try:
-            subprocess.run(grompp_command, check=True, capture_output=True, text=True, cwd=output_dir, env=env)
+            tool_runner.run_tool(grompp_command, cwd=output_dir, env=env, log_path=os.path.join(output_dir, "grompp.log"), timeout=gmx_timeout)
         except subprocess.CalledProcessError as e:
             print("--- GROMACS grompp command failed ---", file=sys.stderr)
             print(f"Return code: {e.returncode}", file=sys.stderr)
@@ -237,7 +167,7 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
 
         print(f"\nRunning genion: {' '.join(map(str, genion_command))}")
         # Provide the replacement group (e.g., 'W') to stdin
-        result = subprocess.run(genion_command, check=True, capture_output=True, text=True, cwd=output_dir, input=solvent_name)
+        result = tool_runner.run_tool(genion_command, cwd=output_dir, input=solvent_name, log_path=os.path.join(output_dir, "genion.log"), timeout=gmx_timeout)
         print(result.stdout)
         if result.stderr:
             print("genion stderr:", result.stderr, file=sys.stderr)
@@ -265,7 +195,7 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
     ]
     print(f"\nRunning grompp: {' '.join(grompp_command)}")
     try:
-        subprocess.run(grompp_command, check=True, capture_output=True, text=True, cwd=output_dir, env=env)
+        tool_runner.run_tool(grompp_command, cwd=output_dir, env=env, log_path=os.path.join(output_dir, "grompp.log"), timeout=gmx_timeout)
     except subprocess.CalledProcessError as e:
         print("--- GROMACS grompp command failed ---", file=sys.stderr)
         print(f"Return code: {e.returncode}", file=sys.stderr)
@@ -293,7 +223,7 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
 
     print(f"\nRunning genion: {' '.join(map(str, genion_command))}")
     # Provide the replacement group (e.g., 'W') to stdin
-    result = subprocess.run(genion_command, check=True, capture_output=True, text=True, cwd=output_dir, input=solvent_name)
+    result = tool_runner.run_tool(genion_command, cwd=output_dir, input=solvent_name, log_path=os.path.join(output_dir, "genion.log"), timeout=gmx_timeout)
     print(result.stdout)
     if result.stderr:
         print("genion stderr:", result.stderr, file=sys.stderr)
@@ -303,31 +233,8 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
     all_ion_names = {ion['ion_name'] for ion in ion_params.get('ions', [])}
 
     try:
-        with open(final_gro_path, 'r') as f:
-            lines = f.readlines()
-
-        if len(lines) >= 3:
-            new_lines = lines[:2]  # Title and atom count
-
-            for line in lines[2:-1]:  # Atom lines
-                if len(line) > 20:
-                    resname = line[5:10].strip()
-                    atomname = line[10:15].strip()
-                    if resname in all_ion_names or atomname in all_ion_names:
-                        new_line = line[:5] + 'ION  ' + line[10:]
-                        new_lines.append(new_line)
-                    else:
-                        new_lines.append(line)
-                else:
-                    new_lines.append(line)
-
-            new_lines.append(lines[-1])  # Box vectors
-
-            with open(final_gro_path, 'w') as f:
-                f.writelines(new_lines)
-
-            print(f"\nResidue names for all ions in '{final_gro}' have been standardized to 'ION'.")
-
+        n_renamed = structure_io.rename_residues_in_gro(final_gro_path, all_ion_names, 'ION')
+        print(f"\nResidue names for all ions in '{final_gro}' have been standardized to 'ION' ({n_renamed} atoms).")
     except FileNotFoundError:
         print(f"Warning: Output file '{final_gro_path}' not found for post-processing.", file=sys.stderr)
     except Exception as e:
@@ -342,3 +249,175 @@ def run_genion_for_neutralization(input_gro, output_gro, topology_file, sim_para
     print("\n" + "="*50)
     print(f"Ion addition complete. Final file: '{output_gro}'")
     print("="*50)
+
+def neutralizing_counts(charge, species, seed=0):
+    """
+    Non-negative numbers of ions that exactly cancel an integer net charge.
+
+    Only the species with a charge opposite to `charge` are used. Their numbers stay as
+    close as possible, in squared deviation, to the split in the ratio of their 'number'
+    entries (equal ratios if all are zero). The ideal counts are rounded down by a
+    margin and the small remaining charge is distributed by an exact dynamic program,
+    so the cost does not grow with the charge magnitude. Ties are broken reproducibly
+    from seed.
+
+    Args:
+        charge (int): Net charge to cancel.
+        species (list): Ion dicts with 'ion_name', 'charge' and optionally 'number'.
+        seed (int): Seed of the tie-breaking.
+
+    Returns:
+        dict: ion_name -> number of ions to add.
+
+    Raises:
+        ValueError: If no combination of the species cancels the charge exactly.
+    """
+    if charge == 0:
+        return {}
+    species = [ion for ion in species if ion['charge'] * charge < 0]
+    if not species:
+        raise ValueError(f"No ion species available to neutralize a net charge of {charge}")
+    q = np.array([abs(int(round(ion['charge']))) for ion in species], dtype=np.int64)
+    target = abs(int(charge))
+    if target % np.gcd.reduce(q):
+        raise ValueError(f"Net charge {charge} cannot be cancelled exactly with charges {q.tolist()}")
+
+    ratio = np.array([max(ion.get('number', 0), 0) for ion in species], dtype=np.float64)
+    if ratio.sum() == 0:
+        ratio[:] = 1.0
+    ideal = ratio * target / np.dot(ratio, q)
+    base = np.maximum(np.floor(ideal).astype(np.int64) - int(q.sum()), 0)
+    remainder = target - int(np.dot(base, q))
+
+    # cost[v]: least squared deviation of the species so far for v extra charge units
+    jitter = np.random.default_rng(seed).random(len(q)) * 1e-9
+    cost = np.full(remainder + 1, np.inf)
+    cost[0] = 0.0
+    picks = []
+    for i in range(len(q)):
+        new_cost = np.full(remainder + 1, np.inf)
+        pick = np.zeros(remainder + 1, dtype=np.int64)
+        for k in range(remainder // q[i] + 1):
+            offset = k * q[i]
+            candidate = cost[:remainder + 1 - offset] + (base[i] + k - ideal[i]) ** 2 + jitter[i] * k
+            better = candidate < new_cost[offset:]
+            new_cost[offset:][better] = candidate[better]
+            pick[offset:][better] = k
+        cost = new_cost
+        picks.append(pick)
+    if not np.isfinite(cost[remainder]):
+        raise ValueError(f"Net charge {charge} cannot be cancelled exactly with charges {q.tolist()}")
+
+    counts, v = {}, remainder
+    for i in reversed(range(len(q))):
+        k = int(picks[i][v])
+        counts[species[i]['ion_name']] = int(base[i]) + k
+        v -= k * int(q[i])
+    return {ion['ion_name']: counts[ion['ion_name']] for ion in species}
+
+def ion_recipe(ion_params, system_charge, seed=0):
+    """
+    Number of ions of each species: the requested numbers plus the neutralizing ions
+    that cancel the system charge together with the requested ions.
+
+    The neutralizers are chosen for the needed sign only, as in the genion path: the
+    'additional_add' species of that sign, otherwise the first listed species of that sign.
+    """
+    ions = ion_params.get('ions', [])
+    counts = {ion['ion_name']: int(ion.get('number', 0)) for ion in ions}
+    total = system_charge + sum(ion['charge'] * ion.get('number', 0) for ion in ions)
+    if abs(total - round(total)) > 1e-3:
+        raise ValueError(f"System charge {total:.4f} is not an integer")
+    opposite = [ion for ion in ions if ion['charge'] * total < 0]
+    neutralizers = [ion for ion in opposite if ion.get('additional_add', False)] or opposite[:1]
+    for name, n in neutralizing_counts(int(round(total)), neutralizers, seed).items():
+        counts[name] += n
+    return counts
+
+def place_ions_native(system, molecule_counts, itp_files, sim_params, ion_params, solvent_name):
+    """
+    Adds ions by replacing randomly chosen solvent molecules, in one pass and without GROMACS.
+
+    The ion numbers come from ion_recipe, with the system charge summed from the
+    moleculetypes in itp_files. Solvent molecules are picked in a random order (seeded
+    with random_seed) and kept only if their first bead is at least 'ion_min_distance_nm'
+    (default 0.6, as genion -rmin) from every ion placed before. The ions are appended
+    after the rest of the system in the order of the ion list, with the atom names of their
+    moleculetype and the residue name 'ION', as the genion path writes them.
+
+    Args:
+        system (Structure): The solvated system.
+        molecule_counts (dict): The [ molecules ] counts of system, in order.
+        itp_files (list): .itp files defining every molecule of the system and the ions.
+
+    Returns:
+        tuple: (the ionized Structure, the updated molecule counts)
+
+    Raises:
+        KeyError: If a molecule or ion has no definition in itp_files.
+        ValueError, RuntimeError: If the charge cannot be neutralized or the ions do not fit.
+    """
+    from core_utils import cell_list
+    from core_utils.martini_parser import read_itp_definitions
+    from core_utils.structure import Structure
+
+    definitions = {}
+    for itp_file in itp_files:
+        definitions.update(read_itp_definitions(itp_file))
+    system_charge = sum(count * sum(bead['charge'] for bead in definitions[name]['beads'])
+                        for name, count in molecule_counts.items() if count > 0)
+    recipe = ion_recipe(ion_params, system_charge, sim_params.get('random_seed', 0))
+    print(f"시스템 전하: {system_charge:+.3f}, 추가할 이온: {recipe}")
+
+    for name, n in recipe.items():
+        if n > 0 and molecule_counts.get(name, 0) > 0:
+            raise ValueError(f"Ion '{name}' is already part of the system")
+    n_ions = sum(recipe.values())
+    solvent_atoms = np.flatnonzero(system.resname == solvent_name)
+    # First atom of every solvent molecule (consecutive atoms with the same residue number)
+    first = solvent_atoms[np.r_[True, (np.diff(solvent_atoms) != 1) | (np.diff(system.resid[solvent_atoms]) != 0)]]
+    if len(first) < n_ions:
+        raise RuntimeError(f"Only {len(first)} '{solvent_name}' molecules available for {n_ions} ions")
+
+    rng = np.random.default_rng(sim_params.get('random_seed', 0))
+    r_min = ion_params.get('ion_min_distance_nm', 0.6)
+    box = system.box
+    cells = cell_list.CellList(box, max(r_min, 1e-3), capacity=n_ions)
+    chosen = []
+    for site in rng.permutation(first):
+        if len(chosen) == n_ions:
+            break
+        p = np.mod(system.positions[site], box)
+        if r_min > 0 and cells.any_within(p, r_min)[0]:
+            continue
+        cells.add(p)
+        chosen.append(site)
+    if len(chosen) < n_ions:
+        raise RuntimeError(f"Placed only {len(chosen)} of {n_ions} ions {r_min} nm apart")
+    chosen = np.array(chosen, dtype=np.int64)
+
+    # Remove the whole solvent molecules of the chosen sites
+    molecule_of = np.searchsorted(first, solvent_atoms, side='right') - 1
+    removed = np.zeros(system.n_atoms, dtype=bool)
+    removed[solvent_atoms[np.isin(first[molecule_of], chosen)]] = True
+    kept = Structure(system.resid[~removed], system.resname[~removed], system.atomname[~removed],
+                     system.positions[~removed], box, system.title)
+
+    labels = np.repeat(list(recipe), list(recipe.values()))
+    positions = system.positions[chosen[rng.permutation(n_ions)]]
+    parts, counts = [kept], dict(molecule_counts)
+    counts[solvent_name] = counts.get(solvent_name, 0) - len(chosen)
+    next_resid = int(kept.resid.max()) + 1 if kept.n_atoms else 1
+    for name, n in recipe.items():
+        if n <= 0:
+            continue
+        if len(definitions[name]['beads']) != 1:
+            raise ValueError(f"Ion '{name}' has {len(definitions[name]['beads'])} beads; only single-bead ions are placed natively")
+        bead = definitions[name]['beads'][0]
+        parts.append(Structure(np.arange(next_resid, next_resid + n), ['ION'] * n, [bead['atom']] * n,
+                               positions[labels == name], box))
+        next_resid += n
+        counts[name] = n
+    ionized = Structure.concatenate(parts, box=box, title=system.title)
+    print(f"{len(chosen)}개의 '{solvent_name}' 분자를 이온으로 교체했습니다.")
+    return ionized, counts
@@ -1,11 +1,26 @@
 import os
-from config_params.read_json import Config
-from core_utils import packer, topology_updater
+
+import numpy as np
+
+from config_params.config import Config
+from core_utils import cell_list, packer, structure_io, topology_updater
+from core_utils.structure import Structure
+
+# Martini water: one W bead stands for four water molecules (72 amu), which puts
+# liquid water at about 8.36 beads per nm^3.
+MARTINI_WATER_DENSITY = 8.36
 
 def calculate_water_molecules(mode):
     """
     Calculates the number of water molecules to add based on the configuration.
+
+    Mode 'free_volume' returns None: the count is then taken from the free volume of
+    the system at the water packing step (see free_volume_water_count).
     """
+    if mode == 'free_volume':
+        print("Calculation mode: free_volume (water count determined from the free volume at packing time)")
+        return None
+
     # --- Constants from the original script ---
     MASS_MONOMER = 232
     MASS_BIS = (297+34)*2
@@ -39,4 +54,119 @@ def calculate_water_molecules(mode):
     print(f"Required water mass: {water_mass:.2f}")
     print(f"Number of water molecules to add: {n_water}")
 
-    return n_water
\ No newline at end of file
+    return n_water
+
+
+def free_volume_water_count(free_map, clearance, density=MARTINI_WATER_DENSITY, other_beads=0):
+    """
+    Number of water beads filling the volume at least `clearance` away from the system's
+    beads, less the volume of `other_beads` beads packed in the same pass (each taking
+    the volume of one water bead, 1 / density).
+    """
+    return max(int(free_map.accessible_volume(clearance) * density) - int(other_beads), 0)
+
+
+def water_lattice(box_size_nm, density=MARTINI_WATER_DENSITY):
+    """
+    Returns solvent sites on an fcc lattice filling a cubic periodic box at about the
+    given number density. The lattice constant is adjusted so that a whole number of
+    cells spans the box, which keeps the lattice seamless across the boundaries.
+    """
+    n_cells = max(1, int(round(box_size_nm / (4.0 / density) ** (1.0 / 3.0))))
+    a = box_size_nm / n_cells
+    basis = np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.0], [0.5, 0.0, 0.5], [0.0, 0.5, 0.5]]) + 0.25
+    grid = np.stack(np.meshgrid(*[np.arange(n_cells)] * 3, indexing='ij'), axis=-1).reshape(-1, 1, 3)
+    return ((grid + basis[None, :, :]) * a).reshape(-1, 3)
+
+
+def _solvent_box(template, box_size_nm, density):
+    """
+    Builds an over-filled solvent box: (positions, molecule index per bead, molecule
+    template, tiled). A template with several residues and a box is treated as a
+    pre-equilibrated solvent box and tiled; otherwise its first residue is placed on
+    the sites of water_lattice.
+    """
+    first = template.resid == template.resid[0]
+    molecule = Structure(template.resid[first], template.resname[first], template.atomname[first],
+                         template.positions[first], template.box, template.title)
+    n_per_molecule = molecule.n_atoms
+    tile_template = len(np.unique(template.resid)) > 1 and np.all(template.box > 0) and template.n_atoms % n_per_molecule == 0
+
+    if tile_template:
+        reps = np.ceil(box_size_nm / template.box).astype(int)
+        shifts = np.stack(np.meshgrid(*[np.arange(r) for r in reps], indexing='ij'), axis=-1).reshape(-1, 3) * template.box
+        positions = (template.positions[None, :, :] + shifts[:, None, :]).reshape(-1, 3)
+        # Only molecules whose first bead lies inside the box are kept.
+        n_molecules = len(positions) // n_per_molecule
+        inside = np.all(positions[::n_per_molecule] < box_size_nm, axis=1)
+        positions = positions.reshape(n_molecules, n_per_molecule, 3)[inside].reshape(-1, 3)
+    else:
+        sites = water_lattice(box_size_nm, density)
+        centred = molecule.positions - molecule.positions.mean(axis=0)
+        positions = (sites[:, None, :] + centred[None, :, :]).reshape(-1, 3)
+    molecule_index = np.repeat(np.arange(len(positions) // n_per_molecule), n_per_molecule)
+    return np.mod(positions, box_size_nm), molecule_index, molecule, tile_template
+
+
+def solvate_system(base_structure, n_water, box_size_nm, water_gro, sim_params, water_params, output_gro=None):
+    """
+    Native solvation: fills the free space around the base structure with n_water
+    solvent molecules without packmol.
+
+    An over-filled solvent box is built (see _solvent_box), every solvent molecule with
+    a bead closer than the cutoff to a bead of the base structure is carved out using a
+    periodic cell list, and a seeded random subset of the remaining molecules is kept.
+
+    Args:
+        base_structure (str or Structure): The system to solvate (e.g. the output of the
+            previous packing step).
+        n_water (int or None): Number of solvent molecules to add; None fills all the
+            free space.
+        box_size_nm (float): Edge length of the cubic box.
+        water_gro (str): Solvent template; a single molecule or a pre-equilibrated box.
+        sim_params (dict): Simulation parameters ('packmol_threshold', 'random_seed').
+        water_params (dict): add_water parameters; 'gel_cutoff_nm' (default
+            packmol_threshold in nm) and 'density' (beads per nm^3) are optional.
+        output_gro (str): Where to write the solvated system, if given.
+
+    Returns:
+        Structure: The solvated system, base first, then the solvent molecules.
+
+    Raises:
+        RuntimeError: If fewer than n_water molecules fit into the free space.
+    """
+    base = base_structure if isinstance(base_structure, Structure) else structure_io.read_structure(base_structure)
+    box = np.full(3, float(box_size_nm))
+    cutoff = float(water_params.get('gel_cutoff_nm', sim_params['packmol_threshold'] / 10.0))
+    density = float(water_params.get('density', MARTINI_WATER_DENSITY))
+
+    positions, molecule_index, molecule, tiled = _solvent_box(structure_io.read_gro(water_gro), box_size_nm, density)
+    n_molecules = molecule_index[-1] + 1 if len(molecule_index) else 0
+    print(f"Native solvation: {n_molecules} candidate solvent molecules ({'tiled template' if tiled else 'fcc lattice'}), "
+          f"cutoff {cutoff:.3f} nm")
+
+    rejected = np.zeros(n_molecules, dtype=bool)
+    if base.n_atoms:
+        clash = cell_list.within_cutoff(positions, np.mod(base.positions, box_size_nm), box, cutoff)
+        rejected[molecule_index[clash]] = True
+    if tiled:
+        # Tiles meet at the box faces without being periodic images of each other; beads
+        # of the same molecule are bonded and may be closer than the cutoff.
+        rejected[molecule_index[cell_list.overlapping_later(positions, box, cutoff, molecule_index)]] = True
+    available = np.flatnonzero(~rejected)
+    print(f"{len(available)} solvent molecules fit around the {base.n_atoms} beads of the base structure.")
+    if n_water is None:
+        n_water = len(available)
+    if len(available) < n_water:
+        raise RuntimeError(f"Only {len(available)} solvent molecules fit into the free volume, {n_water} requested")
+
+    rng = np.random.default_rng(sim_params.get('random_seed', 0))
+    chosen = np.sort(rng.choice(available, size=n_water, replace=False))
+    bead_rows = (chosen[:, None] * molecule.n_atoms + np.arange(molecule.n_atoms)[None, :]).ravel()
+
+    next_resid = int(base.resid.max()) + 1 if base.n_atoms else 1
+    solvent = molecule.replicate(n_water, first_resid=next_resid).with_positions(positions[bead_rows])
+    solvated = Structure.concatenate([base, solvent], box=box, title="Solvated system")
+    if output_gro:
+        structure_io.write_structure(output_gro, solvated)
+    return solvated
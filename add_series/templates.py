@@ -0,0 +1,112 @@
+import os
+import re
+
+# Rendering of the add_series data files (water.gro, water.itp and other solvent
+# templates) whose names are marked by placeholders such as *** and &&&.
+#
+# All placeholders of a file are substituted in a single regex pass. A field is the
+# placeholder together with the blanks on its padding side, so a value longer than the
+# placeholder takes up those blanks and the following columns stay where they are;
+# fields of fixed-column formats (GRO) also have a maximum width.
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# placeholder -> (value key, alignment '<' or '>', padded width, maximum width or None)
+GRO_FIELDS = {'***': ('name', '<', 3, 5)}
+ITP_FIELDS = {'***': ('name', '<', 3, None), '&&&': ('name', '>', 3, None)}
+
+# Solvent templates shipped with add_series: name -> (gro template, itp template)
+SOLVENT_TEMPLATES = {
+    'water': (os.path.join(TEMPLATE_DIR, 'water.gro'), os.path.join(TEMPLATE_DIR, 'water.itp')),
+}
+
+
+def _field_pattern(fields):
+    parts = []
+    for i, (token, (_, align, _, _)) in enumerate(fields.items()):
+        if align == '<':
+            parts.append(f"(?P<t{i}>{re.escape(token)})(?P<s{i}> *)")
+        else:
+            parts.append(f"(?P<s{i}> *)(?P<t{i}>{re.escape(token)})")
+    return re.compile("|".join(parts))
+
+
+def render_text(text, fields, values):
+    """
+    Substitutes every placeholder of `fields` in text.
+
+    Args:
+        fields (dict): placeholder -> (value key, '<' or '>', width, max width or None).
+        values (dict): value key -> string.
+
+    Raises:
+        KeyError: If a value is missing.
+        ValueError: If a value exceeds the maximum width of its field.
+    """
+    specs = list(fields.values())
+    for key, _, _, max_width in specs:
+        if max_width is not None and len(str(values[key])) > max_width:
+            raise ValueError(f"'{values[key]}' is longer than the {max_width} columns of its template field")
+
+    def _replace(match):
+        i = next(k for k in range(len(specs)) if match.group(f"t{k}") is not None)
+        key, align, width, _ = specs[i]
+        blanks = match.group(f"s{i}")
+        value = str(values[key])
+        padded = value.ljust(width) if align == '<' else value.rjust(width)
+        # Blanks between the field and neighbouring text shrink but never vanish.
+        if align == '<':
+            touches_text = match.end() < len(text) and text[match.end()] != '\n'
+        else:
+            touches_text = match.start() > 0 and text[match.start() - 1] != '\n'
+        rest = len(match.group(f"t{i}")) + len(blanks) - len(padded)
+        rest = max(rest, 1 if blanks and touches_text else 0)
+        return padded + " " * rest if align == '<' else " " * rest + padded
+
+    return _field_pattern(fields).sub(_replace, text)
+
+
+def render_template(template_path, output_path, fields, values, cache=None):
+    """
+    Writes the rendered template to output_path.
+
+    Args:
+        cache (ConversionCache): Serves renders of the same template content, fields and
+            values from the shared cache; None renders directly.
+
+    Returns:
+        str: output_path
+    """
+    def _render(src, dst):
+        with open(src, 'r') as f:
+            text = f.read()
+        with open(dst, 'w') as f:
+            f.write(render_text(text, fields, values))
+
+    if cache is None:
+        _render(template_path, output_path)
+    else:
+        params = {"fields": {token: list(spec) for token, spec in fields.items()}, "values": values}
+        cache.fetch_or_convert(template_path, output_path, 'template', params, _render)
+    return output_path
+
+
+def render_solvent(solvent_params, gro_path, itp_path, cache=None):
+    """
+    Renders the coordinate and topology templates of a solvent.
+
+    solvent_params may name a shipped template ('template', default 'water') or give
+    custom files ('template_gro', 'template_itp') using the same placeholders: *** for
+    the molecule and residue name (left-aligned) and &&& for the residue name in
+    [ atoms ] (right-aligned). The name is 'molecule_name' (default 'W').
+
+    Returns:
+        tuple: (gro_path, itp_path)
+    """
+    template_gro, template_itp = SOLVENT_TEMPLATES[solvent_params.get('template', 'water')]
+    template_gro = solvent_params.get('template_gro', template_gro)
+    template_itp = solvent_params.get('template_itp', template_itp)
+    values = {'name': solvent_params.get('molecule_name', 'W')}
+    render_template(template_gro, gro_path, GRO_FIELDS, values, cache)
+    render_template(template_itp, itp_path, ITP_FIELDS, values, cache)
+    return gro_path, itp_path
@@ -5,6 +5,24 @@ import json # Added for temporary config handling
 from config_params.read_json import Config
 from core_utils import polymer_generator
 
+def polymer_output_paths(output_dir, poly_gen_params):
+    """
+    Returns the (.gro paths, .itp paths) generate_polymer_only_from_config will write,
+    so callers can declare them before the generation runs.
+    """
+    num_polymers_to_generate = poly_gen_params['num_polymers']
+    output_gro_filename = poly_gen_params['polymer_output_gro_filename']
+    output_itp_filename = poly_gen_params['polymer_output_itp_filename']
+    if num_polymers_to_generate <= 1:
+        return [os.path.join(output_dir, output_gro_filename)], [os.path.join(output_dir, output_itp_filename)]
+
+    # 파일명에 고분자 인덱스 추가
+    base_gro, ext_gro = os.path.splitext(output_gro_filename)
+    base_itp, ext_itp = os.path.splitext(output_itp_filename)
+    gro_paths = [os.path.join(output_dir, f"{base_gro}_{i+1}{ext_gro}") for i in range(num_polymers_to_generate)]
+    itp_paths = [os.path.join(output_dir, f"{base_itp}_{i+1}{ext_itp}") for i in range(num_polymers_to_generate)]
+    return gro_paths, itp_paths
+
 def generate_polymer_only_from_config(sim_params, poly_gen_params, monomer_definitions):
     print(f"\n--- 단일 고분자 .gro 및 .itp 파일 생성 시작 (전달된 파라미터 기반) ---\n")
 
@@ -22,19 +40,9 @@ def generate_polymer_only_from_config(sim_params, poly_gen_params, monomer_defin
     generated_gro_paths = []
     generated_itp_paths = []
 
-    for i in range(num_polymers_to_generate):
+    output_paths = polymer_output_paths(output_dir, poly_gen_params)
+    for i, (indexed_output_gro_path, indexed_output_itp_path) in enumerate(zip(*output_paths)):
         print(f"고분자 {i+1}/{num_polymers_to_generate} 생성 중...")
-        
-        # 파일명에 고분자 인덱스 추가
-        if num_polymers_to_generate > 1:
-            base_gro, ext_gro = os.path.splitext(output_gro_filename)
-            indexed_output_gro_path = os.path.join(output_dir, f"{base_gro}_{i+1}{ext_gro}")
-            
-            base_itp, ext_itp = os.path.splitext(output_itp_filename)
-            indexed_output_itp_path = os.path.join(output_dir, f"{base_itp}_{i+1}{ext_itp}")
-        else:
-            indexed_output_gro_path = os.path.join(output_dir, output_gro_filename)
-            indexed_output_itp_path = os.path.join(output_dir, output_itp_filename)
 
         # polymer_generator.generate_single_polymer_gro는 output_filename에서 itp_filename을 유추하므로
         # output_gro_filename만 전달하면 됩니다.
@@ -1,15 +1,21 @@
 import json
-import glob
 import os
 import sys
 import shutil
 import random
-from core_utils import packer, topology_updater
-from core_utils.writer import write_to_gro, write_to_itp
-from add_series import add_small_ion
+from core_utils import conversion_cache, free_volume, martini_library, packer, pipeline, structure_io, tool_runner, topology_summary, topology_updater
+from core_utils.structure import Structure
+from core_utils.writer import write_to_gro, write_to_itp, verify_itp_parameters
+from add_series import add_small_ion, templates
 
 from config_params.config import Config
 
+# simulation_parameters keys that determine the built hydrogel and the packing steps;
+# used to slice the config for the stage fingerprints.
+_HYDROGEL_SIM_KEYS = ('segment_length', 'mean_sep', 'number_of_cells', 'pbc_true_or_false', 'number_of_slices', 'random_seed', 'overlap_check_limit',
+                      'itp_parameter_macros', 'verify_itp_parameters', 'checkpoint_format')
+_PACKING_SIM_KEYS = ('packmol_threshold', 'random_seed', 'mean_sep', 'structure_converter', 'checkpoint_format')
+
 def replace_in_file(file_path, old_str, new_str,margin="left"):
     # 파일 읽어들이기
     fr = open(file_path, 'r')
@@ -37,23 +43,81 @@ def execute_mode():
     else:
         print(f"알 수 없는 모드 또는 이 스크립트에서 직접 실행 미지원: {mode}")
 
-def _run_packing_step(step_name, base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params):
+def _run_packing_step(step_name, base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params, engine='packmol', engine_params=None):
     """
-    A helper function to run a single step of packing with packmol.
+    A helper function to run a single step of packing.
+
+    base_structure_gro may be a path or the Structure returned by the previous step.
+    Returns the packed Structure, for the next step, and the number of molecules added
+    per entry of molecules_to_add.
+
+    engine selects how the molecules are placed: 'packmol', 'insert' for the native
+    rigid-body insertion of packer.insert_molecules, or 'solvate' for the native
+    solvation of add_series.add_water (a single solvent entry in molecules_to_add,
+    engine_params are the add_water parameters). The native engines fall back to
+    packmol if the molecules do not fit.
+
+    With simulation_parameters.free_volume_check (default false), a free-volume map of
+    the base structure is built first and requests above its close-packing estimate are
+    reported. A solvent entry with number None is filled to the free volume.
     """
-    print(f"\n--- Packmol 실행 단계: {step_name} ---")
-    
-    # Use the centralized packer function
-    packer.pack_system_with_molecules(
-        base_structure_gro=base_structure_gro,
-        molecules_to_add=molecules_to_add,
-        final_output_gro=final_output_gro,
-        box_size_nm=box_size_nm,
-        sim_params=sim_params
-    )
-    
+    from add_series import add_water
+    print(f"\n--- Packmol 실행 단계: {step_name} (engine: {engine}) ---")
+    engine_params = engine_params or {}
+
+    base = base_structure_gro if isinstance(base_structure_gro, Structure) else structure_io.read_structure(base_structure_gro)
+    tolerance = sim_params['packmol_threshold'] / 10.0
+    fill = any(mol['number'] is None for mol in molecules_to_add)
+    free_map = None
+    free_volume_check = sim_params.get('free_volume_check', False)
+    if free_volume_check or fill:
+        free_map = free_volume.FreeVolumeMap(base.positions, [box_size_nm] * 3, spacing=sim_params.get('free_volume_spacing_nm', 0.1))
+        species = [(os.path.basename(mol['file']), structure_io.read_gro(mol['file']).n_atoms, mol['number']) for mol in molecules_to_add]
+        if free_volume_check:
+            free_volume.check_packing_feasibility(free_map, species, tolerance)
+
+    packed, numbers = None, None
+    if engine == 'solvate':
+        solvent = molecules_to_add[0]
+        try:
+            packed = add_water.solvate_system(
+                base, solvent['number'], box_size_nm, solvent['file'],
+                sim_params, engine_params, output_gro=final_output_gro
+            )
+            numbers = [len(set(packed.resid[base.n_atoms:].tolist()))]
+        except RuntimeError as e:
+            print(f"경고: native solvation 실패 ({e}), packmol로 대체합니다.", file=sys.stderr)
+
+    if packed is None and fill:
+        # The free-volume map holds only the base: the other molecules of this pass take their share of it.
+        other_beads = sum(n_beads * number for _, n_beads, number in species if number is not None)
+        water_count = add_water.free_volume_water_count(
+            free_map, engine_params.get('gel_cutoff_nm', tolerance), engine_params.get('density', add_water.MARTINI_WATER_DENSITY),
+            other_beads
+        )
+        print(f"자유 부피 기준 물 분자 수: {water_count}")
+        molecules_to_add = [dict(mol, number=water_count) if mol['number'] is None else mol for mol in molecules_to_add]
+
+    if packed is None and engine == 'insert':
+        try:
+            packed = packer.insert_molecules(base, molecules_to_add, final_output_gro, box_size_nm, sim_params)
+        except RuntimeError as e:
+            print(f"경고: native insertion 실패 ({e}), packmol로 대체합니다.", file=sys.stderr)
+
+    if packed is None:
+        # Use the centralized packer function
+        packed = packer.pack_system_with_molecules(
+            base_structure_gro=base,
+            molecules_to_add=molecules_to_add,
+            final_output_gro=final_output_gro,
+            box_size_nm=box_size_nm,
+            sim_params=sim_params
+        )
+
+    if numbers is None:
+        numbers = [mol['number'] for mol in molecules_to_add]
     print(f"단계 '{step_name}' 완료. 결과 파일: {final_output_gro}")
-    return final_output_gro
+    return packed, numbers
 
 def _create_single_ion_gro(ion_name, output_dir):
     """
@@ -66,9 +130,69 @@ def _create_single_ion_gro(ion_name, output_dir):
     print(f"생성된 단일 이온 파일: {gro_path}")
     return gro_path
 
+def _insertion_engine(step_params):
+    """Packing engine of an add_polymer/add_molecule step: 'engine' is 'packmol' (default) or 'native'."""
+    return 'insert' if step_params.get('engine', 'packmol') == 'native' else 'packmol'
+
+def _validate_topology(top_path, structure, sim_params):
+    """
+    Summarizes the topology (a .top path or an in-memory Topology) natively and checks
+    it against the structure (ValueError on a missing molecule or atom-count mismatch;
+    differing atom names are only reported, as grompp does).
+    """
+    include_dirs = [d for d in [sim_params.get('gromacs_include_path')] + os.environ.get('GMXLIB', '').split(os.pathsep) if d]
+    summary = topology_summary.summarize_topology(top_path, include_dirs)
+    summary.report()
+    try:
+        warnings = topology_summary.validate_structure(summary, structure)
+    except ValueError as e:
+        print(f"오류: 토폴로지 '{getattr(top_path, 'path', top_path)}'와 좌표가 일치하지 않습니다: {e}", file=sys.stderr)
+        raise
+    for warning in warnings:
+        print(f"경고: {warning}", file=sys.stderr)
+    print("토폴로지와 좌표 일치 확인 완료.")
+
+def _flatten_paths(items):
+    """Flattens the (possibly nested) lists of .itp paths collected for the topology."""
+    paths = []
+    for item in items or []:
+        if isinstance(item, (list, tuple)):
+            paths.extend(_flatten_paths(item))
+        elif isinstance(item, str):
+            paths.append(item)
+    return paths
+
+def _config_slice(*keys):
+    """Returns a configuration sub-tree for stage fingerprints, or None if it is absent (pipeline.Stage snapshots it)."""
+    try:
+        return Config.get_param(*keys)
+    except KeyError:
+        return None
+
+def _generate_polymers_stage(upstream):
+    """
+    Workflow stage: pre-generates the polymers for 'add_polymer'.
+
+    Runs in a separate process because polymer generation resets the global World
+    state that the concurrently running hydrogel build is using.
+    """
+    from config_params import make_polymer_only
+    sim_params = Config.get_param('simulation_parameters')
+    poly_params = Config.get_param('add_series_parameters', 'add_polymer')
+    print("\n--- 고분자 사전 생성 시작 ---")
+    generated_gro_paths, generated_itp_paths = make_polymer_only.generate_polymer_only_from_config(sim_params, poly_params, Config.get_param('monomer_definitions'))
+    return {"generated_gro_paths": generated_gro_paths, "generated_itp_paths": generated_itp_paths}
+
 def _execute_all_mode():
     """
-    Executes the full workflow with sequential packing and genion.
+    Executes the full workflow as a graph of stages.
+
+    Stages declare their input and output files; core_utils.pipeline derives the
+    dependencies from them and runs independent stages (polymer pre-generation, input
+    preparation and PDB conversion) concurrently with the hydrogel build. Every stage is
+    recorded in a stage manifest together with the fingerprint of its inputs, so a rerun
+    in the same output directory skips every stage whose config slice, upstream files
+    and tools are unchanged.
     """
     from config_params import build_hydrogel, make_polymer_only
     
@@ -76,19 +200,60 @@ def _execute_all_mode():
     sim_params = Config.get_param('simulation_parameters')
     output_dir = sim_params['output_dir']
     os.makedirs(output_dir, exist_ok=True)
+    gmx_path = sim_params.get('gromacs_executable_path') or 'gmx_mpi'
+    packmol_path = sim_params.get('packmol_path')
+    # Format conversions only need GROMACS when the editconf route is selected.
+    converter = sim_params.get('structure_converter', packer.DEFAULT_STRUCTURE_CONVERTER)
+    conversion_tools = [gmx_path] if converter == 'gmx' else []
+    cache = conversion_cache.from_sim_params(sim_params)
+    if sim_params.get('max_concurrent_tools'):
+        tool_runner.set_max_concurrent_tools(sim_params['max_concurrent_tools'])
+    manifest = pipeline.StageManifest(output_dir, enabled=sim_params.get('resume_from_manifest', True))
+    stages = []
+
+    # Structures written as stage checkpoints (initial hydrogel, each packing step) use
+    # checkpoint_format: 'gro' (default), 'g96', 'npz', optionally compressed as in
+    # 'gro.gz' or 'g96.zst'. The final system is always written as plain .gro for GROMACS.
+    checkpoint_format = sim_params.get('checkpoint_format') or 'gro'
+
+    if structure_io.structure_format("checkpoint." + checkpoint_format.lstrip('.')) not in ('.gro', '.g96', '.npz'):
+        raise ValueError(f"Unsupported checkpoint_format '{checkpoint_format}' (gro, g96 or npz, optionally .gz/.zst)")
+
+    def _checkpoint(name):
+        return os.path.join(output_dir, f"{name}.{checkpoint_format.lstrip('.')}")
 
     # 1. Initial hydrogel generation
-    hydrogel_world = build_hydrogel.main()
-    current_gro_file = os.path.join(output_dir, "initial_hydrogel.gro")
+    initial_gro = _checkpoint("initial_hydrogel")
     initial_itp = os.path.join(output_dir, "initial_hydrogel.itp")
-    write_to_gro(hydrogel_world, filename=current_gro_file)
-    write_to_itp(hydrogel_world, filename=initial_itp, moleculetype_name="HYDROGEL")
-    print(f"성공적으로 초기 하이드로젤 파일 생성: {current_gro_file}, {initial_itp}")
+    previous_packing_stage = "build_hydrogel"
 
-    try:
-        itp_files_to_include = glob.glob(os.path.join(Config.get_param('simulation_parameters').get('martini_itp_default_directory'), "**", "*.itp"), recursive=True)
-    except KeyError:
-        itp_files_to_include = []
+    def _build_hydrogel_stage(upstream):
+        hydrogel_world = build_hydrogel.main()
+        write_to_gro(hydrogel_world, filename=initial_gro)
+        # itp_parameter_macros: identical bond/angle/... parameter sets are written once as
+        # #define macros, which shrinks the .itp that every grompp call preprocesses. The
+        # result is checked against the explicit parameters unless verify_itp_parameters is false.
+        parameter_macros = sim_params.get('itp_parameter_macros', False)
+        write_to_itp(hydrogel_world, filename=initial_itp, moleculetype_name="HYDROGEL", parameter_macros=parameter_macros)
+        if parameter_macros and sim_params.get('verify_itp_parameters', True):
+            verify_itp_parameters(hydrogel_world, initial_itp, moleculetype_name="HYDROGEL")
+        print(f"성공적으로 초기 하이드로젤 파일 생성: {initial_gro}, {initial_itp}")
+        return {"box_size_nm": hydrogel_world.box_length}
+
+    hydrogel_config = {
+        "simulation_parameters": {k: sim_params.get(k) for k in _HYDROGEL_SIM_KEYS},
+        "hydrogel_components": _config_slice('hydrogel_components'),
+        "monomer_definitions": _config_slice('monomer_definitions'),
+    }
+    stages.append(pipeline.Stage(
+        "build_hydrogel", _build_hydrogel_stage, outputs=[initial_gro, initial_itp], config_slice=hydrogel_config
+    ))
+    current_gro_file = initial_gro
+
+    # The .itp files of the force-field directory come from its persistent index, which
+    # only rescans files changed since the last run.
+    martini_dir = sim_params.get('martini_itp_default_directory')
+    itp_files_to_include = martini_library.open_library(martini_dir).files if martini_dir else []
 
     try:
         itp_files_to_include.append(Config.get_param('additional_itp_files'))
@@ -97,8 +262,14 @@ def _execute_all_mode():
         
     itp_files_to_include.append(initial_itp)
     molecule_counts_for_top = {"HYDROGEL": 1}
-    box_size_nm = hydrogel_world.box_length
-    sim_params['box_size_nm'] = box_size_nm # Save for later steps
+    packing_config = {k: sim_params.get(k) for k in _PACKING_SIM_KEYS}
+
+    # With combined_packing the polymer, molecule and water additions are collected and
+    # packed by a single packmol run instead of one run per species.
+    combined_packing = sim_params.get('combined_packing', False)
+    combined_molecules, combined_inputs, combined_configs = [], [], {}
+    # (stage, entry) whose packed number is the solvent count of the topology
+    water_count_source = None
     
     
     try:
@@ -106,44 +277,81 @@ def _execute_all_mode():
     except:
         add_series_params = []
 
-    # --- Sequential Packing Steps ---
+    # Packed systems handed from one packing stage to the next without re-reading them.
+    # The .gro files are still written as the stage checkpoints used for resuming.
+    packed_systems = {}
+
+    def _packing_stage(step_name, base_gro, molecules_to_add, output_gro, engine='packmol', engine_params=None):
+        def _stage(upstream):
+            box_size_nm = upstream["build_hydrogel"]["box_size_nm"]
+            sim_params['box_size_nm'] = box_size_nm # Save for later steps
+            molecules = molecules_to_add(upstream) if callable(molecules_to_add) else molecules_to_add
+            base = packed_systems.get(base_gro, base_gro)
+            packed_systems[output_gro], numbers = _run_packing_step(step_name, base, molecules, output_gro, box_size_nm, sim_params, engine, engine_params)
+            return {"numbers": numbers}
+        return _stage
+
+    # --- Sequential Packing Steps (their inputs are prepared concurrently) ---
 
     # 2. Add Polymer
     if 'add_polymer' in add_series_params and add_series_params['add_polymer'].get('num_polymers', 0) > 0:
         poly_params = add_series_params['add_polymer']
+        packed_after_poly_gro = _checkpoint("packed_after_polymer")
+        poly_config = {
+            "add_polymer": poly_params, "packing": packing_config,
+            "polymer_components": _config_slice('polymer_components'),
+            "monomer_definitions": _config_slice('monomer_definitions'),
+        }
         if poly_params.get('generation_mode') == 'generate':
-            print("\n--- 고분자 사전 생성 시작 ---")
-            generated_gro_paths, generated_itp_paths = make_polymer_only.generate_polymer_only_from_config(sim_params, poly_params, Config.get_param('monomer_definitions'))
+            generated_gro_paths, generated_itp_paths = make_polymer_only.polymer_output_paths(output_dir, poly_params)
+            stages.append(pipeline.Stage(
+                "generate_polymer", _generate_polymers_stage, outputs=generated_gro_paths + generated_itp_paths,
+                config_slice=poly_config, executor='process'
+            ))
             poly_params['polymer_source_file'] = generated_gro_paths[0]
             itp_files_to_include.extend(generated_itp_paths)
 
         poly_source_gro = poly_params['polymer_source_file']
         poly_dest_gro = os.path.join(output_dir, os.path.basename(poly_source_gro))
-        if os.path.abspath(poly_source_gro) != os.path.abspath(poly_dest_gro):
-            shutil.copy(poly_source_gro, poly_dest_gro)
-        
-        molecules_to_add = [{"file": poly_dest_gro, "number": poly_params['num_polymers']}]
-        packed_after_poly_gro = os.path.join(output_dir, "packed_after_polymer.gro")
-        
-        current_gro_file = _run_packing_step(
-            "Add_Polymer", current_gro_file, molecules_to_add, packed_after_poly_gro, box_size_nm, sim_params
-        )
+        poly_dest_pdb = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(poly_source_gro))[0]}.pdb")
+
+        def _prepare_polymer_stage(upstream):
+            if os.path.abspath(poly_source_gro) != os.path.abspath(poly_dest_gro):
+                shutil.copy(poly_source_gro, poly_dest_gro)
+            packer.convert_gro_to_pdb(poly_dest_gro, poly_dest_pdb, gmx_path, converter, cache)
+            return {}
+
+        stages.append(pipeline.Stage(
+            "prepare_polymer", _prepare_polymer_stage, inputs=[poly_source_gro],
+            outputs=list(dict.fromkeys([poly_dest_gro, poly_dest_pdb])), config_slice=poly_config, tools=conversion_tools
+        ))
+        molecules_to_add = [{"file": poly_dest_gro, "pdb": poly_dest_pdb, "number": poly_params['num_polymers']}]
+        if combined_packing:
+            combined_molecules.extend(molecules_to_add)
+            combined_inputs.extend([poly_dest_gro, poly_dest_pdb])
+            combined_configs["add_polymer"] = poly_config
+        else:
+            stages.append(pipeline.Stage(
+                "add_polymer", _packing_stage("Add_Polymer", current_gro_file, molecules_to_add, packed_after_poly_gro, _insertion_engine(poly_params)),
+                inputs=[current_gro_file, poly_dest_gro, poly_dest_pdb], outputs=[packed_after_poly_gro],
+                config_slice=poly_config, tools=conversion_tools + [packmol_path], after=sorted({"build_hydrogel", previous_packing_stage})
+            ))
+            current_gro_file = packed_after_poly_gro
+            previous_packing_stage = "add_polymer"
         molecule_counts_for_top[poly_params['molecule_name']]= molecule_counts_for_top.get(poly_params['molecule_name'], 0) + poly_params['num_polymers']
 
     # 3. Add Molecule
     if 'add_molecule' in add_series_params and add_series_params['add_molecule'].get('num_molecules', 0) > 0:
         mol_params = add_series_params['add_molecule']
         mol_source = mol_params['molecule_gro']
-        
+        mol_config = {"add_molecule": mol_params, "packing": packing_config}
+
         if mol_source.endswith('.xyz'):
-            gro_filename = f"{os.path.splitext(os.path.basename(mol_source))[0]}.gro"
-            mol_source_gro = packer.convert_xyz_to_gro(mol_source, os.path.join(output_dir, gro_filename), sim_params.get('gromacs_executable_path') or 'gmx_mpi', molecule_name=mol_params['molecule_name'])
+            mol_source_gro = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(mol_source))[0]}.gro")
         else:
             mol_source_gro = mol_source
-
         mol_dest_gro = os.path.join(output_dir, os.path.basename(mol_source_gro))
-        if os.path.abspath(mol_source_gro) != os.path.abspath(mol_dest_gro):
-            shutil.copy(mol_source_gro, mol_dest_gro)
+        mol_dest_pdb = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(mol_source_gro))[0]}.pdb")
 
         # Find and include the ITP file for the molecule
         itp_path_to_add = None
@@ -159,59 +367,122 @@ def _execute_all_mode():
                 itp_path_to_add = potential_itp_path
                 print(f"자동으로 분자 ITP 파일을 감지했습니다: {itp_path_to_add}")
 
+        itp_dest = None
         if itp_path_to_add:
             itp_dest = os.path.join(output_dir, os.path.basename(itp_path_to_add))
-            if os.path.abspath(itp_path_to_add) != os.path.abspath(itp_dest):
-                shutil.copy(itp_path_to_add, itp_dest)
             itp_files_to_include.append(itp_dest)
             print(f"분자 ITP 파일 추가: {itp_dest}")
         else:
             print(f"경고: 분자 '{mol_params['molecule_name']}'의 ITP 파일을 찾을 수 없습니다. grompp 단계에서 오류가 발생할 수 있습니다.")
 
-        molecules_to_add = [{"file": mol_dest_gro, "number": mol_params['num_molecules']}]
-        packed_after_mol_gro = os.path.join(output_dir, "packed_after_molecule.gro")
+        def _prepare_molecule_stage(upstream):
+            if mol_source.endswith('.xyz'):
+                packer.convert_xyz_to_gro(mol_source, mol_source_gro, gmx_path, molecule_name=mol_params['molecule_name'])
+            if os.path.abspath(mol_source_gro) != os.path.abspath(mol_dest_gro):
+                shutil.copy(mol_source_gro, mol_dest_gro)
+            if itp_dest and os.path.abspath(itp_path_to_add) != os.path.abspath(itp_dest):
+                shutil.copy(itp_path_to_add, itp_dest)
+            packer.convert_gro_to_pdb(mol_dest_gro, mol_dest_pdb, gmx_path, converter, cache)
+            return {}
 
-        current_gro_file = _run_packing_step(
-            "Add_Molecule", current_gro_file, molecules_to_add, packed_after_mol_gro, box_size_nm, sim_params
-        )
+        stages.append(pipeline.Stage(
+            "prepare_molecule", _prepare_molecule_stage, inputs=[mol_source] + ([itp_path_to_add] if itp_path_to_add else []),
+            outputs=list(dict.fromkeys([mol_dest_gro, mol_dest_pdb] + ([itp_dest] if itp_dest else []))),
+            config_slice=mol_config, tools=conversion_tools
+        ))
+        molecules_to_add = [{"file": mol_dest_gro, "pdb": mol_dest_pdb, "number": mol_params['num_molecules']}]
+        packed_after_mol_gro = _checkpoint("packed_after_molecule")
+        if combined_packing:
+            combined_molecules.extend(molecules_to_add)
+            combined_inputs.extend([mol_dest_gro, mol_dest_pdb])
+            combined_configs["add_molecule"] = mol_config
+        else:
+            stages.append(pipeline.Stage(
+                "add_molecule", _packing_stage("Add_Molecule", current_gro_file, molecules_to_add, packed_after_mol_gro, _insertion_engine(mol_params)),
+                inputs=[current_gro_file, mol_dest_gro, mol_dest_pdb], outputs=[packed_after_mol_gro],
+                config_slice=mol_config, tools=conversion_tools + [packmol_path], after=sorted({"build_hydrogel", previous_packing_stage})
+            ))
+            current_gro_file = packed_after_mol_gro
+            previous_packing_stage = "add_molecule"
         molecule_counts_for_top[mol_params['molecule_name']] = molecule_counts_for_top.get(mol_params['molecule_name'], 0) + mol_params['num_molecules']
     watername = "W"
     # 4. Add Water
     if 'add_water' in add_series_params:
         water_params = add_series_params['add_water']
         watername = water_params.get('molecule_name',"W")
-        # Use calculate_water_molecules if available, otherwise use a default
-        try:
-            from add_series.add_water import calculate_water_molecules
-            n_water = calculate_water_molecules(water_params.get('mode', 'full'))
-        except (ImportError, KeyError):
-            n_water = water_params.get('number_of_water', 10000) # Fallback
-            print(f"Could not calculate water molecules, using fallback value: {n_water}")
-
-        water_source_gro = os.path.join(os.path.dirname(__file__), '..', 'add_series', 'water.gro')
+        # 'packmol' (default) packs the solvent; 'native' tiles it around the gel (add_water.solvate_system).
+        water_engine = 'solvate' if water_params.get('engine', 'packmol') == 'native' else 'packmol'
+        water_source_gro, water_source_itp = templates.SOLVENT_TEMPLATES[water_params.get('template', 'water')]
+        water_source_gro = water_params.get('template_gro', water_source_gro)
+        water_source_itp = water_params.get('template_itp', water_source_itp)
         water_dest_gro = os.path.join(output_dir, f'{watername}.gro') # <--- This is the problem for GRO
-        if os.path.abspath(water_source_gro) != os.path.abspath(water_dest_gro):
-            shutil.copy(water_source_gro, water_dest_gro)
-        replace_in_file(water_dest_gro,"***",watername,margin="right")
-        molecules_to_add = [{"file": water_dest_gro, "number": n_water}]
-        packed_after_water_gro = os.path.join(output_dir, "packed_after_water.gro")
-
-        current_gro_file = _run_packing_step(
-            "Add_Water", current_gro_file, molecules_to_add, packed_after_water_gro, box_size_nm, sim_params
-        )
-        molecule_counts_for_top[water_params['molecule_name']] = n_water
-
-        # Reconstruct and add the water ITP file path to the list of includes for the final topology
-        water_source_itp = os.path.join(os.path.dirname(__file__), '..', 'add_series', 'water.itp')
+        water_dest_pdb = os.path.join(output_dir, f'{watername}.pdb')
         water_dest_itp = os.path.join(output_dir, f'{watername}.itp') # <--- This is the problem for GRO
-        if os.path.abspath(water_source_itp) != os.path.abspath(water_dest_itp):
-            shutil.copy(water_source_itp, water_dest_itp)
-        replace_in_file(water_dest_itp,"***",watername,margin="right")
-        replace_in_file(water_dest_itp,"&&&",watername,margin="left")
+        packed_after_water_gro = _checkpoint("packed_after_water")
+        water_config = {
+            "add_water": water_params, "packing": packing_config,
+            "water_count": {k: sim_params.get(k) for k in ('segment_length', 'gel_weight_fraction', 'number_of_cells')},
+        }
+
+        def _prepare_water_stage(upstream):
+            # Use calculate_water_molecules if available, otherwise use a default
+            try:
+                from add_series.add_water import calculate_water_molecules
+                n_water = calculate_water_molecules(water_params.get('mode', 'full'))
+            except (ImportError, KeyError):
+                n_water = water_params.get('number_of_water', 10000) # Fallback
+                print(f"Could not calculate water molecules, using fallback value: {n_water}")
+
+            # Water GRO and ITP (for the final topology) rendered from the solvent templates
+            templates.render_solvent(water_params, water_dest_gro, water_dest_itp, cache)
+            packer.convert_gro_to_pdb(water_dest_gro, water_dest_pdb, gmx_path, converter, cache)
+            return {"n_water": n_water}
+
+        stages.append(pipeline.Stage(
+            "prepare_water", _prepare_water_stage, inputs=[water_source_gro, water_source_itp],
+            outputs=[water_dest_gro, water_dest_pdb, water_dest_itp], config_slice=water_config, tools=conversion_tools
+        ))
+
+        def _water_to_add(upstream):
+            return [{"file": water_dest_gro, "pdb": water_dest_pdb, "number": upstream["prepare_water"]["n_water"]}]
+
+        if combined_packing:
+            water_count_source = ("pack_combined", len(combined_molecules))
+            combined_molecules.append(_water_to_add)
+            combined_inputs.extend([water_dest_gro, water_dest_pdb])
+            combined_configs["add_water"] = water_config
+        else:
+            water_count_source = ("add_water", 0)
+            stages.append(pipeline.Stage(
+                "add_water", _packing_stage("Add_Water", current_gro_file, _water_to_add, packed_after_water_gro, water_engine, water_params), inputs=[current_gro_file, water_dest_gro, water_dest_pdb],
+                outputs=[packed_after_water_gro], config_slice=water_config, tools=conversion_tools + [packmol_path],
+                after=sorted({"build_hydrogel", "prepare_water", previous_packing_stage})
+            ))
+            current_gro_file = packed_after_water_gro
+            previous_packing_stage = "add_water"
 
         if watername != "W":
             itp_files_to_include.append(water_dest_itp)
 
+    # 4b. Single packmol pass for all collected additions, in the sequential order
+    if combined_molecules:
+        packed_combined_gro = _checkpoint("packed_combined")
+
+        def _combined_to_add(upstream):
+            molecules = []
+            for entry in combined_molecules:
+                molecules.extend(entry(upstream) if callable(entry) else [entry])
+            return molecules
+
+        stages.append(pipeline.Stage(
+            "pack_combined", _packing_stage("Add_Combined", current_gro_file, _combined_to_add, packed_combined_gro, 'packmol', water_params if 'add_water' in combined_configs else None),
+            inputs=[current_gro_file] + combined_inputs, outputs=[packed_combined_gro],
+            config_slice=combined_configs, tools=conversion_tools + [packmol_path],
+            after=sorted({"build_hydrogel", previous_packing_stage} | ({"prepare_water"} if 'add_water' in combined_configs else set()))
+        ))
+        current_gro_file = packed_combined_gro
+        previous_packing_stage = "pack_combined"
+
     # 5. Create topology for genion AND final topology
     if 'add_small_ion' in add_series_params and add_series_params['add_small_ion'].get('additional_ion_itp_files'):
         itp_ion_add_list = add_series_params['add_small_ion'].get('additional_ion_itp_files')
@@ -222,34 +493,112 @@ def _execute_all_mode():
         if itp_files_to_include[i] != []:
             final_itp.append(itp_files_to_include[i])
     final_top_path = os.path.join(output_dir, "system.top")
-    print(f"\n--- 최종 토폴로지 파일 생성 중: {final_top_path} ---")
-    print(f"ITP files to include in topology: {final_itp}")
-    
-    topology_updater.create_system_topology(output_dir, final_top_path, final_itp)
-    
-    topology_updater.update_topology_molecules(final_top_path, molecule_counts_for_top)
-    print("이온 추가 전 토폴로지 업데이트 완료.")
-
-    # 6. Add Ions using GROMACS genion
-    if 'add_small_ion' in add_series_params and add_series_params['add_small_ion'].get('ions'):
-        ion_config = add_series_params['add_small_ion']
-        # The function expects a flat dictionary, so we prepare one.
-        ion_params_for_function = ion_config.copy()
-
-        final_gro_path = os.path.join(output_dir, "final_system")
-
-        # Call the refactored genion function
-        add_small_ion.run_genion_for_neutralization(
-            input_gro=current_gro_file,
-            output_gro=final_gro_path,
-            topology_file=final_top_path, # genion will read and update this file
-            sim_params=sim_params,
-            ion_params=ion_params_for_function,
-            solvent_name=watername
-        )
-        current_gro_file = final_gro_path
-    else:
-        # If no ions are added, the last .gro file is the final one.
-        shutil.copy(current_gro_file, os.path.join(output_dir, "final_system.gro"))
+    add_ions = 'add_small_ion' in add_series_params and add_series_params['add_small_ion'].get('ions')
+    final_gro_path = os.path.join(output_dir, "final_system")
+    final_outputs = [final_top_path, f"{final_gro_path}_end.gro" if add_ions else f"{final_gro_path}.gro"]
+
+    # The topology is written here and then mutated in place by genion, so both steps
+    # form a single stage; it is cheap to redo compared with the packing stages.
+    def _topology_and_ions_stage(upstream, input_gro=current_gro_file):
+        if "prepare_water" in upstream:
+            molecule_counts_for_top[watername] = upstream["prepare_water"]["n_water"]
+        if water_count_source and upstream.get(water_count_source[0], {}).get("numbers"):
+            # Filled to the free volume: the count is known only after packing.
+            molecule_counts_for_top[watername] = upstream[water_count_source[0]]["numbers"][water_count_source[1]]
+        print(f"\n--- 최종 토폴로지 파일 생성 중: {final_top_path} ---")
+        top_itps = _flatten_paths(_config_slice('additional_itp_files')) + _flatten_paths(final_itp)
+        if sim_params.get('prune_topology_includes', True):
+            # Only the files defining the molecules of this system (and the force-field
+            # parameters) are included, so grompp does not preprocess the whole library.
+            required = [name for name, count in molecule_counts_for_top.items() if count > 0]
+            if add_ions:
+                required += [ion['ion_name'] for ion in add_series_params['add_small_ion']['ions']]
+            library = martini_library.open_library(martini_dir) if martini_dir else None
+            top_itps, reasons, pruned, missing = topology_updater.select_topology_includes(top_itps, required, library)
+            topology_updater.print_include_report(top_itps, reasons, pruned, missing)
+        print(f"ITP files to include in topology: {top_itps}")
+
+        # The topology is kept in memory and written once, after the ion counts are known.
+        topology = topology_updater.create_system_topology(output_dir, final_top_path, top_itps, write=False)
+        topology.set_molecules(molecule_counts_for_top)
+
+        # Fail here, not minutes later inside grompp, if topology and coordinates disagree.
+        system = packed_systems.get(input_gro) or structure_io.read_structure(input_gro)
+        if sim_params.get('validate_topology', True):
+            _validate_topology(topology, system, sim_params)
+
+        # 6. Add ions: natively by replacing solvent in memory, or with GROMACS genion
+        ion_engine = add_series_params['add_small_ion'].get('engine', 'native') if add_ions else None
+        if ion_engine == 'native':
+            try:
+                charge_itps = [p for p in top_itps if os.path.isfile(p)]
+                ionized, ion_counts = add_small_ion.place_ions_native(
+                    system, molecule_counts_for_top, charge_itps, sim_params, add_series_params['add_small_ion'], watername
+                )
+                topology.set_molecules(ion_counts)
+                if sim_params.get('validate_topology', True):
+                    _validate_topology(topology, ionized, sim_params)
+                ionized.to_gro(f"{final_gro_path}_end.gro")
+                topology.write()
+                print(f"성공적으로 토폴로지 파일 '{final_top_path}'을 생성했습니다.")
+                return {}
+            except (KeyError, ValueError, RuntimeError) as e:
+                print(f"경고: native ion placement 실패 ({e}), genion으로 대체합니다.", file=sys.stderr)
+                topology.set_molecules(molecule_counts_for_top)
+
+        topology.write()
+        print("이온 추가 전 토폴로지 업데이트 완료.")
+
+        # GROMACS reads only plain coordinate files: other checkpoint formats are written out as .gro.
+        plain_input = structure_io.split_compression(input_gro)[1] is None \
+            and structure_io.structure_format(input_gro) == '.gro'
+
+        if add_ions:
+            ion_config = add_series_params['add_small_ion']
+            # The function expects a flat dictionary, so we prepare one.
+            ion_params_for_function = ion_config.copy()
+
+            # Call the refactored genion function
+            genion_input = input_gro if plain_input else structure_io.write_gro(
+                os.path.join(output_dir, "genion_input.gro"), system)
+            add_small_ion.run_genion_for_neutralization(
+                input_gro=genion_input,
+                output_gro=final_gro_path,
+                topology_file=final_top_path, # genion will read and update this file
+                sim_params=sim_params,
+                ion_params=ion_params_for_function,
+                solvent_name=watername
+            )
+            print(f"genion 이후 [ molecules ]: {topology_updater.Topology.read(final_top_path).counts()}")
+        else:
+            # If no ions are added, the last .gro file is the final one.
+            if plain_input:
+                shutil.copy(input_gro, f"{final_gro_path}.gro")
+            else:
+                structure_io.write_gro(f"{final_gro_path}.gro", system)
+        return {}
+
+    final_config = {
+        "molecule_counts": molecule_counts_for_top, "itp_files": final_itp,
+        "additional_itp_files": _config_slice('additional_itp_files'),
+        "add_small_ion": add_series_params.get('add_small_ion') if add_ions else None,
+        "solvent_name": watername, "random_seed": sim_params.get('random_seed'),
+        "gromacs_include_path": sim_params.get('gromacs_include_path'),
+        "prune_topology_includes": sim_params.get('prune_topology_includes', True),
+    }
+    produced_files = {os.path.abspath(o) for stage in stages for o in stage.outputs}
+    final_inputs = [p for p in final_itp if isinstance(p, str) and (os.path.isfile(p) or os.path.abspath(p) in produced_files)]
+    stages.append(pipeline.Stage(
+        "topology_and_ions", _topology_and_ions_stage, inputs=[current_gro_file] + final_inputs,
+        outputs=final_outputs, config_slice=final_config,
+        tools=[gmx_path] if add_ions and add_series_params['add_small_ion'].get('engine', 'native') != 'native' else (),
+        after=sorted({previous_packing_stage} | ({"prepare_water"} if 'add_water' in add_series_params else set()))
+    ))
+
+    _, timings = pipeline.run_stage_graph(
+        stages, manifest, max_workers=sim_params.get('max_parallel_stages', 4),
+        process_initializer=Config.load_config, process_initargs=(Config._file_path,)
+    )
+    pipeline.print_timing_report(stages, timings)
 
-    print("\n--- 모든 작업 완료 ---")
\ No newline at end of file
+    print("\n--- 모든 작업 완료 ---")
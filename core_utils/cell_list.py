@@ -0,0 +1,180 @@
+import numpy as np
+import numba
+
+# Periodic linked-list cell list for neighbour queries in a rectangular box.
+#
+# The box is divided into cells at least `cell_size` wide; head[c] holds the last bead
+# inserted into cell c and nxt[i] the previous bead of the same cell (-1 ends the list),
+# so beads can be appended at any time without rebuilding. Queries with a cutoff not
+# larger than cell_size only need the 27 neighbouring cells.
+
+_MAX_CELLS_PER_AXIS = 256
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _cell_of(p, box, n_cells):
+    c = np.empty(3, dtype=np.int64)
+    for t in range(3):
+        k = int(np.floor(p[t] / box[t] * n_cells[t]))
+        c[t] = k % n_cells[t]
+    return c
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _insert(positions, start, stop, box, n_cells, head, nxt):
+    for i in range(start, stop):
+        c = _cell_of(positions[i], box, n_cells)
+        flat = (c[0] * n_cells[1] + c[1]) * n_cells[2] + c[2]
+        nxt[i] = head[flat]
+        head[flat] = i
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _axis_cells(c, n):
+    # Neighbouring cell indices along one axis, without duplicates for tiny grids.
+    if n >= 3:
+        out = np.empty(3, dtype=np.int64)
+        for k in range(3):
+            out[k] = (c + k - 1) % n
+        return out
+    return np.arange(n)
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _has_neighbour(p, positions, box, n_cells, head, nxt, cutoff_sq, below):
+    """True if a stored bead with index < below lies within the cutoff of p."""
+    c = _cell_of(p, box, n_cells)
+    xs = _axis_cells(c[0], n_cells[0])
+    ys = _axis_cells(c[1], n_cells[1])
+    zs = _axis_cells(c[2], n_cells[2])
+    for ix in xs:
+        for iy in ys:
+            for iz in zs:
+                j = head[(ix * n_cells[1] + iy) * n_cells[2] + iz]
+                while j != -1:
+                    if j < below:
+                        d2 = 0.0
+                        for t in range(3):
+                            s = p[t] - positions[j, t]
+                            s -= box[t] * np.round(s / box[t])
+                            d2 += s * s
+                        if d2 < cutoff_sq:
+                            return True
+                    j = nxt[j]
+    return False
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _any_within(query, positions, box, n_cells, head, nxt, cutoff_sq, below, result):
+    for q in range(query.shape[0]):
+        result[q] = _has_neighbour(query[q], positions, box, n_cells, head, nxt, cutoff_sq, below)
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _overlaps_earlier(positions, box, n_cells, head, nxt, cutoff_sq, result):
+    for i in range(positions.shape[0]):
+        result[i] = _has_neighbour(positions[i], positions, box, n_cells, head, nxt, cutoff_sq, i)
+
+
+@numba.jit(nopython=True, cache=True, nogil=True)
+def _overlaps_earlier_group(positions, groups, box, n_cells, head, nxt, cutoff_sq, result):
+    # As _overlaps_earlier, but beads of the same group (molecule) never clash.
+    for i in range(positions.shape[0]):
+        p = positions[i]
+        c = _cell_of(p, box, n_cells)
+        xs = _axis_cells(c[0], n_cells[0])
+        ys = _axis_cells(c[1], n_cells[1])
+        zs = _axis_cells(c[2], n_cells[2])
+        found = False
+        for ix in xs:
+            for iy in ys:
+                for iz in zs:
+                    j = head[(ix * n_cells[1] + iy) * n_cells[2] + iz]
+                    while j != -1 and not found:
+                        if j < i and groups[j] != groups[i]:
+                            d2 = 0.0
+                            for t in range(3):
+                                s = p[t] - positions[j, t]
+                                s -= box[t] * np.round(s / box[t])
+                                d2 += s * s
+                            if d2 < cutoff_sq:
+                                found = True
+                        j = nxt[j]
+        result[i] = found
+
+
+class CellList:
+    """
+    Growable periodic cell list over a rectangular box.
+
+    Args:
+        box (array-like): Box edge lengths (nm).
+        cell_size (float): Minimum cell width; the largest cutoff that can be queried.
+        positions (array-like): Initial beads, (n, 3).
+        capacity (int): Number of beads to reserve room for.
+    """
+
+    def __init__(self, box, cell_size, positions=None, capacity=0):
+        self.box = np.asarray(box, dtype=np.float64).reshape(3)
+        self.cell_size = float(cell_size)
+        self.n_cells = np.clip(np.floor(self.box / self.cell_size), 1, _MAX_CELLS_PER_AXIS).astype(np.int64)
+        self.head = np.full(int(np.prod(self.n_cells)), -1, dtype=np.int64)
+        initial = np.zeros((0, 3)) if positions is None else np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        size = max(capacity, len(initial), 16)
+        self.positions = np.empty((size, 3), dtype=np.float64)
+        self.nxt = np.full(size, -1, dtype=np.int64)
+        self.n = 0
+        self.add(initial)
+
+    def __len__(self):
+        return self.n
+
+    def add(self, points):
+        """Appends beads; returns their indices."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        needed = self.n + len(points)
+        if needed > len(self.positions):
+            size = max(needed, 2 * len(self.positions))
+            positions = np.empty((size, 3), dtype=np.float64)
+            positions[:self.n] = self.positions[:self.n]
+            nxt = np.full(size, -1, dtype=np.int64)
+            nxt[:self.n] = self.nxt[:self.n]
+            self.positions, self.nxt = positions, nxt
+        self.positions[self.n:needed] = points
+        _insert(self.positions, self.n, needed, self.box, self.n_cells, self.head, self.nxt)
+        indices = np.arange(self.n, needed)
+        self.n = needed
+        return indices
+
+    def any_within(self, points, cutoff):
+        """Boolean mask: which points have a stored bead closer than cutoff (periodic)."""
+        if cutoff > self.cell_size + 1e-12:
+            raise ValueError(f"Cutoff {cutoff} exceeds the cell size {self.cell_size} of this cell list")
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+        result = np.zeros(len(points), dtype=np.bool_)
+        _any_within(points, self.positions, self.box, self.n_cells, self.head, self.nxt, cutoff * cutoff, self.n, result)
+        return result
+
+
+def within_cutoff(points, reference, box, cutoff):
+    """Boolean mask of the points lying closer than cutoff to any reference bead (periodic)."""
+    return CellList(box, cutoff, reference).any_within(points, cutoff)
+
+
+def overlapping_later(positions, box, cutoff, groups=None):
+    """
+    Boolean mask of the beads closer than cutoff to a bead that precedes them in the
+    array; removing the masked beads leaves a set without close pairs.
+
+    Args:
+        groups (array-like): Optional per-bead group (e.g. molecule) index; pairs within
+            the same group are not counted, so bonded beads of one molecule do not clash.
+    """
+    cells = CellList(box, cutoff, positions)
+    result = np.zeros(len(cells), dtype=np.bool_)
+    args = (cells.box, cells.n_cells, cells.head, cells.nxt, cutoff * cutoff, result)
+    if groups is None:
+        _overlaps_earlier(cells.positions[:cells.n], *args)
+    else:
+        _overlaps_earlier_group(cells.positions[:cells.n], np.asarray(groups, dtype=np.int64), *args)
+    return result
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, concurrent misses just convert twice
+    fcntl = None
+
+from core_utils import pipeline
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'hygel_martini', 'conversions'
+)
+DEFAULT_MAX_MB = 512
+
+
+class _FileLock:
+    """Exclusive advisory lock on a lock file, held for the duration of a with block."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+class ConversionCache:
+    """
+    Shared cache of converted structure files (GRO -> PDB, PDB -> GRO, ...).
+
+    Entries are keyed by the SHA-256 of the input content plus the conversion kind and
+    parameters (converter, tool identity, box, ...), so unchanged inputs are converted
+    once and then served to every packing step, run and sweep job using the same cache
+    directory. A per-key lock makes concurrent workers wait for a conversion already in
+    progress instead of repeating it; entries are published with an atomic rename.
+    The directory is kept below max_bytes by evicting the least recently used entries.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, src_path, kind, params):
+        payload = json.dumps({"input": pipeline.file_sha256(src_path), "kind": kind, "params": params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key, ext):
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def fetch_or_convert(self, src_path, dst_path, kind, params, convert):
+        """
+        Writes the conversion of src_path to dst_path, from the cache if possible.
+
+        Args:
+            kind (str): Conversion name, e.g. 'gro2pdb'.
+            params (dict): Everything besides the input content that affects the output.
+            convert (callable): convert(src_path, dst_path) performing the conversion on a miss.
+
+        Returns:
+            bool: True on a cache hit.
+        """
+        key = self.key(src_path, kind, params)
+        entry = self._entry_path(key, os.path.splitext(dst_path)[1])
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        if self._serve(entry, dst_path):
+            return True
+        with _FileLock(entry + ".lock"):
+            # Another worker may have finished the same conversion while we waited.
+            if self._serve(entry, dst_path):
+                return True
+            convert(src_path, dst_path)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(dst_path, tmp_path)
+            os.replace(tmp_path, entry)
+        self.evict()
+        return False
+
+    def _serve(self, entry, dst_path):
+        try:
+            shutil.copyfile(entry, dst_path)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(entry)  # mark as recently used
+        except OSError:
+            pass
+        return True
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        with _FileLock(os.path.join(self.cache_dir, ".evict.lock")):
+            entries, total = [], 0
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if name.endswith((".lock", ".tmp")):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+
+def from_sim_params(sim_params):
+    """
+    Returns the ConversionCache configured in simulation_parameters, or None when
+    'conversion_cache' is false.
+
+    Keys: 'conversion_cache' (default True), 'conversion_cache_dir' (default
+    ~/.cache/hygel_martini/conversions) and 'conversion_cache_max_mb' (default 512).
+    """
+    if not sim_params.get('conversion_cache', True):
+        return None
+    cache_dir = sim_params.get('conversion_cache_dir') or DEFAULT_CACHE_DIR
+    max_mb = sim_params.get('conversion_cache_max_mb', DEFAULT_MAX_MB)
+    try:
+        return ConversionCache(cache_dir, int(max_mb * 1024 * 1024))
+    except OSError as e:
+        print(f"Warning: conversion cache '{cache_dir}' unavailable, converting without it: {e}", file=sys.stderr)
+        return None
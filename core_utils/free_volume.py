@@ -0,0 +1,160 @@
+import sys
+
+import numpy as np
+from scipy import ndimage
+
+# Voxelized occupancy and free-volume analysis of a periodic system.
+#
+# Beads are binned into a voxel grid in one vectorized pass; a Euclidean distance
+# transform of the empty voxels then gives, for every voxel, the distance to the
+# nearest occupied voxel (accurate to half a voxel diagonal). The grid is padded by
+# periodic wrapping so distances up to max_distance are correct across the box faces;
+# larger distances are clipped to max_distance.
+
+_MAX_VOXELS_PER_AXIS = 200
+_FCC_VOLUME_FACTOR = 1.0 / np.sqrt(2.0)  # volume per sphere of diameter d at close packing: d**3 / sqrt(2)
+
+
+class FreeVolumeMap:
+    """
+    Occupancy and clearance map of a set of beads in a rectangular periodic box.
+
+    Args:
+        positions (array-like): Bead coordinates (nm), (n, 3).
+        box (array-like): Box edge lengths (nm).
+        spacing (float): Target voxel edge (nm); coarsened so no axis exceeds
+            200 voxels.
+        max_distance (float): Largest clearance resolved (nm).
+    """
+
+    def __init__(self, positions, box, spacing=0.1, max_distance=2.0):
+        self.box = np.asarray(box, dtype=np.float64).reshape(3)
+        self.shape = np.clip(np.ceil(self.box / spacing), 1, _MAX_VOXELS_PER_AXIS).astype(np.int64)
+        self.spacing = self.box / self.shape
+        self.voxel_volume = float(np.prod(self.spacing))
+        self.max_distance = float(max_distance)
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        index = np.minimum(np.floor(np.mod(positions, self.box) / self.spacing).astype(np.int64), self.shape - 1)
+        flat = np.ravel_multi_index(index.T, tuple(self.shape))
+        self.bead_count = np.bincount(flat, minlength=int(np.prod(self.shape))).reshape(tuple(self.shape))
+
+        if len(positions) == 0:
+            self.distance = np.full(tuple(self.shape), self.max_distance)
+            return
+        pad = np.minimum(np.ceil(self.max_distance / self.spacing).astype(np.int64) + 1, self.shape)
+        empty = np.pad(self.bead_count == 0, [(p, p) for p in pad], mode='wrap')
+        distance = ndimage.distance_transform_edt(empty, sampling=self.spacing)
+        crop = tuple(slice(p, p + n) for p, n in zip(pad, self.shape))
+        self.distance = np.minimum(distance[crop], self.max_distance)
+
+    @property
+    def occupied_fraction(self):
+        return float(np.count_nonzero(self.bead_count)) / self.bead_count.size
+
+    def accessible_volume(self, clearance):
+        """Volume (nm^3) of the points at least `clearance` away from every bead."""
+        return float(np.count_nonzero(self.distance >= clearance)) * self.voxel_volume
+
+    def accessible_volume_by_subdomain(self, n_div, clearance):
+        """Accessible volume (nm^3) of each of the n_div^3 equal subdomains, in np.ndindex order."""
+        centres = [(np.arange(n) + 0.5) * h for n, h in zip(self.shape, self.spacing)]
+        region = [np.minimum((c / (b / n_div)).astype(np.int64), n_div - 1) for c, b in zip(centres, self.box)]
+        flat = (region[0][:, None, None] * n_div + region[1][None, :, None]) * n_div + region[2][None, None, :]
+        accessible = (self.distance >= clearance).astype(np.float64) * self.voxel_volume
+        return np.bincount(flat.ravel(), weights=accessible.ravel(), minlength=n_div ** 3)
+
+    def excluded_boxes(self, clearance, block_size=0.5, max_boxes=200):
+        """
+        Boxes in which (to voxel accuracy) no point lies `clearance` or farther from
+        every bead, e.g. for packmol 'outside box' exclusions. Blocks of about block_size (nm) whose voxels
+        are all that close to a bead are merged into runs along z; the max_boxes
+        largest runs are returned.
+
+        Returns:
+            tuple: (lo, hi) corner coordinates (nm), each (m, 3).
+        """
+        # Judged at the voxel centres: an excluded box may hide slivers of free space
+        # up to half a voxel diagonal wide, but never lets a point come too close.
+        blocked = self.distance < clearance
+        k = np.maximum(1, np.round(block_size / self.spacing)).astype(np.int64)
+        n_blocks = self.shape // k
+        if np.any(n_blocks == 0):
+            return np.zeros((0, 3)), np.zeros((0, 3))
+        trimmed = blocked[:n_blocks[0] * k[0], :n_blocks[1] * k[1], :n_blocks[2] * k[2]]
+        blocks = trimmed.reshape(n_blocks[0], k[0], n_blocks[1], k[1], n_blocks[2], k[2]).all(axis=(1, 3, 5))
+        change = np.diff(np.pad(blocks, [(0, 0), (0, 0), (1, 1)]).astype(np.int8), axis=2)
+        starts, stops = np.argwhere(change == 1), np.argwhere(change == -1)
+        edge = k * self.spacing
+        lo = starts * edge
+        hi = np.column_stack([starts[:, 0] + 1, starts[:, 1] + 1, stops[:, 2]]) * edge
+        order = np.argsort(-np.prod(hi - lo, axis=1), kind='stable')[:max_boxes]
+        return lo[order], hi[order]
+
+    def pore_size_distribution(self, bins=20, clearance=0.0):
+        """
+        Histogram of local pore diameters: twice the clearance of every voxel with a
+        clearance above `clearance`, weighted by voxel volume.
+
+        Returns:
+            tuple: (volumes in nm^3 per bin, bin edges in nm)
+        """
+        free = self.distance[self.distance > clearance]
+        return np.histogram(2.0 * free, bins=bins, range=(0.0, 2.0 * self.max_distance),
+                            weights=np.full(free.shape, self.voxel_volume))
+
+    def max_insertions(self, beads_per_molecule, tolerance):
+        """
+        Rough estimate of how many molecules can be added with every new bead at least
+        `tolerance` from all other beads: the accessible volume divided by the
+        close-packing volume of the beads' exclusion spheres. It is not a bound: thin
+        or porous regions hold more beads than their centre-locus volume suggests.
+        """
+        per_molecule = beads_per_molecule * tolerance ** 3 * _FCC_VOLUME_FACTOR
+        return int(self.accessible_volume(tolerance) / per_molecule)
+
+    def report(self, tolerance):
+        """Prints the accessible volume and pore-size distribution summary."""
+        total = float(np.prod(self.box))
+        accessible = self.accessible_volume(tolerance)
+        diameters = 2.0 * self.distance[self.distance >= tolerance]
+        print(f"Free volume map: {self.shape[0]}x{self.shape[1]}x{self.shape[2]} voxels of {self.spacing.mean():.3f} nm, "
+              f"{self.occupied_fraction * 100:.1f}% occupied")
+        print(f"  Accessible volume (clearance {tolerance:.3f} nm): {accessible:.2f} of {total:.2f} nm^3 "
+              f"({accessible / total * 100:.1f}%)")
+        if len(diameters):
+            p50, p90 = np.percentile(diameters, [50, 90])
+            print(f"  Pore diameter: median {p50:.2f} nm, 90th percentile {p90:.2f} nm, "
+                  f"max {diameters.max():.2f} nm (resolved up to {2 * self.max_distance:.1f} nm)")
+
+
+def check_packing_feasibility(free_map, molecules, tolerance):
+    """
+    Reports the free volume and warns if the requested molecules look too many for it.
+
+    The comparison uses the close-packing estimate of FreeVolumeMap.max_insertions,
+    which undercounts thin pores, so it only warns and never stops the packing.
+
+    Args:
+        free_map (FreeVolumeMap): Map of the current system.
+        molecules (list): (name, beads per molecule, number) tuples; a number of None
+            (fill the free volume) is skipped.
+        tolerance (float): Minimum distance between beads of different molecules (nm).
+
+    Returns:
+        bool: False if the request exceeds the estimate.
+    """
+    free_map.report(tolerance)
+    demand = 0.0
+    for name, n_beads, number in molecules:
+        if number is None:
+            continue
+        estimate = free_map.max_insertions(n_beads, tolerance)
+        print(f"  {name}: {number} requested, about {estimate} fit at close packing")
+        demand += number * n_beads * tolerance ** 3 * _FCC_VOLUME_FACTOR
+    accessible = free_map.accessible_volume(tolerance)
+    if demand > accessible:
+        print(f"Warning: the requested molecules need about {demand:.2f} nm^3 at close packing, "
+              f"{accessible:.2f} nm^3 is accessible; packing may be slow or fail", file=sys.stderr)
+        return False
+    return True
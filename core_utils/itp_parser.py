@@ -0,0 +1,363 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+
+# Full-section parser of GROMACS .itp files into per-moleculetype NumPy tables.
+#
+# The preprocessor directives are honoured (#define with and without value, #undef,
+# #ifdef/#ifndef/#else/#endif, line continuation); macro names used as parameters are
+# substituted. Every interaction section becomes a table of atom indices, function
+# types and parameters, so callers work on whole columns instead of per-line dicts.
+# Parsed files are cached in memory and on disk, keyed by path, mtime, size and the
+# active defines, so repeated lookups across runs and worker processes cost a single
+# unpickling.
+
+PARSER_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'hygel_martini', 'itp'
+)
+
+# Number of atom columns of the fixed-width interaction sections
+SECTION_ATOMS = {
+    'bonds': 2, 'pairs': 2, 'pairs_nb': 2, 'constraints': 2, 'angles': 3, 'dihedrals': 4,
+    'cmap': 5, 'settles': 1, 'position_restraints': 1, 'distance_restraints': 2,
+    'dihedral_restraints': 4, 'orientation_restraints': 2, 'angle_restraints': 4,
+    'angle_restraints_z': 2, 'virtual_sites1': 2, 'virtual_sites2': 3, 'virtual_sites3': 4,
+    'virtual_sites4': 5,
+}
+# Sections whose rows list a variable number of atoms
+RAGGED_SECTIONS = ('exclusions', 'virtual_sitesn')
+
+ATOM_DTYPE = np.dtype([
+    ('nr', np.int64), ('type', 'U16'), ('resnr', np.int64), ('residue', 'U8'), ('atom', 'U8'),
+    ('cgnr', np.int64), ('charge', np.float64), ('mass', np.float64),
+])
+
+
+class MoleculeType:
+    """
+    One [ moleculetype ] as tables.
+
+    Attributes:
+        name (str), nrexcl (int)
+        atoms (ndarray): Structured array with ATOM_DTYPE fields; a missing charge is 0,
+            a missing mass NaN (taken from the atom type).
+        sections (dict): Interaction section name -> table. Fixed-width sections have
+            'atoms' (n, k) int64 (1-based, as in the file), 'funct' (n,) int64 and
+            'params' (n, p) float64 padded with NaN. Ragged sections (exclusions,
+            virtual_sitesn) have 'atoms' (flat int64), 'offsets' (n + 1,) and, for
+            virtual_sitesn, 'funct'.
+    """
+
+    def __init__(self, name, nrexcl, atoms, sections):
+        self.name = name
+        self.nrexcl = nrexcl
+        self.atoms = atoms
+        self.sections = sections
+
+    @property
+    def n_atoms(self):
+        return len(self.atoms)
+
+    @property
+    def charge(self):
+        return float(self.atoms['charge'].sum())
+
+    def masses(self, atomtype_masses=None):
+        """Per-atom masses, missing ones from atomtype_masses (name -> mass), else 0."""
+        masses = self.atoms['mass'].copy()
+        missing = np.isnan(masses)
+        if missing.any():
+            lookup = atomtype_masses or {}
+            masses[missing] = [lookup.get(t, 0.0) for t in self.atoms['type'][missing]]
+        return masses
+
+    def section(self, name):
+        """The table of a section, or None if the moleculetype does not have it."""
+        return self.sections.get(name)
+
+
+class ItpFile:
+    """
+    Parsed .itp file: moleculetypes in file order, [ atomtypes ] masses, the defines in
+    effect at the end of the file and the #include names met in active blocks.
+    """
+
+    def __init__(self, path, moleculetypes, atomtype_masses, defines, includes):
+        self.path = path
+        self.moleculetypes = moleculetypes
+        self.atomtype_masses = atomtype_masses
+        self.defines = defines
+        self.includes = includes
+
+    def __getitem__(self, name):
+        return self.moleculetypes[name]
+
+    def __contains__(self, name):
+        return name in self.moleculetypes
+
+    def __iter__(self):
+        return iter(self.moleculetypes)
+
+
+def _logical_lines(f):
+    pending = ""
+    for line in f:
+        line = line.rstrip('\n')
+        if line.endswith('\\'):
+            pending += line[:-1] + " "
+            continue
+        yield pending + line
+        pending = ""
+    if pending:
+        yield pending
+
+
+def _as_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return np.nan
+
+
+def _fixed_table(rows, k):
+    n = len(rows)
+    atoms = np.zeros((n, k), dtype=np.int64)
+    funct = np.zeros(n, dtype=np.int64)
+    n_params = max((len(r) - k - 1 for r in rows), default=0)
+    params = np.full((n, max(n_params, 0)), np.nan)
+    for i, row in enumerate(rows):
+        atoms[i] = [int(t) for t in row[:k]]
+        if len(row) > k:
+            funct[i] = int(row[k])
+        values = row[k + 1:]
+        if values:
+            params[i, :len(values)] = [_as_float(t) for t in values]
+    return {'atoms': atoms, 'funct': funct, 'params': params}
+
+
+def _ragged_table(rows, with_funct):
+    funct = np.zeros(len(rows), dtype=np.int64)
+    flat, offsets = [], [0]
+    for i, row in enumerate(rows):
+        if with_funct:
+            # virtual_sitesn rows are 'site funct from1 from2 ...': the site and its
+            # constructing atoms are stored together, site first.
+            members = [row[0]] + row[2:]
+            funct[i] = int(row[1])
+        else:
+            members = row
+        flat.extend(int(t) for t in members)
+        offsets.append(len(flat))
+    table = {'atoms': np.array(flat, dtype=np.int64), 'offsets': np.array(offsets, dtype=np.int64)}
+    if with_funct:
+        table['funct'] = funct
+    return table
+
+
+def _atom_table(rows):
+    atoms = np.zeros(len(rows), dtype=ATOM_DTYPE)
+    for i, row in enumerate(rows):
+        atoms[i] = (
+            int(row[0]), row[1], int(row[2]), row[3], row[4],
+            int(row[5]) if len(row) > 5 else int(row[0]),
+            _as_float(row[6]) if len(row) > 6 else 0.0,
+            _as_float(row[7]) if len(row) > 7 else np.nan,
+        )
+    return atoms
+
+
+def _build_moleculetype(header, rows):
+    name, nrexcl = header[0], int(header[1]) if len(header) > 1 else 1
+    sections = {}
+    for section, section_rows in rows.items():
+        if section == 'atoms':
+            continue
+        if section in SECTION_ATOMS:
+            sections[section] = _fixed_table(section_rows, SECTION_ATOMS[section])
+        elif section in RAGGED_SECTIONS:
+            sections[section] = _ragged_table(section_rows, section == 'virtual_sitesn')
+    return MoleculeType(name, nrexcl, _atom_table(rows.get('atoms', [])), sections)
+
+
+def _parse(path, defines):
+    with open(path, 'r') as f:
+        return _parse_lines(f, defines, os.path.abspath(path))
+
+
+def _parse_lines(lines, defines, path):
+    defines = dict(defines)
+    active = []  # one flag per open #if block
+    includes = []
+    moleculetypes = {}
+    atomtype_masses = {}
+    header, rows, section = None, None, None
+
+    def _finish():
+        if header is not None:
+            moleculetypes[header[0]] = _build_moleculetype(header, rows)
+
+    for line in _logical_lines(lines):
+        line = line.split(';', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            parts = line.split()
+            directive = parts[0]
+            if directive in ('#ifdef', '#ifndef'):
+                defined = len(parts) > 1 and parts[1] in defines
+                active.append(defined if directive == '#ifdef' else not defined)
+            elif directive == '#else' and active:
+                active[-1] = not active[-1]
+            elif directive == '#endif' and active:
+                active.pop()
+            elif all(active):
+                if directive == '#define' and len(parts) > 1:
+                    defines[parts[1]] = " ".join(parts[2:])
+                elif directive == '#undef' and len(parts) > 1:
+                    defines.pop(parts[1], None)
+                elif directive == '#include' and len(parts) > 1:
+                    includes.append(parts[1].strip('"<>'))
+            continue
+        if not all(active):
+            continue
+        if line.startswith('['):
+            section = line.strip('[] \t').lower()
+            if section == 'moleculetype':
+                _finish()
+                header, rows = None, {}
+            continue
+
+        tokens = []
+        for token in line.split():
+            value = defines.get(token)
+            tokens.extend(value.split() if value else [token])
+        if section == 'moleculetype':
+            header = tokens
+        elif section == 'atomtypes':
+            for i in range(2, len(tokens)):
+                if tokens[i] in ('A', 'S', 'V', 'D'):
+                    atomtype_masses[tokens[0]] = _as_float(tokens[i - 2])
+                    break
+        elif header is not None and section is not None:
+            rows.setdefault(section, []).append(tokens)
+    _finish()
+    return ItpFile(path, moleculetypes, atomtype_masses, defines, includes)
+
+
+def parse_itp_block(path, offset, length, defines=None):
+    """
+    Parses `length` bytes of an .itp file starting at byte `offset`, e.g. a single
+    moleculetype located by an index. Not cached; defines as for parse_itp.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        text = f.read(length).decode('utf-8', errors='replace')
+    return _parse_lines(text.splitlines(), dict(defines or {}), os.path.abspath(path))
+
+_memory_cache = {}
+_memory_lock = threading.Lock()
+
+
+def _cache_key(path, defines):
+    stat = os.stat(path)
+    payload = repr((PARSER_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size, sorted(dict(defines).items())))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def parse_itp(path, defines=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Parses an .itp file into an ItpFile, reusing cached results.
+
+    Args:
+        path (str): The .itp file.
+        defines (dict or iterable): Macros defined before the file is read, e.g.
+            {'FLEXIBLE': ''} or ['FLEXIBLE'].
+        cache_dir (str): Directory of the on-disk cache; None disables it.
+
+    Returns:
+        ItpFile
+    """
+    if defines is None:
+        defines = {}
+    elif not isinstance(defines, dict):
+        defines = {name: "" for name in defines}
+    key = _cache_key(path, defines)
+    with _memory_lock:
+        if key in _memory_cache:
+            return _memory_cache[key]
+
+    parsed = None
+    entry = os.path.join(cache_dir, key[:2], key + ".pkl") if cache_dir else None
+    if entry and os.path.exists(entry):
+        try:
+            with open(entry, 'rb') as f:
+                parsed = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            parsed = None
+    if parsed is None:
+        parsed = _parse(path, defines)
+        if entry:
+            try:
+                os.makedirs(os.path.dirname(entry), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, entry)
+            except OSError:
+                pass  # a read-only cache only costs the parse
+    with _memory_lock:
+        _memory_cache[key] = parsed
+    return parsed
+
+
+def _tables_equal(a, b):
+    if a.keys() != b.keys():
+        return False
+    for key in a:
+        x, y = a[key], b[key]
+        if x.shape != y.shape:
+            return False
+        if x.dtype.kind == 'f' and y.dtype.kind == 'f':
+            if not np.array_equal(x, y, equal_nan=True):
+                return False
+        elif not np.array_equal(x, y):
+            return False
+    return True
+
+
+def compare_itp(reference_path, candidate_path, defines=None):
+    """
+    Compares two .itp files as grompp sees them: after macro substitution, every
+    moleculetype must have the same atoms and the same interaction tables (atoms,
+    function types and parameters, row by row).
+
+    Returns:
+        list: Descriptions of the differences; empty if the files are equivalent.
+    """
+    reference = parse_itp(reference_path, defines, cache_dir=None)
+    candidate = parse_itp(candidate_path, defines, cache_dir=None)
+    differences = []
+    if list(reference.moleculetypes) != list(candidate.moleculetypes):
+        differences.append(f"moleculetypes {list(reference.moleculetypes)} != {list(candidate.moleculetypes)}")
+    for name in reference:
+        if name not in candidate:
+            continue
+        a, b = reference[name], candidate[name]
+        if a.nrexcl != b.nrexcl:
+            differences.append(f"{name}: nrexcl {a.nrexcl} != {b.nrexcl}")
+        if a.atoms.shape != b.atoms.shape or not all(
+                np.array_equal(a.atoms[field], b.atoms[field], equal_nan=a.atoms[field].dtype.kind == 'f')
+                for field in ATOM_DTYPE.names):
+            differences.append(f"{name}: [ atoms ] differ")
+        for section in sorted(set(a.sections) | set(b.sections)):
+            if section not in a.sections or section not in b.sections:
+                differences.append(f"{name}: [ {section} ] only in one file")
+            elif not _tables_equal(a.sections[section], b.sections[section]):
+                differences.append(f"{name}: [ {section} ] differ")
+    return differences
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from core_utils import itp_parser
+
+# Persistent index of a force-field tree such as martini_v300.
+#
+# Every .itp file under the root is scanned once for its [ moleculetype ] blocks; the
+# index maps each moleculetype name to its file, the byte range of its block and the
+# macros defined before it, and records the #include names of every file. The index is
+# stored as JSON in the cache directory and refreshed file by file when an .itp file is
+# added, removed or changed (mtime or size), so a lookup only stats the tree and then
+# parses the single requested block.
+
+INDEX_VERSION = 2
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(itp_parser.DEFAULT_CACHE_DIR), 'index')
+
+
+def _scan_itp(path):
+    """
+    Locates the moleculetype blocks of one .itp file.
+
+    Returns:
+        dict: {'includes': [...], 'parameters': whether the file has [ defaults ] or
+        [ *types ] sections, 'moleculetypes': [[name, offset, length, defines], ...]}
+    """
+    defines, active, includes = {}, [], []
+    parameters = False
+    blocks = []  # [name, offset, defines at the block]; name filled from the header line
+    section, offset = None, 0
+    with open(path, 'rb') as f:
+        raw_lines = f.readlines()
+    size = sum(len(raw) for raw in raw_lines)
+    for raw in raw_lines:
+        start, offset = offset, offset + len(raw)
+        line = raw.decode('utf-8', errors='replace').split(';', 1)[0].strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            parts = line.split()
+            directive = parts[0]
+            if directive in ('#ifdef', '#ifndef'):
+                defined = len(parts) > 1 and parts[1] in defines
+                active.append(defined if directive == '#ifdef' else not defined)
+            elif directive == '#else' and active:
+                active[-1] = not active[-1]
+            elif directive == '#endif' and active:
+                active.pop()
+            elif all(active):
+                if directive == '#define' and len(parts) > 1:
+                    defines[parts[1]] = " ".join(parts[2:])
+                elif directive == '#undef' and len(parts) > 1:
+                    defines.pop(parts[1], None)
+                elif directive == '#include' and len(parts) > 1:
+                    includes.append(parts[1].strip('"<>'))
+            continue
+        if not all(active):
+            continue
+        if line.startswith('['):
+            section = line.strip('[] \t').lower()
+            if section == 'moleculetype':
+                blocks.append([None, start, dict(defines)])
+            elif section == 'defaults' or section.endswith('types'):
+                parameters = True
+            continue
+        if section == 'moleculetype' and blocks and blocks[-1][0] is None:
+            blocks[-1][0] = line.split()[0]
+
+    moleculetypes = []
+    for i, (name, start, block_defines) in enumerate(blocks):
+        end = blocks[i + 1][1] if i + 1 < len(blocks) else size
+        if name is not None:
+            moleculetypes.append([name, start, end - start, block_defines])
+    return {'includes': includes, 'parameters': parameters, 'moleculetypes': moleculetypes}
+
+
+class MartiniLibrary:
+    """
+    Indexed collection of the .itp files under a force-field directory.
+
+    Args:
+        root (str): Directory searched recursively for .itp files.
+        index_dir (str): Directory of the persistent index; None keeps it in memory.
+
+    A moleculetype defined in several files is served from the first file in sorted
+    path order; providers() lists all of them. The index is built without extra
+    defines, so blocks behind #ifdef switches that are off by default are not listed.
+    """
+
+    def __init__(self, root, index_dir=DEFAULT_INDEX_DIR):
+        self.root = os.path.abspath(root)
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._parsed = {}
+        self._files = self._load()
+        self._refresh()
+
+    def _index_path(self):
+        if not self.index_dir:
+            return None
+        key = hashlib.sha256(self.root.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.index_dir, key + ".json")
+
+    def _load(self):
+        index_path = self._index_path()
+        if index_path and os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    stored = json.load(f)
+                if stored.get('version') == INDEX_VERSION and stored.get('root') == self.root:
+                    return stored['files']
+            except (OSError, ValueError, KeyError):
+                pass
+        return {}
+
+    def _save(self):
+        index_path = self._index_path()
+        if not index_path:
+            return
+        try:
+            os.makedirs(self.index_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'root': self.root, 'files': self._files}, f)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            pass  # a read-only cache only costs the rescan
+
+    def _refresh(self):
+        """Rescans the files that were added or changed since the index was written."""
+        present = {}
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith('.itp'):
+                    path = os.path.join(directory, name)
+                    present[os.path.relpath(path, self.root)] = os.stat(path)
+        changed = set(self._files) - set(present)  # removed files
+        for relpath in changed:
+            del self._files[relpath]
+        for relpath, stat in present.items():
+            entry = self._files.get(relpath)
+            if entry is None or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                entry = _scan_itp(os.path.join(self.root, relpath))
+                entry.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                self._files[relpath] = entry
+                changed.add(relpath)
+        self._names = {}
+        for relpath in sorted(self._files):
+            for name, offset, length, defines in self._files[relpath]['moleculetypes']:
+                self._names.setdefault(name, []).append((relpath, offset, length, defines))
+        if changed:
+            self._parsed.clear()
+            self._save()
+
+    @property
+    def files(self):
+        """Absolute paths of the indexed .itp files, sorted."""
+        return [os.path.join(self.root, relpath) for relpath in sorted(self._files)]
+
+    def names(self):
+        return sorted(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def providers(self, name):
+        """Absolute paths of every file defining the moleculetype `name`."""
+        return [os.path.join(self.root, entry[0]) for entry in self._names.get(name, [])]
+
+    def locate(self, name):
+        """The file defining the moleculetype `name`, or None."""
+        providers = self.providers(name)
+        return providers[0] if providers else None
+
+    def _entry(self, path):
+        return self._files.get(os.path.relpath(os.path.abspath(path), self.root))
+
+    def indexed(self, path):
+        """Whether `path` is one of the indexed files."""
+        return self._entry(path) is not None
+
+    def includes(self, path):
+        """The #include names of an indexed file."""
+        return list(self._entry(path)['includes'])
+
+    def defines_parameters(self, path):
+        """Whether an indexed file has [ defaults ] or [ *types ] (force-field parameter) sections."""
+        return self._entry(path)['parameters']
+
+    def moleculetype_names(self, path):
+        """Names of the moleculetypes of an indexed file, in file order."""
+        return [block[0] for block in self._entry(path)['moleculetypes']]
+
+    def moleculetype(self, name, path=None, defines=None):
+        """
+        Parses only the block of the moleculetype `name`.
+
+        Args:
+            path (str): Take the definition from this file instead of the first provider.
+            defines (dict): Macros defined in addition to those of the file before the block.
+
+        Returns:
+            itp_parser.MoleculeType
+
+        Raises:
+            KeyError: If the moleculetype is not indexed (in `path`).
+        """
+        entries = self._names.get(name, [])
+        if path is not None:
+            relpath = os.path.relpath(os.path.abspath(path), self.root)
+            entries = [entry for entry in entries if entry[0] == relpath]
+        if not entries:
+            raise KeyError(f"Moleculetype '{name}' is not defined in {path or self.root}")
+        relpath, offset, length, block_defines = entries[0]
+        active = dict(block_defines)
+        active.update(defines or {})
+        key = (relpath, offset, tuple(sorted(active.items())))
+        with self._lock:
+            if key not in self._parsed:
+                block = itp_parser.parse_itp_block(os.path.join(self.root, relpath), offset, length, active)
+                self._parsed[key] = block[name]
+            return self._parsed[key]
+
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def open_library(root, index_dir=DEFAULT_INDEX_DIR):
+    """
+    The MartiniLibrary of `root`, shared within the process. Files changed since the
+    last call are picked up on the next open_library call.
+    """
+    root = os.path.abspath(root)
+    with _libraries_lock:
+        library = _libraries.get((root, index_dir))
+        if library is None:
+            library = _libraries[(root, index_dir)] = MartiniLibrary(root, index_dir)
+        else:
+            library._refresh()
+        return library
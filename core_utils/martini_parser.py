@@ -1,10 +1,15 @@
 
-import re
+import numpy as np
+
+from core_utils.itp_parser import parse_itp
 
 def read_itp_definitions(itp_file_path):
     """
     Parses a Martini .itp file and extracts molecule definitions.
 
+    Built on core_utils.itp_parser, so the file is parsed once and then served from
+    its cache; preprocessor blocks are evaluated without extra defines.
+
     Args:
         itp_file_path (str): The path to the .itp file.
 
@@ -12,62 +17,40 @@ def read_itp_definitions(itp_file_path):
         dict: A dictionary where keys are molecule names and values are their
               definitions (including beads and bonds).
     """
-    definitions = {}
-    current_molecule = None
-    section = None
-
-    with open(itp_file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith(';'):
-                continue
-
-            # Check for section headers like [ moleculetype ], [ atoms ], etc.
-            match = re.match(r'\[\s*(\w+)\s*\]', line)
-            if match:
-                section = match.group(1).lower()
-                if section == 'moleculetype':
-                    current_molecule = None # Reset on new moleculetype
-                continue
-
-            if section == 'moleculetype':
-                parts = line.split()
-                if len(parts) >= 1:
-                    molecule_name = parts[0]
-                    current_molecule = {
-                        'name': molecule_name,
-                        'beads': [],
-                        'bonds': []
-                    }
-                    definitions[molecule_name] = current_molecule
+    return {name: moleculetype_definition(moltype)
+            for name, moltype in parse_itp(itp_file_path).moleculetypes.items()}
 
-            elif section == 'atoms' and current_molecule:
-                parts = line.split()
-                if len(parts) >= 5:
-                    bead = {
-                        'nr': int(parts[0]),
-                        'type': parts[1],
-                        'resnr': int(parts[2]),
-                        'residue': parts[3],
-                        'atom': parts[4],
-                        'cgnr': int(parts[5]),
-                        'charge': float(parts[6]) if len(parts) > 6 else 0.0,
-                        'mass': float(parts[7]) if len(parts) > 7 else 0.0
-                    }
-                    current_molecule['beads'].append(bead)
-
-            elif section == 'bonds' and current_molecule:
-                parts = line.split()
-                if len(parts) >= 4:
-                    bond = {
-                        'from': int(parts[0]),
-                        'to': int(parts[1]),
-                        'funct': int(parts[2]),
-                        'params': [float(p) for p in parts[3:]]
-                    }
-                    current_molecule['bonds'].append(bond)
+def moleculetype_definition(moltype):
+    """
+    Converts an itp_parser.MoleculeType into the definition dict of read_itp_definitions:
+    {'name', 'beads': [per-atom dicts], 'bonds': [{'from', 'to', 'funct', 'params'}]}.
+    """
+    atoms = moltype.atoms
+    beads = [
+        {
+            'nr': int(a['nr']), 'type': str(a['type']), 'resnr': int(a['resnr']),
+            'residue': str(a['residue']), 'atom': str(a['atom']), 'cgnr': int(a['cgnr']),
+            'charge': float(a['charge']), 'mass': 0.0 if np.isnan(a['mass']) else float(a['mass']),
+        }
+        for a in atoms
+    ]
+    bonds = []
+    table = moltype.section('bonds')
+    if table is not None:
+        for pair, funct, params in zip(table['atoms'], table['funct'], table['params']):
+            n_params = len(params) - int(np.argmax(~np.isnan(params[::-1]))) if (~np.isnan(params)).any() else 0
+            bonds.append({'from': int(pair[0]), 'to': int(pair[1]), 'funct': int(funct),
+                          'params': [float(p) for p in params[:n_params]]})
+    return {'name': moltype.name, 'beads': beads, 'bonds': bonds}
+
+def read_atomtype_masses(itp_file_path):
+    """
+    Returns the masses defined in the [ atomtypes ] section of a force-field file.
 
-    return definitions
+    The mass is the second column before the particle type (A, S, V or D), which covers
+    the layouts with and without bonded type and atomic number.
+    """
+    return dict(parse_itp(itp_file_path).atomtype_masses)
 
 if __name__ == '__main__':
     # Example usage:
@@ -2,217 +2,576 @@ import subprocess
 import os
 import sys
 
-def convert_gro_to_pdb(gro_path, pdb_path, gmx_path):
-    """Converts a .gro file to a .pdb file using gmx editconf."""
-    command = [gmx_path, 'editconf', '-f', gro_path, '-o', pdb_path]
-    try:
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print(f"Successfully converted {gro_path} to {pdb_path}")
-        return pdb_path
-    except FileNotFoundError:
-        print(f"Error: '{gmx_path}' command not found. Is GROMACS installed and in your PATH?", file=sys.stderr)
-        raise
-    except subprocess.CalledProcessError as e:
-        print(f"Error converting {gro_path} to {pdb_path}:", file=sys.stderr)
-        print(e.stderr, file=sys.stderr)
-        raise
+import numpy as np
 
-def convert_pdb_to_gro(pdb_path, gro_path, gmx_path, box_size_nm=None):
-    """Converts a .pdb file to a .gro file using gmx editconf."""
-    command = [gmx_path, 'editconf', '-f', pdb_path, '-o', gro_path]
-    if box_size_nm:
-        command.extend(['-box', str(box_size_nm), str(box_size_nm), str(box_size_nm)])
+from core_utils import cell_list, conversion_cache, free_volume, pipeline, structure_io, tool_runner
+from core_utils.structure import Structure
+
+# Format conversions are done natively by core_utils.structure_io; 'gmx' keeps the
+# former `gmx editconf` route (simulation_parameters.structure_converter).
+DEFAULT_STRUCTURE_CONVERTER = 'native'
+# Packmol meets its tolerance only approximately and its PDB output is rounded to
+# 0.001 Angstrom, so packed copies are accepted down to this much below the tolerance (nm).
+VERIFY_SLACK_NM = 0.005
+
+def _run_editconf(command, src_path, dst_path, gmx_path):
     try:
-        result = subprocess.run(
-            command,
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        print(f"Successfully converted {pdb_path} to {gro_path}")
-        return gro_path
+        tool_runner.run_tool(command)
     except FileNotFoundError:
         print(f"Error: '{gmx_path}' command not found. Is GROMACS installed and in your PATH?", file=sys.stderr)
         raise
     except subprocess.CalledProcessError as e:
-        print(f"Error converting {pdb_path} to {gro_path}:", file=sys.stderr)
+        print(f"Error converting {src_path} to {dst_path}:", file=sys.stderr)
         print(e.stderr, file=sys.stderr)
         raise
 
-def convert_xyz_to_gro(xyz_path, gro_path, gmx_path, molecule_name="MOL"):
-
-    """Converts a .xyz file to a .gro file by manually parsing it."""
-
-    try:
-
-        with open(xyz_path, 'r', encoding='utf-8-sig') as f_xyz:
-
-            lines = f_xyz.readlines()
-
-        
-
-        num_atoms = int(lines[0].strip())
-
-        comment = lines[1].strip()
-
-        atom_lines = lines[2:2+num_atoms]
-
-
-
-        with open(gro_path, 'w') as f_gro:
-
-            f_gro.write(f"{comment}\n")
-
-            f_gro.write(f" {num_atoms}\n")
-
-            
-
-            for i, line in enumerate(atom_lines):
-
-                parts = line.split()
-
-                atom_name = parts[0]
-
-                x = float(parts[1]) / 10.0
-
-                y = float(parts[2]) / 10.0
-
-                z = float(parts[3]) / 10.0
-
-                
-
-                f_gro.write(f"{'1':>5s}{molecule_name:<5s}{atom_name:<5s}{i+1:>5d}{x:8.3f}{y:8.3f}{z:8.3f}\n")
-
-
-
-            f_gro.write("   10.00000   10.00000   10.00000\n")
+def _conversion_params(converter, gmx_path, **extra):
+    """Conversion cache parameters: what besides the input content determines the output."""
+    tool = pipeline.tool_version(gmx_path) if converter == 'gmx' else f"structure_io:{structure_io.WRITER_VERSION}"
+    return dict(converter=converter, tool=tool, **extra)
 
+def convert_gro_to_pdb(gro_path, pdb_path, gmx_path, converter=DEFAULT_STRUCTURE_CONVERTER, cache=None):
+    """
+    Converts a .gro file to a .pdb file, natively or with gmx editconf (converter='gmx').
+    With a conversion_cache.ConversionCache, unchanged inputs are served from the cache.
+    """
+    def _convert(src, dst):
+        # editconf reads only plain coordinate files; compressed or .npz checkpoints are converted natively.
+        if converter == 'gmx' and not structure_io.split_compression(src)[1] and structure_io.structure_format(src) != '.npz':
+            _run_editconf([gmx_path, 'editconf', '-f', src, '-o', dst], src, dst, gmx_path)
+        else:
+            structure_io.write_pdb(dst, structure_io.read_structure(src))
+
+    if cache is None:
+        _convert(gro_path, pdb_path)
+    elif cache.fetch_or_convert(gro_path, pdb_path, 'gro2pdb', _conversion_params(converter, gmx_path), _convert):
+        print(f"Converted {gro_path} to {pdb_path} (conversion cache hit)")
+        return pdb_path
+    print(f"Successfully converted {gro_path} to {pdb_path}")
+    return pdb_path
 
+def convert_pdb_to_gro(pdb_path, gro_path, gmx_path, box_size_nm=None, converter=DEFAULT_STRUCTURE_CONVERTER, cache=None):
+    """
+    Converts a .pdb file to a .gro file, natively or with gmx editconf (converter='gmx').
+    With a conversion_cache.ConversionCache, unchanged inputs are served from the cache.
+    """
+    def _convert(src, dst):
+        if converter == 'gmx':
+            command = [gmx_path, 'editconf', '-f', src, '-o', dst]
+            if box_size_nm:
+                command.extend(['-box', str(box_size_nm), str(box_size_nm), str(box_size_nm)])
+            _run_editconf(command, src, dst, gmx_path)
+        else:
+            structure = structure_io.read_pdb(src)
+            if box_size_nm:
+                structure.box[:] = box_size_nm
+            structure_io.write_gro(dst, structure)
+
+    if cache is None:
+        _convert(pdb_path, gro_path)
+    elif cache.fetch_or_convert(pdb_path, gro_path, 'pdb2gro', _conversion_params(converter, gmx_path, box_size_nm=box_size_nm), _convert):
+        print(f"Converted {pdb_path} to {gro_path} (conversion cache hit)")
+        return gro_path
+    print(f"Successfully converted {pdb_path} to {gro_path}")
+    return gro_path
 
+def convert_xyz_to_gro(xyz_path, gro_path, gmx_path, molecule_name="MOL"):
+    """Converts a .xyz file (Angstrom) to a .gro file with a 10 nm box."""
+    try:
+        structure_io.write_gro(gro_path, structure_io.read_xyz(xyz_path, resname=molecule_name))
         print(f"Successfully converted {xyz_path} to {gro_path} manually.")
-
         return gro_path
-
-
-
     except Exception as e:
-
         print(f"Error manually converting {xyz_path} to {gro_path}:", file=sys.stderr)
-
         print(e, file=sys.stderr)
-
         raise
 
-def run_packmol(packmol_path, input_content, output_dir):
-    """
-    Generates a Packmol input file and runs Packmol.
-    """
+PACKMOL_FAIL_PATTERNS = ("ERROR", "Could not pack the molecules in the required number of tries.")
+
+def _packmol_invocation(packmol_path, input_content, output_dir, timeout=None):
+    """Writes the packmol input file; returns the (command, kwargs) pair for core_utils.tool_runner."""
     inp_filename = os.path.join(output_dir, "packmol_input.inp")
     with open(inp_filename, 'w') as f:
         f.write(input_content)
-
-    print("\n--- Running Packmol... ---")
     print(f"Input file generated at: {inp_filename}")
+    return [packmol_path], dict(cwd=output_dir, input=input_content, log_path=os.path.join(output_dir, "packmol.log"),
+                                timeout=timeout, fail_patterns=PACKMOL_FAIL_PATTERNS)
 
-    command = [packmol_path]
-
-    try:
-        with open(inp_filename, 'r') as f:
-            result = subprocess.run(
-                command,
-                stdin=f,
-                check=True,
-                capture_output=True,
-                text=True,
-                cwd=output_dir
-            )
-        print("Packmol execution successful.")
-        print(result.stdout)
-        if result.stderr:
-            print("Packmol stderr:", result.stderr, file=sys.stderr)
-
-        if "ERROR" in result.stdout or "Could not pack the molecules in the required number of tries." in result.stdout:
-            raise subprocess.CalledProcessError(1, command, stdout=result.stdout, stderr=result.stderr)
-
-    except FileNotFoundError:
+def _report_packmol_failure(e, packmol_path):
+    if isinstance(e, FileNotFoundError):
         print(f"Error: Packmol executable not found: '{packmol_path}'", file=sys.stderr)
-        raise
-    except subprocess.CalledProcessError as e:
-        print("Error: Packmol execution failed.", file=sys.stderr)
+    else:
+        print(f"Error: Packmol execution failed: {e}", file=sys.stderr)
         print(e.stdout, file=sys.stderr)
         print(e.stderr, file=sys.stderr)
-        raise
 
-def pack_system_with_molecules(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params):
+def run_packmol(packmol_path, input_content, output_dir, timeout=None):
     """
-    Runs a full packing step: converts to PDB, generates packmol input, runs packmol, and converts back to GRO.
+    Generates a Packmol input file and runs Packmol.
 
-    Args:
-        base_structure_gro (str): Path to the base .gro file (e.g., initial hydrogel).
-        molecules_to_add (list): A list of dictionaries, where each dict contains 'file' (path to .gro) and 'number'.
-        final_output_gro (str): Path for the final, packed .gro file.
-        box_size_nm (float): The box size in nanometers.
-        sim_params (dict): Dictionary of simulation parameters from the config.
+    The output is streamed to packmol.log in output_dir. Packmol is stopped as soon as
+    it reports a failure, or after timeout seconds.
     """
-    print(f"\n--- pack_system_with_molecules: Packing into {final_output_gro} ---")
+    print("\n--- Running Packmol... ---")
+    command, kwargs = _packmol_invocation(packmol_path, input_content, output_dir, timeout)
+    try:
+        tool_runner.run_tool(command, **kwargs)
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        _report_packmol_failure(e, packmol_path)
+        raise
+    print(f"Packmol execution successful (log: {kwargs['log_path']}).")
+
+def _packing_setup(sim_params):
+    """Scratch directory and conversion settings shared by the packmol based packers."""
     output_dir = sim_params['output_dir']
+    scratch_dir = sim_params.get('scratch_dir') or os.path.join(output_dir, "scratch")
+    os.makedirs(scratch_dir, exist_ok=True)
     gmx_path = sim_params.get('gromacs_executable_path') or 'gmx_mpi'
-    packmol_path = sim_params['packmol_path']
-    packmol_threshold = sim_params['packmol_threshold']
+    converter = sim_params.get('structure_converter', DEFAULT_STRUCTURE_CONVERTER)
+    return scratch_dir, gmx_path, converter, conversion_cache.from_sim_params(sim_params)
 
-    # 1. Convert all source .gro files to .pdb for packmol
-    base_structure_pdb = convert_gro_to_pdb(
-        base_structure_gro,
-        os.path.join(output_dir, f"{os.path.splitext(os.path.basename(base_structure_gro))[0]}.pdb"),
-        gmx_path
-    )
-    
+def _molecule_pdbs(molecules_to_add, scratch_dir, gmx_path, converter, cache):
+    """PDB copies of the molecules to add, with their in-memory templates."""
     molecules_pdb_to_add = []
     for mol in molecules_to_add:
-        pdb_path = convert_gro_to_pdb(
-            mol['file'],
-            os.path.join(output_dir, f"{os.path.splitext(os.path.basename(mol['file']))[0]}.pdb"),
-            gmx_path
-        )
-        molecules_pdb_to_add.append({"file": pdb_path, "number": mol['number']})
-
-    # 2. Generate packmol input content
-    box_size_angstrom = box_size_nm * 10
-    box_center = box_size_angstrom / 2.0
-    temp_output_pdb = os.path.join(output_dir, "temp_packed_output.pdb")
+        if mol.get('pdb') and os.path.exists(mol['pdb']):
+            # Already converted by an upstream preparation stage.
+            pdb_path = mol['pdb']
+        else:
+            pdb_path = convert_gro_to_pdb(
+                mol['file'],
+                os.path.join(scratch_dir, f"{os.path.splitext(os.path.basename(mol['file']))[0]}.pdb"),
+                gmx_path, converter, cache
+            )
+        molecules_pdb_to_add.append({"file": pdb_path, "number": mol['number'], "template": structure_io.read_gro(mol['file'])})
+    return molecules_pdb_to_add
 
+def _packmol_input(tolerance, output_pdb, fixed_pdb, fixed_lines, molecules, region_lo, region_hi, constraint_lines=()):
+    """
+    Packmol input: one fixed structure (if any) and each molecule type inside the region
+    (Angstrom), with constraint_lines added to every molecule type.
+    """
     lines = [
-        f"tolerance {packmol_threshold}",
+        f"tolerance {tolerance}",
         "filetype pdb",
-        f"output {os.path.abspath(temp_output_pdb)}",
+        f"output {os.path.abspath(output_pdb)}",
         "",
-        f"structure {os.path.abspath(base_structure_pdb)}",
-        "  number 1",
-        f"  fixed {box_center:.4f} {box_center:.4f} {box_center:.4f} 0. 0. 0.",
-        "end structure",
-        ""
     ]
-    for mol in molecules_pdb_to_add:
+    if fixed_pdb:
+        lines.extend([f"structure {os.path.abspath(fixed_pdb)}", "  number 1"] + fixed_lines + ["end structure", ""])
+    for mol in molecules:
         if mol['number'] > 0:
             lines.extend([
                 f"structure {os.path.abspath(mol['file'])}",
                 f"  number {mol['number']}",
-                f"  inside box 0. 0. 0. {box_size_angstrom:.4f} {box_size_angstrom:.4f} {box_size_angstrom:.4f}",
+                f"  inside box {region_lo[0]:.4f} {region_lo[1]:.4f} {region_lo[2]:.4f} {region_hi[0]:.4f} {region_hi[1]:.4f} {region_hi[2]:.4f}",
+                *constraint_lines,
                 "end structure",
                 ""
             ])
-    packmol_inp_content = "\n".join(lines)
+    return "\n".join(lines)
+
+def _fixed_in_place(structure):
+    """Packmol 'fixed' lines that leave the beads of structure where they are."""
+    # 'center' puts the geometric centre at the given point, i.e. leaves the beads where they are.
+    centre = structure.positions.mean(axis=0) * 10.0
+    return [f"  fixed {centre[0]:.4f} {centre[1]:.4f} {centre[2]:.4f} 0. 0. 0.", "  center"]
+
+
+def pack_system_with_molecules(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params):
+    """
+    Runs a full packing step: prepares PDB inputs, generates packmol input, runs packmol, and rebuilds the packed system in memory.
+
+    Intermediate files are written to a scratch directory only because packmol needs them.
+    Atom and residue names of the result come from the in-memory inputs, only the
+    coordinates are taken from the packmol output. With simulation_parameters
+    'packmol_subdomains' > 1 the box is packed by pack_system_decomposed instead, with
+    'packmol_region_constraints' by pack_system_constrained.
+
+    Args:
+        base_structure_gro (str or Structure): Path to the base .gro file (e.g., initial hydrogel) or the
+            in-memory system returned by the previous packing step.
+        molecules_to_add (list): A list of dictionaries, where each dict contains 'file' (path to .gro) and 'number',
+            and optionally 'pdb', an already converted copy of 'file' to use as is.
+        final_output_gro (str or None): Path for the final, packed .gro file; nothing is written if None.
+        box_size_nm (float): The box size in nanometers.
+        sim_params (dict): Dictionary of simulation parameters from the config.
+
+    Returns:
+        Structure: The packed system. Its pdb_path points at the packmol output so the next step can use it directly.
+    """
+    if sim_params.get('packmol_subdomains', 1) > 1:
+        return pack_system_decomposed(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params)
+    if sim_params.get('packmol_region_constraints', False):
+        return pack_system_constrained(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params)
+
+    print(f"\n--- pack_system_with_molecules: Packing into {final_output_gro or 'memory'} ---")
+    scratch_dir, gmx_path, converter, cache = _packing_setup(sim_params)
+    packmol_path = sim_params['packmol_path']
+    packmol_threshold = sim_params['packmol_threshold']
+    step_tag = os.path.splitext(os.path.basename(final_output_gro))[0] if final_output_gro else "packed"
+
+    # 1. Fixed base structure as PDB for packmol: reuse the previous packmol output when it still matches
+    if isinstance(base_structure_gro, Structure):
+        base_structure = base_structure_gro
+        if base_structure.pdb_path and os.path.exists(base_structure.pdb_path):
+            base_structure_pdb = base_structure.pdb_path
+        else:
+            base_structure_pdb = structure_io.write_pdb(os.path.join(scratch_dir, f"{step_tag}_base.pdb"), base_structure)
+    else:
+        base_structure = structure_io.read_structure(base_structure_gro)
+        base_structure_pdb = convert_gro_to_pdb(
+            base_structure_gro,
+            os.path.join(scratch_dir, f"{os.path.splitext(os.path.basename(base_structure_gro))[0]}.pdb"),
+            gmx_path, converter, cache
+        )
+
+    molecules_pdb_to_add = _molecule_pdbs(molecules_to_add, scratch_dir, gmx_path, converter, cache)
+
+    # 2. Generate packmol input content
+    box_size_angstrom = box_size_nm * 10
+    temp_output_pdb = os.path.join(scratch_dir, f"{step_tag}_packmol.pdb")
+    packmol_inp_content = _packmol_input(
+        packmol_threshold, temp_output_pdb, base_structure_pdb, _fixed_in_place(base_structure),
+        molecules_pdb_to_add, [0.0] * 3, [box_size_angstrom] * 3
+    )
 
     # 3. Run packmol
-    run_packmol(packmol_path, packmol_inp_content, output_dir)
+    run_packmol(packmol_path, packmol_inp_content, scratch_dir, tool_runner.timeout_for(sim_params, 'packmol'))
+
+    # 4. Rebuild the packed system: names from memory, coordinates from packmol (same atom order)
+    parts = [base_structure]
+    next_resid = int(base_structure.resid.max()) + 1 if base_structure.n_atoms else 1
+    for mol in molecules_pdb_to_add:
+        if mol['number'] > 0:
+            parts.append(mol['template'].replicate(mol['number'], first_resid=next_resid))
+            next_resid += mol['number']
+    packed = Structure.concatenate(parts, box=[box_size_nm] * 3, title="Packed system")
+    positions = structure_io.read_pdb_positions(temp_output_pdb)
+    if len(positions) != packed.n_atoms:
+        raise RuntimeError(f"Packmol output '{temp_output_pdb}' has {len(positions)} atoms, expected {packed.n_atoms}")
+    packed = packed.with_positions(positions, pdb_path=temp_output_pdb)
+
+    if final_output_gro:
+        structure_io.write_structure(final_output_gro, packed)
+    print(f"--- Packing step complete. Final system at: {final_output_gro or 'memory'} ---")
+    return packed
+
+def _split_counts(number, weights):
+    """Splits number proportionally to weights (largest remainder), returning integers."""
+    weights = np.asarray(weights, dtype=np.float64)
+    if number == 0 or weights.sum() <= 0:
+        counts = np.zeros(len(weights), dtype=np.int64)
+        counts[:1] = number
+        return counts
+    exact = number * weights / weights.sum()
+    counts = np.floor(exact).astype(np.int64)
+    counts[np.argsort(counts - exact)[:number - counts.sum()]] += 1
+    return counts
+
+def _subdomain_invocation(packmol_path, tolerance, work_dir, fixed, molecules, counts, lo_nm, hi_nm, timeout=None):
+    """
+    Writes the packmol inputs of one subdomain.
 
-    # 4. Convert the packmol output PDB to the final GRO file
-    convert_pdb_to_gro(temp_output_pdb, final_output_gro, gmx_path, box_size_nm)
-    
-    print(f"--- Packing step complete. Final system at: {final_output_gro} ---")
-    return final_output_gro
\ No newline at end of file
+    Returns:
+        tuple: (command, kwargs) for core_utils.tool_runner and the packmol output path.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    sub_molecules = [dict(mol, number=int(n)) for mol, n in zip(molecules, counts)]
+    fixed_pdb, fixed_lines = None, []
+    if fixed.n_atoms:
+        fixed_pdb = structure_io.write_pdb(os.path.join(work_dir, "fixed.pdb"), fixed)
+        fixed_lines = _fixed_in_place(fixed)
+    output_pdb = os.path.join(work_dir, "packmol.pdb")
+    # Shrinking every region by half the tolerance keeps copies of neighbouring subdomains apart.
+    margin = tolerance / 2.0
+    command, kwargs = _packmol_invocation(packmol_path, _packmol_input(
+        tolerance * 10.0, output_pdb, fixed_pdb, fixed_lines, sub_molecules, (lo_nm + margin) * 10.0, (hi_nm - margin) * 10.0
+    ), work_dir, timeout)
+    return command, kwargs, output_pdb
+
+def _subdomain_result(output_pdb, n_fixed, molecules, counts):
+    """Per molecule type, the (count, n_atoms, 3) coordinates (nm) placed by one subdomain run."""
+    positions = structure_io.read_pdb_positions(output_pdb)[n_fixed:]
+    placed, start = [], 0
+    for mol, n in zip(molecules, counts):
+        n_atoms = mol['template'].n_atoms
+        placed.append(positions[start:start + n * n_atoms].reshape(int(n), n_atoms, 3))
+        start += n * n_atoms
+    if start != len(positions):
+        raise RuntimeError(f"Packmol output '{output_pdb}' has {len(positions)} added atoms, expected {start}")
+    return placed
+
+def _verify_and_repair(base, molecules, placed, box_size_nm, tolerance, sim_params, where):
+    """
+    Native verification of packed copies: every copy closer than the tolerance (less
+    VERIFY_SLACK_NM) to the base or to an earlier copy is dropped and re-placed by
+    rigid-body insertion.
+
+    Args:
+        placed (list): Per molecule type, the (n_atoms, 3) coordinates of its copies.
+        where (str): Describes the likely clash location in the repair message.
+
+    Returns:
+        Structure: base followed by the copies of each molecule type.
+    """
+    box = np.full(3, float(box_size_nm))
+    capacity = base.n_atoms + sum(mol['number'] * mol['template'].n_atoms for mol in molecules)
+    cells = cell_list.CellList(box, tolerance, np.mod(base.positions, box_size_nm), capacity=capacity)
+    rng = np.random.default_rng(sim_params.get('random_seed', 0))
+    clash_distance = max(tolerance - VERIFY_SLACK_NM, 0.0)
+    parts = [base]
+    next_resid = int(base.resid.max()) + 1 if base.n_atoms else 1
+    for mol, copies in zip(molecules, placed):
+        kept, n_clashing = [], 0
+        for copy in copies:
+            copy_wrapped = np.mod(copy, box_size_nm)
+            if cells.any_within(copy_wrapped, clash_distance).any():
+                n_clashing += 1
+                continue
+            cells.add(copy_wrapped)
+            kept.append(copy)
+        name = os.path.basename(mol['file'])
+        if n_clashing:
+            print(f"Repairing {n_clashing} clashing copies of '{name}' {where}")
+            kept.extend(_insert_copies(cells, mol['template'], n_clashing, box_size_nm, tolerance, rng,
+                                       sim_params.get('insertion_max_trials', 2000), name))
+        replicas = mol['template'].replicate(mol['number'], first_resid=next_resid)
+        parts.append(replicas.with_positions(np.concatenate(kept)))
+        next_resid += mol['number']
+    return Structure.concatenate(parts, box=box, title="Packed system")
+
+def pack_system_decomposed(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params):
+    """
+    Spatially decomposed packing: the box is split into packmol_subdomains^3 subdomains
+    that are packed by concurrent packmol processes (simulation_parameters
+    'packmol_workers', default: all cores).
+
+    Each subdomain receives a share of every molecule type proportional to its
+    accessible free volume, and as fixed structure the beads of the base system within
+    'packmol_halo_nm' (default: the tolerance) of it, including periodic images. The
+    copies are confined to the subdomain shrunk by half the tolerance. The merged result
+    is verified against a periodic cell list; copies that still clash are removed and
+    re-placed by native insertion. Same arguments and return value as
+    pack_system_with_molecules (pdb_path is not set).
+    """
+    print(f"\n--- pack_system_decomposed: Packing into {final_output_gro or 'memory'} ---")
+    scratch_dir, gmx_path, converter, cache = _packing_setup(sim_params)
+    n_div = int(sim_params['packmol_subdomains'])
+    workers = sim_params.get('packmol_workers') or os.cpu_count() or 1
+    tolerance = sim_params['packmol_threshold'] / 10.0
+    halo = sim_params.get('packmol_halo_nm', tolerance)
+    step_tag = os.path.splitext(os.path.basename(final_output_gro))[0] if final_output_gro else "packed"
+    box = np.full(3, float(box_size_nm))
+    edge = box_size_nm / n_div
+    if edge + 2 * halo >= box_size_nm:
+        raise ValueError(f"Subdomains of {edge:.2f} nm with a {halo:.2f} nm halo do not fit a {box_size_nm:.2f} nm box")
+
+    base = base_structure_gro if isinstance(base_structure_gro, Structure) else structure_io.read_structure(base_structure_gro)
+    molecules = [mol for mol in _molecule_pdbs(molecules_to_add, scratch_dir, gmx_path, converter, cache) if mol['number'] > 0]
+
+    free_map = free_volume.FreeVolumeMap(base.positions, box, spacing=sim_params.get('free_volume_spacing_nm', 0.1))
+    weights = free_map.accessible_volume_by_subdomain(n_div, tolerance)
+    shares = np.array([_split_counts(mol['number'], weights) for mol in molecules]).reshape(len(molecules), -1)
+
+    jobs = []
+    wrapped = np.mod(base.positions, box_size_nm)
+    for index, cell in enumerate(np.ndindex(n_div, n_div, n_div)):
+        if not shares[:, index].any():
+            continue
+        lo = np.array(cell) * edge
+        centre = lo + edge / 2.0
+        # Nearest periodic image of every bead relative to this subdomain
+        images = wrapped - box_size_nm * np.round((wrapped - centre) / box_size_nm)
+        near = np.all((images >= lo - halo) & (images <= lo + edge + halo), axis=1)
+        fixed = Structure(base.resid[near], base.resname[near], base.atomname[near], images[near], box)
+        work_dir = os.path.join(scratch_dir, f"{step_tag}_sub{index:03d}")
+        jobs.append((work_dir, fixed, shares[:, index], lo, lo + edge))
+    print(f"Packing {len(jobs)} subdomains of {edge:.2f} nm with up to {workers} concurrent packmol processes")
+
+    invocations, outputs = [], []
+    for work_dir, fixed, counts, lo, hi in jobs:
+        command, kwargs, output_pdb = _subdomain_invocation(sim_params['packmol_path'], tolerance, work_dir, fixed, molecules,
+                                                            counts, lo, hi, tool_runner.timeout_for(sim_params, 'packmol'))
+        invocations.append((command, kwargs))
+        outputs.append(output_pdb)
+    try:
+        tool_runner.run_tools(invocations, max_concurrent=workers)
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        _report_packmol_failure(e, sim_params['packmol_path'])
+        raise
+    results = [_subdomain_result(output_pdb, fixed.n_atoms, molecules, counts)
+               for output_pdb, (_, fixed, counts, _, _) in zip(outputs, jobs)]
+
+    # Merge with a boundary overlap check; clashing copies are re-placed natively.
+    placed = [[copy for result in results for copy in result[t]] for t in range(len(molecules))]
+    packed = _verify_and_repair(base, molecules, placed, box_size_nm, tolerance, sim_params, "at subdomain boundaries")
+    if final_output_gro:
+        structure_io.write_structure(final_output_gro, packed)
+    print(f"--- Decomposed packing complete. Final system at: {final_output_gro or 'memory'} ---")
+    return packed
+
+def pack_system_constrained(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params):
+    """
+    Packmol packing with occupancy-derived region constraints.
+
+    The blocks of a voxel free-volume map of the base system that lie entirely within
+    the tolerance of its beads are passed to packmol as 'outside box' exclusions of
+    every species: up to 'packmol_max_region_constraints' (default 200) runs along z of
+    blocks of 'packmol_region_block_nm' (default 0.5). Base beads deeper than the
+    tolerance inside an excluded box are left out of the fixed structure; with
+    'packmol_fixed_proxy' the rest is decimated further to one bead per cell of
+    'packmol_proxy_spacing_nm' (default: the tolerance). The packmol result then goes
+    through the native verification pass, which re-places clashing copies. Same
+    arguments and return value as pack_system_with_molecules (pdb_path is not set).
+    """
+    print(f"\n--- pack_system_constrained: Packing into {final_output_gro or 'memory'} ---")
+    scratch_dir, gmx_path, converter, cache = _packing_setup(sim_params)
+    tolerance = sim_params['packmol_threshold'] / 10.0
+    step_tag = os.path.splitext(os.path.basename(final_output_gro))[0] if final_output_gro else "packed"
+    box = np.full(3, float(box_size_nm))
+
+    base = base_structure_gro if isinstance(base_structure_gro, Structure) else structure_io.read_structure(base_structure_gro)
+    molecules = [mol for mol in _molecule_pdbs(molecules_to_add, scratch_dir, gmx_path, converter, cache) if mol['number'] > 0]
+
+    free_map = free_volume.FreeVolumeMap(base.positions, box, spacing=sim_params.get('free_volume_spacing_nm', 0.1))
+    lo, hi = free_map.excluded_boxes(tolerance, sim_params.get('packmol_region_block_nm', 0.5),
+                                     sim_params.get('packmol_max_region_constraints', 200))
+    constraint_lines = [f"  outside box {a[0]:.4f} {a[1]:.4f} {a[2]:.4f} {b[0]:.4f} {b[1]:.4f} {b[2]:.4f}"
+                        for a, b in zip(lo * 10.0, hi * 10.0)]
+
+    # Fixed proxy: beads that the exclusions already keep every copy away from are dropped.
+    wrapped = np.mod(base.positions, box_size_nm)
+    keep = np.ones(base.n_atoms, dtype=bool)
+    for a, b in zip(lo, hi):
+        keep &= ~np.all((wrapped > a + tolerance) & (wrapped < b - tolerance), axis=1)
+    if sim_params.get('packmol_fixed_proxy', False):
+        spacing = sim_params.get('packmol_proxy_spacing_nm', tolerance)
+        shape = np.maximum(1, np.floor(box / spacing)).astype(np.int64)
+        cell = np.minimum((wrapped / (box / shape)).astype(np.int64), shape - 1)
+        kept = np.flatnonzero(keep)
+        _, first = np.unique(np.ravel_multi_index(cell[kept].T, tuple(shape)), return_index=True)
+        keep[:] = False
+        keep[kept[first]] = True
+    fixed = Structure(base.resid[keep], base.resname[keep], base.atomname[keep], wrapped[keep], box)
+    print(f"{len(constraint_lines)} outside-box exclusions, fixed structure reduced from {base.n_atoms} to {fixed.n_atoms} beads")
+
+    fixed_pdb, fixed_lines = None, []
+    if fixed.n_atoms:
+        fixed_pdb = structure_io.write_pdb(os.path.join(scratch_dir, f"{step_tag}_fixed_proxy.pdb"), fixed)
+        fixed_lines = _fixed_in_place(fixed)
+    output_pdb = os.path.join(scratch_dir, f"{step_tag}_packmol.pdb")
+    run_packmol(sim_params['packmol_path'], _packmol_input(
+        sim_params['packmol_threshold'], output_pdb, fixed_pdb, fixed_lines, molecules,
+        [0.0] * 3, [box_size_nm * 10.0] * 3, constraint_lines
+    ), scratch_dir, tool_runner.timeout_for(sim_params, 'packmol'))
+
+    positions = structure_io.read_pdb_positions(output_pdb)[fixed.n_atoms:]
+    expected = sum(mol['number'] * mol['template'].n_atoms for mol in molecules)
+    if len(positions) != expected:
+        raise RuntimeError(f"Packmol output '{output_pdb}' has {len(positions)} added atoms, expected {expected}")
+    placed, start = [], 0
+    for mol in molecules:
+        n_atoms = mol['template'].n_atoms
+        placed.append(positions[start:start + mol['number'] * n_atoms].reshape(mol['number'], n_atoms, 3))
+        start += mol['number'] * n_atoms
+
+    packed = _verify_and_repair(base, molecules, placed, box_size_nm, tolerance, sim_params, "near the fixed proxy")
+    if final_output_gro:
+        structure_io.write_structure(final_output_gro, packed)
+    print(f"--- Constrained packing complete. Final system at: {final_output_gro or 'memory'} ---")
+    return packed
+
+def random_rotations(n, rng):
+    """Returns n uniformly distributed random rotation matrices, (n, 3, 3)."""
+    # Uniform unit quaternions (Shoemake)
+    u1, u2, u3 = rng.random((3, n))
+    a, b = np.sqrt(1.0 - u1), np.sqrt(u1)
+    w, x = a * np.sin(2 * np.pi * u2), a * np.cos(2 * np.pi * u2)
+    y, z = b * np.sin(2 * np.pi * u3), b * np.cos(2 * np.pi * u3)
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=-1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=-1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=1)
+
+def _insertion_trials(centred, n_trials, box_size_nm, rng):
+    """Randomly rotated copies of a centred template, translated so they lie inside the box when they fit."""
+    rotated = np.einsum('tij,aj->tai', random_rotations(n_trials, rng), centred)
+    lo = -rotated.min(axis=1)
+    hi = box_size_nm - rotated.max(axis=1)
+    # Copies larger than the box are placed anywhere and rely on periodicity.
+    hi = np.where(hi < lo, lo + box_size_nm, hi)
+    shift = lo + rng.random((n_trials, 3)) * (hi - lo)
+    return rotated + shift[:, None, :]
+
+def _insert_copies(cells, template, number, box_size_nm, tolerance, rng, max_trials_per_copy, name):
+    """
+    Places `number` copies of template into the free space of the cell list, adding
+    them to it. Returns the list of placed (n_atoms, 3) coordinate arrays.
+    """
+    centred = template.positions - template.positions.mean(axis=0)
+    placed, n_trials = [], 0
+    while len(placed) < number:
+        remaining = number - len(placed)
+        if n_trials >= max_trials_per_copy * number:
+            raise RuntimeError(f"Placed only {len(placed)} of {number} copies of '{name}' "
+                               f"after {n_trials} trials")
+        batch = max(64, 4 * remaining)
+        trials = _insertion_trials(centred, batch, box_size_nm, rng)
+        n_trials += batch
+        clash = cells.any_within(np.mod(trials, box_size_nm).reshape(-1, 3), tolerance)
+        accepted_in_batch = 0
+        for candidate in trials[~clash.reshape(batch, -1).any(axis=1)]:
+            wrapped = np.mod(candidate, box_size_nm)
+            # Copies accepted earlier in this batch are not in the screening above.
+            if accepted_in_batch and cells.any_within(wrapped, tolerance).any():
+                continue
+            cells.add(wrapped)
+            placed.append(candidate)
+            accepted_in_batch += 1
+            if len(placed) == number:
+                break
+    print(f"Inserted {number} copies of '{name}' ({n_trials} trials)")
+    return placed
+
+def insert_molecules(base_structure_gro, molecules_to_add, final_output_gro, box_size_nm, sim_params):
+    """
+    Native alternative to pack_system_with_molecules for rigid molecules: places copies
+    by random rotation and translation, rejecting trials with a bead closer than the
+    tolerance (packmol_threshold, converted from Angstrom to nm) to any existing bead.
+
+    Trials are generated and screened against a periodic cell list in vectorized
+    batches; the survivors are then committed one by one, re-checking each against the
+    copies accepted before it. Same arguments and return value as
+    pack_system_with_molecules.
+
+    Raises:
+        RuntimeError: If a molecule cannot be placed within 'insertion_max_trials'
+            (simulation_parameters, default 2000) trials per copy.
+    """
+    print(f"\n--- insert_molecules: Inserting into {final_output_gro or 'memory'} ---")
+    base = base_structure_gro if isinstance(base_structure_gro, Structure) else structure_io.read_structure(base_structure_gro)
+    box = np.full(3, float(box_size_nm))
+    tolerance = sim_params['packmol_threshold'] / 10.0
+    max_trials_per_copy = sim_params.get('insertion_max_trials', 2000)
+    rng = np.random.default_rng(sim_params.get('random_seed', 0))
+
+    templates = [(os.path.basename(mol['file']), structure_io.read_gro(mol['file']), int(mol['number']))
+                 for mol in molecules_to_add if mol['number'] > 0]
+    capacity = base.n_atoms + sum(t.n_atoms * n for _, t, n in templates)
+    cells = cell_list.CellList(box, tolerance, np.mod(base.positions, box_size_nm), capacity=capacity)
+
+    parts = [base]
+    next_resid = int(base.resid.max()) + 1 if base.n_atoms else 1
+    for name, template, number in templates:
+        placed = _insert_copies(cells, template, number, box_size_nm, tolerance, rng, max_trials_per_copy, name)
+        copies = template.replicate(number, first_resid=next_resid)
+        parts.append(copies.with_positions(np.concatenate(placed)))
+        next_resid += number
+
+    packed = Structure.concatenate(parts, box=box, title="Packed system")
+    if final_output_gro:
+        structure_io.write_structure(final_output_gro, packed)
+    print(f"--- Insertion step complete. Final system at: {final_output_gro or 'memory'} ---")
+    return packed
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+MANIFEST_FILENAME = "stage_manifest.json"
+
+_tool_version_cache = {}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tool_version(executable):
+    """
+    Returns an identity string for an external executable.
+
+    Neither packmol nor every GROMACS build has a cheap, side-effect free version flag,
+    so the resolved path plus size and mtime of the binary is used instead. Replacing or
+    upgrading the tool changes this string and invalidates the stages that used it.
+    """
+    if executable in _tool_version_cache:
+        return _tool_version_cache[executable]
+    resolved = shutil.which(executable) if executable else None
+    if resolved is None:
+        identity = f"{executable}:missing"
+    else:
+        stat = os.stat(resolved)
+        identity = f"{os.path.realpath(resolved)}:{stat.st_size}:{int(stat.st_mtime)}"
+    _tool_version_cache[executable] = identity
+    return identity
+
+
+def fingerprint(config_slice, input_files=(), tools=()):
+    """
+    Computes the input fingerprint of a pipeline stage.
+
+    Args:
+        config_slice: JSON-serializable part of the configuration the stage depends on.
+        input_files (iterable): Upstream files the stage reads; hashed by content.
+        tools (iterable): External executables the stage runs.
+
+    Returns:
+        str: SHA-256 hex digest over the config slice, input hashes and tool identities.
+    """
+    payload = {
+        "config": config_slice,
+        "inputs": {os.path.abspath(p): file_sha256(p) for p in input_files if p},
+        "tools": {t: tool_version(t) for t in tools if t},
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class StageManifest:
+    """
+    Records, per pipeline stage, the input fingerprint, the output file hashes and any
+    small results (box size, molecule counts, ...) later stages need.
+
+    A stage is current when its stored fingerprint equals the freshly computed one and
+    all of its recorded outputs still exist with unchanged content.
+    """
+
+    def __init__(self, output_dir, enabled=True):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.enabled = enabled
+        self.stages = {}
+        if enabled and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.stages = json.load(f).get('stages', {})
+            except (OSError, ValueError) as e:
+                print(f"Warning: could not read stage manifest '{self.path}', starting fresh: {e}", file=sys.stderr)
+                self.stages = {}
+
+    def is_current(self, stage, stage_fingerprint):
+        if not self.enabled:
+            return False
+        entry = self.stages.get(stage)
+        if entry is None or entry.get('fingerprint') != stage_fingerprint:
+            return False
+        for path, digest in entry.get('outputs', {}).items():
+            if not os.path.exists(path) or file_sha256(path) != digest:
+                return False
+        return True
+
+    def results(self, stage):
+        return self.stages.get(stage, {}).get('results', {})
+
+    def record(self, stage, stage_fingerprint, outputs, results=None):
+        self.stages[stage] = {
+            "fingerprint": stage_fingerprint,
+            "outputs": {os.path.abspath(p): file_sha256(p) for p in outputs},
+            "results": results or {},
+        }
+        self.save()
+
+    def invalidate(self, stage):
+        if self.stages.pop(stage, None) is not None:
+            self.save()
+
+    def save(self):
+        if not self.enabled:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"stages": self.stages}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class Stage:
+    """
+    A node of the workflow graph.
+
+    Dependencies are derived from the declared files: a stage depends on every stage
+    that lists one of its inputs among its outputs. `after` adds explicit dependencies
+    for stages that only exchange results, not files.
+
+    Args:
+        name (str): Unique stage name, also the manifest key.
+        func (callable): Called as func(upstream) where upstream maps each dependency
+            name to its results dict; must return a JSON-serializable dict. Stages with
+            executor='process' need a module-level func.
+        inputs (list): Files read by the stage.
+        outputs (list): Files written by the stage.
+        config_slice: Configuration the stage depends on (part of the fingerprint).
+        tools (iterable): External executables used by the stage.
+        after (iterable): Names of additional stages that must finish first.
+        executor (str): 'thread' or 'process'.
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), config_slice=None, tools=(), after=(), executor='thread'):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor '{executor}' for stage '{name}'")
+        self.name = name
+        self.func = func
+        self.inputs = [p for p in inputs if p]
+        self.outputs = [p for p in outputs if p]
+        # Snapshot taken when the graph is built: stages may mutate the live configuration
+        # (e.g. monomer definitions) while running, and the fingerprint must not depend on
+        # which stages already ran in this process.
+        self.config_slice = json.loads(json.dumps(config_slice, sort_keys=True, default=str))
+        self.tools = [t for t in tools if t]
+        self.after = list(after)
+        self.executor = executor
+
+
+def _timed_call(func, upstream):
+    start = time.time()
+    results = func(upstream) or {}
+    return results, start, time.time()
+
+
+def _resolve_dependencies(stages):
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate stage names in workflow: {names}")
+    producers = {}
+    for stage in stages:
+        for out in stage.outputs:
+            # A file rewritten in place by a later stage keeps its first producer.
+            producers.setdefault(os.path.abspath(out), stage.name)
+    deps = {}
+    for stage in stages:
+        stage_deps = set(stage.after)
+        for inp in stage.inputs:
+            producer = producers.get(os.path.abspath(inp))
+            if producer is not None and producer != stage.name:
+                stage_deps.add(producer)
+        unknown = stage_deps - set(names)
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {sorted(unknown)}")
+        deps[stage.name] = stage_deps
+
+    # Kahn's algorithm, both to detect cycles and to fix a deterministic dispatch order.
+    order, remaining = [], {n: set(d) for n, d in deps.items()}
+    while remaining:
+        ready = [n for n in names if n in remaining and not remaining[n]]
+        if not ready:
+            raise ValueError(f"Cyclic stage dependencies among: {sorted(remaining)}")
+        for n in ready:
+            order.append(n)
+            del remaining[n]
+        for d in remaining.values():
+            d.difference_update(ready)
+    return deps, order
+
+
+def run_stage_graph(stages, manifest, max_workers=4, process_initializer=None, process_initargs=()):
+    """
+    Executes a workflow graph, running every stage whose dependencies are satisfied
+    concurrently on a thread pool (or a process pool for executor='process' stages).
+
+    Stages found current in the manifest are skipped and contribute their recorded
+    results. If a stage fails, no new stages are started, the running ones are allowed
+    to finish and are recorded, and the first error is re-raised.
+
+    Returns:
+        tuple: (results, timings) where results maps stage name to its results dict and
+            timings maps stage name to (start, end, status) wall-clock tuples.
+    """
+    by_name = {s.name: s for s in stages}
+    deps, order = _resolve_dependencies(stages)
+    results, timings = {}, {}
+    pending = list(order)
+    running = {}
+    failure = None
+    t_origin = time.time()
+
+    threads = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    processes = None
+    if any(s.executor == 'process' for s in stages):
+        processes = ProcessPoolExecutor(
+            max_workers=max(1, max_workers),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=process_initializer,
+            initargs=process_initargs,
+        )
+    try:
+        while pending or running:
+            dispatched = True
+            while dispatched and failure is None:
+                dispatched = False
+                for name in list(pending):
+                    if not deps[name].issubset(results):
+                        continue
+                    pending.remove(name)
+                    stage = by_name[name]
+                    stage_fingerprint = fingerprint(stage.config_slice, stage.inputs, stage.tools)
+                    if manifest.is_current(name, stage_fingerprint):
+                        print(f"\n--- Stage '{name}' is up to date, skipping (manifest: {manifest.path}) ---")
+                        results[name] = manifest.results(name)
+                        now = time.time()
+                        timings[name] = (now, now, 'skipped')
+                        dispatched = True
+                        continue
+                    manifest.invalidate(name)
+                    upstream = {d: results[d] for d in deps[name]}
+                    pool = processes if stage.executor == 'process' else threads
+                    print(f"\n--- Stage '{name}' started ({stage.executor}) ---")
+                    running[pool.submit(_timed_call, stage.func, upstream)] = (name, stage_fingerprint)
+                    dispatched = True
+
+            if not running:
+                if pending and failure is None:
+                    raise RuntimeError(f"Workflow stalled with unsatisfied stages: {pending}")
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, stage_fingerprint = running.pop(future)
+                try:
+                    stage_results, start, end = future.result()
+                except Exception as e:
+                    print(f"Error: stage '{name}' failed: {e}", file=sys.stderr)
+                    timings[name] = (t_origin, time.time(), 'failed')
+                    if failure is None:
+                        failure = e
+                    continue
+                manifest.record(name, stage_fingerprint, by_name[name].outputs, stage_results)
+                results[name] = stage_results
+                timings[name] = (start, end, 'ran')
+                print(f"--- Stage '{name}' finished in {end - start:.2f} s ---")
+            if failure is not None:
+                pending = []
+    finally:
+        threads.shutdown(wait=True)
+        if processes is not None:
+            processes.shutdown(wait=True)
+
+    if failure is not None:
+        print_timing_report(stages, timings, t_origin)
+        raise failure
+    return results, timings
+
+
+def print_timing_report(stages, timings, t_origin=None):
+    """Prints per-stage timings and the critical path through the workflow graph."""
+    deps, order = _resolve_dependencies(stages)
+    if not timings:
+        return
+    t_origin = t_origin if t_origin is not None else min(t[0] for t in timings.values())
+    wall = max(t[1] for t in timings.values()) - t_origin
+
+    durations = {n: timings[n][1] - timings[n][0] if n in timings else 0.0 for n in order}
+    path_length, path_prev = {}, {}
+    for name in order:
+        prev = max(deps[name], key=lambda d: path_length[d], default=None)
+        path_length[name] = durations[name] + (path_length[prev] if prev else 0.0)
+        path_prev[name] = prev
+    tail = max(order, key=lambda n: path_length[n])
+    critical = []
+    while tail is not None:
+        critical.append(tail)
+        tail = path_prev[tail]
+    critical.reverse()
+
+    print("\n--- Stage timing report ---")
+    print(f"{'stage':<24}{'status':<9}{'start [s]':>10}{'duration [s]':>14}  critical")
+    for name in order:
+        if name not in timings:
+            continue
+        start, end, status = timings[name]
+        mark = '*' if name in critical else ''
+        print(f"{name:<24}{status:<9}{start - t_origin:>10.2f}{end - start:>14.2f}  {mark}")
+    print(f"Critical path: {' -> '.join(critical)} ({path_length[critical[-1]]:.2f} s of {wall:.2f} s wall time)")
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class Structure:
+    """
+    In-memory coarse-grained system: per-atom residue numbers, residue names, atom names
+    and coordinates (nm) as arrays, plus the box.
+
+    The packing steps hand this object to each other instead of re-reading the growing
+    system from disk. `pdb_path` optionally points at a PDB file (Angstrom) holding
+    exactly these coordinates, so packmol can reuse it as the fixed structure of the
+    next step without another conversion.
+    """
+
+    def __init__(self, resid, resname, atomname, positions, box, title="", pdb_path=None):
+        self.resid = np.asarray(resid, dtype=np.int64)
+        self.resname = np.asarray(resname, dtype='U5')
+        self.atomname = np.asarray(atomname, dtype='U5')
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.box = np.asarray(box, dtype=np.float64).reshape(3)
+        self.title = title
+        self.pdb_path = pdb_path
+        n = len(self.positions)
+        if not (len(self.resid) == len(self.resname) == len(self.atomname) == n):
+            raise ValueError("Structure arrays must all have one entry per atom")
+
+    @property
+    def n_atoms(self):
+        return len(self.positions)
+
+    def copy(self):
+        return Structure(self.resid.copy(), self.resname.copy(), self.atomname.copy(),
+                         self.positions.copy(), self.box.copy(), self.title, self.pdb_path)
+
+    def with_positions(self, positions, pdb_path=None):
+        """Returns a copy with new coordinates (the PDB twin no longer applies unless given)."""
+        return Structure(self.resid, self.resname, self.atomname, positions, self.box, self.title, pdb_path)
+
+    def replicate(self, n_copies, first_resid=1):
+        """
+        Returns n_copies of this structure back to back, as packmol writes them, each copy
+        renumbered to its own residue number starting at first_resid. Coordinates are
+        the template's; callers overwrite them with the placed ones.
+        """
+        reps = np.repeat(np.arange(n_copies, dtype=np.int64), self.n_atoms)
+        return Structure(
+            first_resid + reps,
+            np.tile(self.resname, n_copies),
+            np.tile(self.atomname, n_copies),
+            np.tile(self.positions, (n_copies, 1)),
+            self.box, self.title,
+        )
+
+    @staticmethod
+    def concatenate(structures, box=None, title=None):
+        first = structures[0]
+        return Structure(
+            np.concatenate([s.resid for s in structures]),
+            np.concatenate([s.resname for s in structures]),
+            np.concatenate([s.atomname for s in structures]),
+            np.concatenate([s.positions for s in structures]),
+            first.box if box is None else box,
+            first.title if title is None else title,
+        )
+
+    @classmethod
+    def from_gro(cls, path, mmap=False):
+        from core_utils.structure_io import read_gro
+        return read_gro(path, mmap=mmap)
+
+    def to_gro(self, path):
+        from core_utils.structure_io import write_gro
+        return write_gro(path, self)
@@ -0,0 +1,642 @@
+import gzip
+import io
+import os
+import queue
+import threading
+import zipfile
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for .zst files
+    zstandard = None
+
+from core_utils import bulk_format as bf
+from core_utils.structure import Structure
+
+# Native readers and writers for the coordinate formats the workflow exchanges with
+# packmol and GROMACS (GRO, PDB, XYZ, G96) and of a NumPy binary format (.npz).
+#
+# Files are read as one byte array; line starts come from a single newline scan and
+# every fixed-width column is gathered for all atoms at once and converted with
+# NumPy, so reading or writing a system costs milliseconds even for millions of beads.
+# Writers go through core_utils.bulk_format and produce the same text as the
+# equivalent per-line str.format calls.
+
+#
+# Any text format may be gzip (.gz) or zstd (.zst) compressed, e.g. system.gro.gz:
+# readers decompress transparently, and writers compress on a background thread, so
+# compression overlaps the formatting of the next chunk of records.
+
+# Bump when the text produced by the writers changes; cached conversions depend on it.
+WRITER_VERSION = 1
+
+COMPRESSION_SUFFIXES = ('.gz', '.zst')
+# Fast levels: compression keeps pace with formatting and still shrinks GRO text ~2.5x.
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+_NEWLINE = 10
+
+
+def split_compression(path):
+    """Returns (path without compression suffix, suffix or None)."""
+    root, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSION_SUFFIXES:
+        return root, ext.lower()
+    return path, None
+
+
+def structure_format(path):
+    """The coordinate format extension of a path, ignoring compression ('.gro' for 'a.gro.gz')."""
+    return os.path.splitext(split_compression(path)[0])[1].lower()
+
+
+def _require_zstandard(path):
+    if zstandard is None:
+        raise ImportError(f"Reading or writing '{path}' needs the zstandard package (pip install zstandard)")
+
+
+def _read_raw(path):
+    """Returns the (decompressed) content of a file as bytes."""
+    compression = split_compression(path)[1]
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if compression == '.gz':
+        return gzip.decompress(raw)
+    if compression == '.zst':
+        _require_zstandard(path)
+        # decompressobj also handles streamed frames that do not record their size.
+        return zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    return raw
+
+
+def _load_bytes(path, mmap=False):
+    """
+    Returns the file content as a uint8 array (memory-mapped if requested; compressed
+    files are decompressed into memory and read-only).
+    """
+    if split_compression(path)[1]:
+        return np.frombuffer(_read_raw(path), dtype=np.uint8)
+    if mmap and os.path.getsize(path) > 0:
+        return np.memmap(path, dtype=np.uint8, mode='r')
+    return np.fromfile(path, dtype=np.uint8)
+
+
+class BackgroundWriter:
+    """
+    Binary file object whose writes are handed to a thread through a bounded queue.
+
+    The thread writes them to `stream` (typically a compressor; zlib and zstd release
+    the GIL), so the caller formats the next chunk while the previous one is being
+    compressed. Errors of the thread are raised by the next write or by close().
+    """
+
+    def __init__(self, stream, depth=4):
+        self._stream = stream
+        self._queue = queue.Queue(maxsize=depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="structure-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            if self._error is None:
+                try:
+                    self._stream.write(chunk)
+                except Exception as e:
+                    self._error = e
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            self._stream.close()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _ZstdStream:
+    # zstd stream writer that also closes the file it writes to.
+    def __init__(self, path):
+        _require_zstandard(path)
+        self._file = open(path, 'wb')
+        self._writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self._file, closefd=False)
+
+    def write(self, data):
+        return self._writer.write(data)
+
+    def close(self):
+        self._writer.close()
+        self._file.close()
+
+
+def open_output(path):
+    """
+    Opens a binary output file; .gz and .zst paths are compressed on a BackgroundWriter.
+    The gzip header carries no timestamp, so equal content gives equal files.
+    """
+    compression = split_compression(path)[1]
+    if compression == '.gz':
+        return BackgroundWriter(gzip.GzipFile(path, 'wb', compresslevel=GZIP_LEVEL, mtime=0))
+    if compression == '.zst':
+        return BackgroundWriter(_ZstdStream(path))
+    return open(path, 'wb')
+
+
+def _line_bounds(data):
+    """Start and end (exclusive, without '\\r\\n') offsets of every line."""
+    newlines = np.flatnonzero(data == _NEWLINE)
+    if len(data) and (len(newlines) == 0 or newlines[-1] != len(data) - 1):
+        newlines = np.append(newlines, len(data))
+    starts = np.empty(len(newlines), dtype=np.int64)
+    starts[:1] = 0
+    starts[1:] = newlines[:-1] + 1
+    ends = newlines.copy()
+    if len(ends):
+        has_cr = (ends > starts) & (data[np.maximum(ends - 1, 0)] == 13)
+        ends[has_cr] -= 1
+    return starts, ends
+
+
+def _gather_columns(data, starts, ends, first, last):
+    """
+    Returns the (n, last - first) block of columns [first, last) of the given lines;
+    positions past the end of a line read as spaces.
+    """
+    n = len(starts)
+    if n and int((ends - starts).min()) >= last:
+        stride = int(starts[1] - starts[0]) if n > 1 else last
+        if n == 1 or np.all(np.diff(starts) == stride):
+            # Equal-length lines (the normal case for generated files): a strided view.
+            rows = np.asarray(data[starts[0]:starts[0] + (n - 1) * stride + last])
+            return np.lib.stride_tricks.as_strided(rows, shape=(n, last), strides=(stride, 1))[:, first:]
+    columns = starts[:, None] + np.arange(first, last)
+    block = data[np.minimum(columns, max(len(data) - 1, 0))]
+    block[columns >= ends[:, None]] = 32
+    return block
+
+
+def _as_bytes_column(block):
+    """Views an (n, w) uint8 block as an (n,) array of w-byte strings."""
+    block = np.ascontiguousarray(block)
+    return block.view(f'S{block.shape[1]}').ravel()
+
+
+def _parse_int(block):
+    return _as_bytes_column(block).astype(np.int64)
+
+
+def _parse_float(block):
+    return _as_bytes_column(block).astype(np.float64)
+
+
+def _parse_str(block):
+    # ASCII bytes widened to UTF-32 code units form a native str array without decoding.
+    text = np.ascontiguousarray(block, dtype=np.uint32).view(f'U{block.shape[1]}').ravel()
+    return np.char.strip(text)
+
+
+def _line_text(data, start, end):
+    return bytes(data[start:end]).decode('utf-8', errors='replace')
+
+
+# --- GRO ---
+
+def read_gro(path, mmap=False):
+    """
+    Reads a .gro file into a Structure.
+
+    Coordinate precision is taken from the spacing of the decimal points of the first
+    atom line, so files written with more than three decimals are read correctly.
+    Velocities, if present, are ignored; a triclinic box keeps its diagonal.
+
+    Args:
+        path (str): The .gro file.
+        mmap (bool): Memory-map the file instead of reading it, for very large systems.
+    """
+    data = _load_bytes(path, mmap)
+    starts, ends = _line_bounds(data)
+    if len(starts) < 2:
+        raise ValueError(f"'{path}' is not a valid .gro file")
+    title = _line_text(data, starts[0], ends[0]).strip()
+    n_atoms = int(_line_text(data, starts[1], ends[1]).strip())
+    if len(starts) < n_atoms + 2:
+        raise ValueError(f"'{path}' declares {n_atoms} atoms but has only {len(starts) - 2} atom lines")
+
+    atom_starts, atom_ends = starts[2:2 + n_atoms], ends[2:2 + n_atoms]
+    width = 8
+    if n_atoms:
+        first = _line_text(data, atom_starts[0], atom_ends[0])
+        dots = [i for i, ch in enumerate(first[20:]) if ch == '.']
+        if len(dots) >= 2:
+            width = dots[1] - dots[0]
+    block = np.ascontiguousarray(_gather_columns(data, atom_starts, atom_ends, 0, 20 + 3 * width))
+
+    resid = _parse_int(block[:, 0:5])
+    resname = _parse_str(block[:, 5:10])
+    atomname = _parse_str(block[:, 10:15])
+    positions = np.empty((n_atoms, 3), dtype=np.float64)
+    for axis in range(3):
+        positions[:, axis] = _parse_float(block[:, 20 + axis * width:20 + (axis + 1) * width])
+
+    box = [0.0, 0.0, 0.0]
+    if len(starts) > n_atoms + 2:
+        box_fields = _line_text(data, starts[n_atoms + 2], ends[n_atoms + 2]).split()
+        if len(box_fields) >= 3:
+            box = [float(v) for v in box_fields[:3]]
+    return Structure(resid, resname, atomname, positions, box, title)
+
+
+def _gro_atom_parts(structure, start, stop):
+    index = np.arange(start, stop, dtype=np.int64)
+    return [
+        bf.fixed(bf.int_field(structure.resid[start:stop] % 100000), 5),
+        bf.fixed(bf.str_field(structure.resname[start:stop], max_length=5), 5, '<'),
+        bf.fixed(bf.str_field(structure.atomname[start:stop], max_length=5), 5),
+        bf.fixed(bf.int_field((index + 1) % 100000), 5),
+        bf.fixed(bf.float_field(structure.positions[start:stop, 0], 3), 8),
+        bf.fixed(bf.float_field(structure.positions[start:stop, 1], 3), 8),
+        bf.fixed(bf.float_field(structure.positions[start:stop, 2], 3), 8),
+        b'\n',
+    ]
+
+
+def write_gro(path, structure, title=None):
+    """Writes a Structure as a GROMACS .gro file ('%5d%-5s%5s%5d%8.3f%8.3f%8.3f' lines)."""
+    with open_output(path) as f:
+        f.write(f"{title or structure.title or 'Generated structure'}\n".encode('utf-8'))
+        f.write(f"{structure.n_atoms:5d}\n".encode('ascii'))
+        bf.write_records(f, lambda a, b: _gro_atom_parts(structure, a, b), structure.n_atoms)
+        box = structure.box
+        f.write(f"{box[0]:10.5f}{box[1]:10.5f}{box[2]:10.5f}\n".encode('ascii'))
+    return path
+
+
+def rename_residues_in_gro(path, names, new_resname):
+    """
+    Sets the residue name of every atom whose residue or atom name is in `names` to
+    `new_resname`, editing the fixed residue-name columns of the file in place.
+
+    Returns:
+        int: The number of renamed atoms.
+    """
+    data = _load_bytes(path)
+    starts, ends = _line_bounds(data)
+    n_atoms = int(_line_text(data, starts[1], ends[1]).strip())
+    atom_starts, atom_ends = starts[2:2 + n_atoms], ends[2:2 + n_atoms]
+    long_enough = (atom_ends - atom_starts) > 20
+    block = _gather_columns(data, atom_starts, atom_ends, 5, 15)
+    names = list(names)
+    selected = long_enough & (np.isin(_parse_str(block[:, 0:5]), names) | np.isin(_parse_str(block[:, 5:10]), names))
+    rows = atom_starts[selected]
+    if len(rows):
+        replacement = np.frombuffer(f"{new_resname:<5}"[:5].encode('ascii'), dtype=np.uint8)
+        if not data.flags.writeable:
+            data = data.copy()
+        data[rows[:, None] + np.arange(5, 10)] = replacement
+        with open_output(path) as f:
+            f.write(data.tobytes())
+    return len(rows)
+
+
+# --- PDB ---
+
+def _pdb_atom_records(data, last):
+    # ATOM/HETATM lines and their first `last` columns, plus all line starts and record names
+    starts, ends = _line_bounds(data)
+    heads = _as_bytes_column(_gather_columns(data, starts, ends, 0, 6))
+    is_atom = (heads == b'ATOM  ') | (heads == b'HETATM')
+    block = np.ascontiguousarray(_gather_columns(data, starts[is_atom], ends[is_atom], 0, last))
+    return block, starts, ends, heads
+
+
+def _pdb_positions(block):
+    positions = np.empty((len(block), 3), dtype=np.float64)
+    for axis in range(3):
+        positions[:, axis] = _parse_float(block[:, 30 + 8 * axis:38 + 8 * axis]) / 10.0
+    return positions
+
+
+def _hybrid36(text):
+    """Decodes a 4-character hybrid-36 number ('A000' = 10000, 'a000' = 10000 + 26 * 36**3); None if invalid."""
+    if len(text) != 4 or not text.isalnum() or not text.isascii():
+        return None
+    if text[0].isupper() and text[1:] == text[1:].upper():
+        return int(text, 36) - 10 * 36 ** 3 + 10000
+    if text[0].islower() and text[1:] == text[1:].lower():
+        return int(text, 36) + 16 * 36 ** 3 + 10000
+    return None
+
+
+def _pdb_residue_numbers(column):
+    """
+    Residue numbers of the PDB residue column (22-26). Past 9999 residues, packmol and
+    others write hybrid-36 numbers ('A000'), older versions '****': hybrid-36 is decoded,
+    and if any value is still not a number the residues are renumbered from 1, a new
+    residue starting wherever the column changes.
+    """
+    text = np.char.strip(_as_bytes_column(column))
+    text = np.where(text == b'', b'0', text)
+    try:
+        return text.astype(np.int64)
+    except ValueError:
+        pass
+    values, inverse = np.unique(text, return_inverse=True)
+    numbers = []
+    for value in values.tolist():
+        value = value.decode('ascii', errors='replace')
+        number = int(value) if value.lstrip('-').isdigit() else _hybrid36(value)
+        if number is None:
+            changes = np.r_[True, text[1:] != text[:-1]]
+            return np.cumsum(changes, dtype=np.int64)
+        numbers.append(number)
+    return np.array(numbers, dtype=np.int64)[inverse.reshape(-1)]
+
+
+def read_pdb(path, mmap=False):
+    """
+    Reads the ATOM/HETATM records of a PDB file into a Structure (coordinates in nm).
+
+    The box is taken from the CRYST1 record if present. Residue names are read from
+    columns 18-21, as GROMACS writes four-character residue names; residue numbers
+    may be hybrid-36 or overflowed (see _pdb_residue_numbers).
+    """
+    data = _load_bytes(path, mmap)
+    block, starts, ends, heads = _pdb_atom_records(data, 54)
+    box = [0.0, 0.0, 0.0]
+    cryst = np.flatnonzero(heads == b'CRYST1')
+    if len(cryst):
+        line = _line_text(data, starts[cryst[0]], ends[cryst[0]])
+        box = [float(line[6:15]) / 10.0, float(line[15:24]) / 10.0, float(line[24:33]) / 10.0]
+    return Structure(_pdb_residue_numbers(block[:, 22:26]), _parse_str(block[:, 17:21]), _parse_str(block[:, 12:16]),
+                     _pdb_positions(block), box, title=os.path.splitext(os.path.basename(split_compression(path)[0]))[0])
+
+
+def read_pdb_positions(path, mmap=False):
+    """
+    Reads only the ATOM/HETATM coordinates (columns 31-54) of a PDB file and returns
+    them in nm; the other columns, e.g. overflowed residue numbers, are not parsed.
+    """
+    return _pdb_positions(_pdb_atom_records(_load_bytes(path, mmap), 54)[0])
+
+
+def _pdb_atom_parts(structure, start, stop):
+    index = np.arange(start, stop, dtype=np.int64)
+    angstrom = structure.positions[start:stop] * 10.0
+    return [
+        b'ATOM  ',
+        bf.fixed(bf.int_field((index + 1) % 100000), 5),
+        b' ',
+        bf.fixed(bf.str_field(structure.atomname[start:stop], max_length=4), 4, '<'),
+        b' ',
+        bf.fixed(bf.str_field(structure.resname[start:stop], max_length=4), 4, '<'),
+        b' ',
+        bf.fixed(bf.int_field(structure.resid[start:stop] % 10000), 4),
+        b'    ',
+        bf.fixed(bf.float_field(angstrom[:, 0], 3), 8),
+        bf.fixed(bf.float_field(angstrom[:, 1], 3), 8),
+        bf.fixed(bf.float_field(angstrom[:, 2], 3), 8),
+        b'  1.00  0.00\n',
+    ]
+
+
+def write_pdb(path, structure, title=None):
+    """
+    Writes a Structure as a PDB file in Angstrom, ATOM records laid out as
+    'ATOM  %5d %-4s %-4s %4d    %8.3f%8.3f%8.3f  1.00  0.00'.
+
+    Atom serials and residue numbers wrap like in GROMACS output so every record keeps
+    its fixed columns, which is what packmol relies on.
+    """
+    with open_output(path) as f:
+        f.write(f"TITLE     {title or structure.title or 'Generated structure'}\n".encode('utf-8'))
+        if np.all(structure.box > 0):
+            a, b, c = structure.box * 10.0
+            f.write(f"CRYST1{a:9.3f}{b:9.3f}{c:9.3f}  90.00  90.00  90.00 P 1           1\n".encode('ascii'))
+        bf.write_records(f, lambda s, e: _pdb_atom_parts(structure, s, e), structure.n_atoms)
+        f.write(b"TER\nENDMDL\n")
+    return path
+
+
+# --- XYZ ---
+
+def read_xyz(path, resname="MOL", box=(10.0, 10.0, 10.0)):
+    """
+    Reads an .xyz file (Angstrom) into a single-residue Structure in nm.
+
+    Args:
+        resname (str): Residue name given to all atoms.
+        box: Box to assign, since .xyz files carry none.
+    """
+    with io.StringIO(_read_raw(path).decode('utf-8-sig')) as f:
+        n_atoms = int(f.readline().strip())
+        title = f.readline().strip()
+        atom_lines = [f.readline() for _ in range(n_atoms)]
+    tokens = "".join(atom_lines).split()
+    if len(tokens) == 4 * n_atoms:
+        table = np.array(tokens, dtype=object).reshape(n_atoms, 4)
+    else:
+        # Extra columns (charges, forces, ...) on some lines: take the first four per line.
+        table = np.array([line.split()[:4] for line in atom_lines], dtype=object).reshape(n_atoms, 4)
+    positions = table[:, 1:4].astype(np.float64) / 10.0
+    return Structure(np.ones(n_atoms, dtype=np.int64), np.full(n_atoms, resname), table[:, 0].astype(str),
+                     positions, box, title)
+
+
+def write_xyz(path, structure, title=None):
+    """Writes a Structure as an .xyz file in Angstrom ('%-5s %12.5f %12.5f %12.5f' lines)."""
+    angstrom = structure.positions * 10.0
+
+    def _parts(start, stop):
+        return [
+            bf.fixed(bf.str_field(structure.atomname[start:stop]), 5, '<'),
+            b' ', bf.fixed(bf.float_field(angstrom[start:stop, 0], 5), 12),
+            b' ', bf.fixed(bf.float_field(angstrom[start:stop, 1], 5), 12),
+            b' ', bf.fixed(bf.float_field(angstrom[start:stop, 2], 5), 12),
+            b'\n',
+        ]
+
+    with open_output(path) as f:
+        f.write(f"{structure.n_atoms}\n{title or structure.title}\n".encode('utf-8'))
+        bf.write_records(f, _parts, structure.n_atoms)
+    return path
+
+
+# --- G96 ---
+
+def read_g96(path, mmap=False):
+    """
+    Reads the TITLE, POSITION and BOX blocks of a GROMACS .g96 file into a Structure.
+
+    POSITION lines are read by column ('%5d %-5s %-5s%7d%15.9f%15.9f%15.9f'); files
+    with only a POSITIONRED block carry no names and are rejected.
+    """
+    data = _load_bytes(path, mmap)
+    starts, ends = _line_bounds(data)
+    heads = np.char.strip(_as_bytes_column(_gather_columns(data, starts, ends, 0, 8)))
+    block_ends = np.flatnonzero(heads == b'END')
+
+    def _block(name):
+        found = np.flatnonzero(heads == name)
+        if not len(found):
+            return None
+        first = int(found[0]) + 1
+        last = block_ends[block_ends >= first]
+        return first, int(last[0]) if len(last) else len(starts)
+
+    positions_block = _block(b'POSITION')
+    if positions_block is None:
+        raise ValueError(f"'{path}' has no POSITION block")
+    first, last = positions_block
+    atom_starts, atom_ends = starts[first:last], ends[first:last]
+    # comment lines may appear inside blocks
+    is_atom = _gather_columns(data, atom_starts, atom_ends, 0, 1)[:, 0] != ord('#')
+    block = np.ascontiguousarray(_gather_columns(data, atom_starts[is_atom], atom_ends[is_atom], 0, 69))
+    positions = np.empty((len(block), 3), dtype=np.float64)
+    for axis in range(3):
+        positions[:, axis] = _parse_float(block[:, 24 + 15 * axis:39 + 15 * axis])
+
+    title = ""
+    title_block = _block(b'TITLE')
+    if title_block is not None and title_block[1] > title_block[0]:
+        title = _line_text(data, starts[title_block[0]], ends[title_block[0]]).strip()
+    box = [0.0, 0.0, 0.0]
+    box_block = _block(b'BOX')
+    if box_block is not None and box_block[1] > box_block[0]:
+        box = [float(v) for v in _line_text(data, starts[box_block[0]], ends[box_block[0]]).split()[:3]]
+    return Structure(_parse_int(block[:, 0:5]), _parse_str(block[:, 6:11]), _parse_str(block[:, 12:17]),
+                     positions, box, title)
+
+
+def _g96_atom_parts(structure, start, stop):
+    index = np.arange(start, stop, dtype=np.int64)
+    return [
+        bf.fixed(bf.int_field(structure.resid[start:stop] % 100000), 5),
+        b' ',
+        bf.fixed(bf.str_field(structure.resname[start:stop], max_length=5), 5, '<'),
+        b' ',
+        bf.fixed(bf.str_field(structure.atomname[start:stop], max_length=5), 5, '<'),
+        bf.fixed(bf.int_field((index + 1) % 10000000), 7),
+        bf.fixed(bf.float_field(structure.positions[start:stop, 0], 9), 15),
+        bf.fixed(bf.float_field(structure.positions[start:stop, 1], 9), 15),
+        bf.fixed(bf.float_field(structure.positions[start:stop, 2], 9), 15),
+        b'\n',
+    ]
+
+
+def write_g96(path, structure, title=None):
+    """
+    Writes a Structure as a GROMACS .g96 file, POSITION lines laid out as
+    '%5d %-5s %-5s%7d%15.9f%15.9f%15.9f' like gmx does (nm, nine decimals).
+    """
+    with open_output(path) as f:
+        f.write(f"TITLE\n{title or structure.title or 'Generated structure'}\nEND\nPOSITION\n".encode('utf-8'))
+        bf.write_records(f, lambda a, b: _g96_atom_parts(structure, a, b), structure.n_atoms)
+        box = structure.box
+        f.write(f"END\nBOX\n{box[0]:15.9f}{box[1]:15.9f}{box[2]:15.9f}\nEND\n".encode('ascii'))
+    return path
+
+
+# --- NumPy binary ---
+
+def _npz_memmaps(path):
+    """
+    Memory-maps the arrays of an uncompressed .npz archive (np.load ignores mmap_mode
+    for archives). Each member is a stored .npy file, so its data starts at a fixed
+    offset of the archive. Returns None if a member is compressed or not mappable.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as raw:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith('.npy'):
+                return None
+            # Local file header: 30 fixed bytes, then the name and extra fields
+            raw.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(raw.read(4), dtype='<u2')
+            with archive.open(info) as member:
+                version = np.lib.format.read_magic(member)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(member)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(member)
+                header_length = member.tell()
+            if dtype.hasobject:
+                return None
+            offset = info.header_offset + 30 + int(name_length) + int(extra_length) + header_length
+            key = info.filename[:-len('.npy')]
+            if int(np.prod(shape)) == 0:
+                arrays[key] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[key] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                                        order='F' if fortran_order else 'C')
+    return arrays
+
+
+def read_npz(path, mmap=False):
+    """
+    Reads a Structure saved by write_npz.
+
+    With mmap=True the per-atom arrays are memory-mapped from the archive instead of
+    read, for very large systems (write_npz stores them uncompressed).
+    """
+    stored = _npz_memmaps(path) if mmap else None
+    if stored is not None:
+        return Structure(stored['resid'], stored['resname'], stored['atomname'], stored['positions'],
+                         stored['box'], str(stored['title']))
+    with np.load(path, allow_pickle=False) as stored:
+        return Structure(stored['resid'], stored['resname'], stored['atomname'], stored['positions'],
+                         stored['box'], str(stored['title']))
+
+
+def write_npz(path, structure, title=None):
+    """
+    Writes the Structure arrays to an uncompressed .npz file: full float64 precision
+    and no text formatting or parsing, for checkpoints read back only by this package.
+    """
+    with open(path, 'wb') as f:
+        np.savez(f, resid=structure.resid, resname=structure.resname, atomname=structure.atomname,
+                 positions=structure.positions, box=structure.box,
+                 title=np.array(title or structure.title or ""))
+    return path
+
+
+# --- Dispatch by extension ---
+
+_READERS = {'.gro': read_gro, '.pdb': read_pdb, '.xyz': read_xyz, '.g96': read_g96, '.npz': read_npz}
+_WRITERS = {'.gro': write_gro, '.pdb': write_pdb, '.xyz': write_xyz, '.g96': write_g96, '.npz': write_npz}
+
+
+def _format_of(path, table):
+    ext = structure_format(path)
+    if ext not in table:
+        raise ValueError(f"Unsupported structure format '{ext}' for '{path}'")
+    if ext == '.npz' and split_compression(path)[1]:
+        raise ValueError(f"'{path}': .npz files cannot be compressed further")
+    return table[ext]
+
+
+def read_structure(path, **kwargs):
+    """Reads a .gro, .pdb, .xyz, .g96 or .npz file, chosen by extension (.gz/.zst allowed)."""
+    return _format_of(path, _READERS)(path, **kwargs)
+
+
+def write_structure(path, structure, **kwargs):
+    """Writes a .gro, .pdb, .xyz, .g96 or .npz file, chosen by extension (.gz/.zst allowed)."""
+    return _format_of(path, _WRITERS)(path, structure, **kwargs)
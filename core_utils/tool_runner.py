@@ -0,0 +1,227 @@
+import asyncio
+import collections
+import os
+import signal
+import subprocess
+import threading
+
+# Asyncio-based runner for the external tools (packmol, gmx editconf/grompp/genion).
+#
+# Output is streamed line by line to a log file instead of being buffered in memory;
+# only the last lines are kept for error messages. Failure patterns are matched while
+# the tool runs, so a failing tool is stopped as soon as it reports the failure, and a
+# per-call timeout kills tools that hang. run_tools runs independent invocations
+# concurrently in one event loop under a semaphore; synchronous run_tool calls from
+# different threads share a process-wide limit (set_max_concurrent_tools).
+#
+# Every tool starts in its own session, so a kill reaches the whole process group
+# (e.g. the ranks started by an MPI launcher), not only the direct child.
+
+_TAIL_LINES = 200
+_LINE_LIMIT = 1 << 20
+
+_slots_lock = threading.Lock()
+_slots_limit = None
+_slots = None  # created once, by the first run_tool call
+
+
+class ToolError(subprocess.CalledProcessError):
+    """
+    An external tool exited with an error, timed out or printed a failure pattern.
+
+    Subclasses CalledProcessError so existing handlers keep working; stdout and stderr
+    hold the last lines of the output, the full output is in log_path.
+    """
+
+    def __init__(self, returncode, cmd, stdout=None, stderr=None, reason="", log_path=None):
+        super().__init__(returncode, cmd, output=stdout, stderr=stderr)
+        self.reason = reason
+        self.log_path = log_path
+
+    def __str__(self):
+        text = f"{self.cmd[0] if self.cmd else 'tool'}: {self.reason or super().__str__()}"
+        return f"{text} (log: {self.log_path})" if self.log_path else text
+
+
+class ToolResult:
+    """Outcome of a successful tool run: return code, output tails and the log path."""
+
+    def __init__(self, returncode, stdout, stderr, log_path):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.log_path = log_path
+
+
+def set_max_concurrent_tools(n):
+    """
+    Limits how many tools run_tool runs at the same time across all threads. Must be
+    called before the first tool runs: the semaphore is never replaced while threads may
+    hold it.
+
+    Raises:
+        RuntimeError: If tools already ran under a different limit.
+    """
+    global _slots_limit
+    n = max(1, int(n))
+    with _slots_lock:
+        if _slots is not None and n != _slots_limit:
+            raise RuntimeError(f"max_concurrent_tools must be set before the first tool runs "
+                               f"(already running with {_slots_limit})")
+        _slots_limit = n
+
+
+def _tool_slots():
+    global _slots, _slots_limit
+    with _slots_lock:
+        if _slots is None:
+            _slots_limit = _slots_limit or os.cpu_count() or 1
+            _slots = threading.BoundedSemaphore(_slots_limit)
+        return _slots
+
+
+def timeout_for(sim_params, tool):
+    """Timeout (s) of a tool from simulation_parameters 'tool_timeouts', e.g. {"packmol": 3600, "gmx": 600}."""
+    return (sim_params.get('tool_timeouts') or {}).get(tool)
+
+
+async def _feed(stdin, text):
+    # Written concurrently with reading the output, so a chatty tool cannot block on a full pipe.
+    if text is None:
+        return
+    try:
+        stdin.write(text.encode('utf-8'))
+        await stdin.drain()
+        stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # the tool exited without reading all of its input
+
+
+def _kill_group(process):
+    # The tool leads its own process group (start_new_session), so this also stops its children.
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _pump(stream, label, log, tail, fail_patterns, on_failure):
+    async for line in stream:
+        if log is not None:
+            log.write(line if label is None else label + line)
+        text = line.decode('utf-8', errors='replace')
+        tail.append(text)
+        for pattern in fail_patterns:
+            if pattern in text:
+                on_failure(f"reported '{pattern}'")
+                return
+
+
+async def run_tool_async(command, cwd=None, env=None, input=None, log_path=None, timeout=None, fail_patterns=()):
+    """
+    Runs one external tool, streaming its output to log_path.
+
+    Args:
+        command (list): Executable and arguments.
+        input (str): Text written to the tool's stdin, which is then closed.
+        log_path (str): File receiving stdout and stderr (stderr lines prefixed); None
+            discards the output except for the retained tail.
+        timeout (float): Seconds after which the tool and its process group are killed;
+            None waits forever.
+        fail_patterns (iterable): Strings that mark a failure when printed by the tool;
+            the tool and its process group are killed as soon as one appears.
+
+    Returns:
+        ToolResult
+
+    Raises:
+        FileNotFoundError: If the executable does not exist.
+        ToolError: On a non-zero exit, a timeout or a failure pattern.
+    """
+    command = [str(c) for c in command]
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd, env=env, limit=_LINE_LIMIT,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=True,
+    )
+    out_tail = collections.deque(maxlen=_TAIL_LINES)
+    err_tail = collections.deque(maxlen=_TAIL_LINES)
+    failure = []
+
+    def _fail(reason):
+        if not failure:
+            failure.append(reason)
+        _kill_group(process)
+
+    log = open(log_path, 'wb') if log_path else None
+    try:
+        pumps = asyncio.gather(
+            _feed(process.stdin, input),
+            _pump(process.stdout, None, log, out_tail, fail_patterns, _fail),
+            _pump(process.stderr, b"[stderr] ", log, err_tail, fail_patterns, _fail),
+        )
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), timeout)
+        except asyncio.TimeoutError:
+            _fail(f"timed out after {timeout} s")
+        await process.wait()
+        await pumps
+    finally:
+        if process.returncode is None or failure:
+            _kill_group(process)
+        if process.returncode is None:
+            await process.wait()
+        if log is not None:
+            log.close()
+
+    stdout, stderr = "".join(out_tail), "".join(err_tail)
+    if failure or process.returncode != 0:
+        reason = failure[0] if failure else f"exited with status {process.returncode}"
+        raise ToolError(process.returncode or 1, command, stdout, stderr, reason, log_path)
+    return ToolResult(process.returncode, stdout, stderr, log_path)
+
+
+def run_tool(command, **kwargs):
+    """
+    Synchronous run_tool_async, for callers outside an event loop. At most the number
+    set by set_max_concurrent_tools (default: CPU count) run at once across threads.
+    """
+    with _tool_slots():
+        return asyncio.run(run_tool_async(command, **kwargs))
+
+
+def run_tools(invocations, max_concurrent=None):
+    """
+    Runs independent tool invocations concurrently, at most max_concurrent at a time
+    (default: CPU count). Every invocation also takes a slot of the process-wide limit
+    of set_max_concurrent_tools, shared with run_tool calls from other threads.
+
+    Args:
+        invocations (list): (command, kwargs) pairs, kwargs as for run_tool_async.
+
+    Returns:
+        list: ToolResult per invocation, in order. The first failure is raised after
+        all invocations have finished.
+    """
+    slots = _tool_slots()
+
+    async def _run_all():
+        semaphore = asyncio.Semaphore(max_concurrent or os.cpu_count() or 1)
+        loop = asyncio.get_running_loop()
+
+        async def _one(command, kwargs):
+            async with semaphore:
+                # The shared slot is a threading semaphore: wait for it off the event loop.
+                await loop.run_in_executor(None, slots.acquire)
+                try:
+                    return await run_tool_async(command, **kwargs)
+                finally:
+                    slots.release()
+
+        return await asyncio.gather(*(_one(c, k) for c, k in invocations), return_exceptions=True)
+
+    results = asyncio.run(_run_all())
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
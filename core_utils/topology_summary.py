@@ -0,0 +1,185 @@
+import io
+import os
+import re
+
+import numpy as np
+
+from core_utils.itp_parser import parse_itp
+
+# Accounting of a GROMACS system topology without grompp: the #include files are
+# resolved and parsed with core_utils.itp_parser, and the [ molecules ] counts are
+# combined with the per-moleculetype atom counts, charges and masses.
+# validate_structure checks the result against the coordinates before any GROMACS tool
+# is started.
+
+_INCLUDE = re.compile(r'^\s*#include\s+["<]([^">]+)[">]')
+_SECTION = re.compile(r'^\s*\[\s*(\w+)\s*\]')
+
+
+def _resolve_include(name, including_dir, include_dirs):
+    for directory in [including_dir] + list(include_dirs):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return os.path.abspath(path)
+    return None
+
+
+def read_topology(top_path, include_dirs=()):
+    """
+    Reads the includes and [ molecules ] of a topology.
+
+    Includes are searched next to the including file, then in include_dirs, and
+    followed recursively. top_path may also be an in-memory topology_updater.Topology,
+    read without writing it (relative includes are resolved from its path, else the
+    working directory).
+
+    Returns:
+        tuple: (included .itp paths in order, unresolved include names,
+                [(molecule name, count)] in order)
+    """
+    in_memory = not isinstance(top_path, str)
+    root = os.path.abspath(top_path.path or "topol.top") if in_memory else os.path.abspath(top_path)
+    includes, missing, molecules = [], [], []
+    pending = [root]
+    seen = set()
+    while pending:
+        path = pending.pop(0)
+        if path in seen:
+            continue
+        seen.add(path)
+        if path != root:
+            includes.append(path)
+        section = None
+        nested = []
+        with (io.StringIO(top_path.to_string()) if in_memory and path == root else open(path, 'r')) as f:
+            for line in f:
+                match = _INCLUDE.match(line)
+                if match:
+                    resolved = _resolve_include(match.group(1), os.path.dirname(path), include_dirs)
+                    if resolved:
+                        nested.append(resolved)
+                    else:
+                        missing.append(match.group(1))
+                    continue
+                line = line.split(';', 1)[0].strip()
+                if not line or line.startswith('#'):
+                    continue
+                match = _SECTION.match(line)
+                if match:
+                    section = match.group(1).lower()
+                elif section == 'molecules':
+                    parts = line.split()
+                    molecules.append((parts[0], int(parts[1])))
+        # Nested includes are read where they appear, before the rest of the queue.
+        pending[0:0] = nested
+    return includes, missing, molecules
+
+
+class TopologySummary:
+    """
+    Per-moleculetype and total atom counts, charges and masses of a system topology.
+
+    Attributes:
+        molecules (list): [(name, count)] from [ molecules ], in order.
+        types (dict): name -> {'n_atoms', 'charge', 'mass', 'atom_names'} per molecule.
+        missing_includes (list): Include names that could not be resolved.
+    """
+
+    def __init__(self, molecules, types, missing_includes=()):
+        self.molecules = molecules
+        self.types = types
+        self.missing_includes = list(missing_includes)
+
+    @property
+    def undefined(self):
+        """Molecule names listed in [ molecules ] without a moleculetype definition."""
+        return sorted({name for name, _ in self.molecules if name not in self.types})
+
+    def _total(self, key):
+        return sum(count * self.types[name][key] for name, count in self.molecules if name in self.types)
+
+    @property
+    def n_atoms(self):
+        return int(self._total('n_atoms'))
+
+    @property
+    def charge(self):
+        return float(self._total('charge'))
+
+    @property
+    def mass(self):
+        return float(self._total('mass'))
+
+    def expected_atom_names(self):
+        """Atom names of the whole system in topology order, as a GRO file holds them (5 characters)."""
+        blocks = [np.tile(np.asarray(self.types[name]['atom_names'], dtype='U5'), count)
+                  for name, count in self.molecules if count > 0]
+        return np.concatenate(blocks) if blocks else np.zeros(0, dtype='U5')
+
+    def report(self):
+        print(f"Topology summary: {self.n_atoms} atoms, charge {self.charge:+.4f}, mass {self.mass:.2f} amu")
+        for name, count in self.molecules:
+            if name in self.types:
+                t = self.types[name]
+                print(f"  {name:<15} x{count:<8} {t['n_atoms']:>6} atoms  charge {t['charge']:+.4f}  mass {t['mass']:.2f}")
+            else:
+                print(f"  {name:<15} x{count:<8} (no moleculetype definition)")
+
+
+def summarize_topology(top_path, include_dirs=()):
+    """
+    Builds the TopologySummary of a .top file (or an in-memory Topology) from its includes.
+
+    Masses missing from [ atoms ] are taken from the [ atomtypes ] of the included files.
+    """
+    includes, missing, molecules = read_topology(top_path, include_dirs)
+    moleculetypes, masses, defines = {}, {}, {}
+    for itp_path in includes:
+        # Macros defined by earlier includes apply to the later ones, as in grompp.
+        parsed = parse_itp(itp_path, defines)
+        moleculetypes.update(parsed.moleculetypes)
+        masses.update(parsed.atomtype_masses)
+        defines = parsed.defines
+    types = {}
+    for name in {name for name, _ in molecules}:
+        if name not in moleculetypes:
+            continue
+        moltype = moleculetypes[name]
+        types[name] = {
+            'n_atoms': moltype.n_atoms,
+            'charge': moltype.charge,
+            'mass': float(moltype.masses(masses).sum()),
+            'atom_names': moltype.atoms['atom'].tolist(),
+        }
+    return TopologySummary(molecules, types, missing)
+
+
+def validate_structure(summary, structure, check_names=True):
+    """
+    Checks that a structure matches the topology: every molecule is defined and the atom
+    counts agree. With check_names the atom names are compared atom by atom; like grompp,
+    which only warns about them, name mismatches (e.g. element names of molecules
+    converted from .xyz) are returned as warnings.
+
+    Returns:
+        list: Warning messages (empty if the names agree or were not checked).
+
+    Raises:
+        ValueError: Describing the first undefined molecule or count mismatch.
+    """
+    if summary.missing_includes:
+        raise ValueError(f"Unresolved #include files: {', '.join(summary.missing_includes)}")
+    if summary.undefined:
+        raise ValueError(f"Molecules without a moleculetype definition: {', '.join(summary.undefined)}")
+    if summary.n_atoms != structure.n_atoms:
+        raise ValueError(f"Topology describes {summary.n_atoms} atoms, the structure has {structure.n_atoms}")
+    warnings = []
+    if check_names:
+        expected = summary.expected_atom_names()
+        mismatch = np.flatnonzero(expected != structure.atomname)
+        if len(mismatch):
+            i = int(mismatch[0])
+            warnings.append(f"{len(mismatch)} atom names differ from the topology; first at atom {i + 1}: "
+                            f"'{structure.atomname[i]}' (residue {structure.resname[i]} {structure.resid[i]}), "
+                            f"expected '{expected[i]}'")
+    return warnings
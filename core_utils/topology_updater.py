@@ -1,21 +1,198 @@
 import re
 import os
 from config_params.config import Config
+from core_utils.itp_parser import parse_itp
 
-def create_system_topology(output_dir, top_path, itp_files):
-    top_content = ""
+_INCLUDE_LINE = re.compile(r'^\s*#include\s+["<]([^">]+)[">]')
+_SECTION_LINE = re.compile(r'^\s*\[\s*(\w+)\s*\]')
+
+
+class Topology:
+    """
+    In-memory system topology: the lines before [ system ] (the #include lines and any
+    other directives, kept verbatim), the system name, the ordered [ molecules ] list
+    and any sections after it.
+
+    The pipeline updates the object and writes it once; read() parses files written by
+    write() or modified by GROMACS (genion appends to [ molecules ]), so both
+    round-trip.
+
+    Attributes:
+        preamble (list): Lines before [ system ], without trailing newlines.
+        system_name (str)
+        molecules (list): [name, count] pairs in order; a name may appear more than once.
+        trailer (list): Lines after the [ molecules ] entries.
+        path (str): The file read from or last written to, if any.
+    """
+
+    def __init__(self, includes=(), system_name="My System", molecules=(), preamble=None, trailer=()):
+        self.preamble = list(preamble) if preamble is not None else []
+        self.system_name = system_name
+        self.molecules = [[name, int(count)] for name, count in molecules]
+        self.trailer = list(trailer)
+        self.path = None
+        self.add_includes(includes)
+
+    @classmethod
+    def read(cls, top_path):
+        preamble, name_lines, molecules, trailer = [], [], [], []
+        section = None
+        with open(top_path, 'r') as f:
+            for raw in f:
+                line = raw.rstrip('\n')
+                match = _SECTION_LINE.match(line)
+                if match and section != 'trailer':
+                    name = match.group(1).lower()
+                    if name in ('system', 'molecules'):
+                        section = name
+                        continue
+                    if section == 'molecules':
+                        section = 'trailer'
+                if section is None:
+                    preamble.append(line)
+                elif section == 'system':
+                    if line.strip() and not line.lstrip().startswith(';'):
+                        name_lines.append(line.strip())
+                elif section == 'molecules':
+                    content = line.split(';', 1)[0].split()
+                    if content:
+                        molecules.append([content[0], int(content[1])])
+                else:
+                    trailer.append(line)
+        while preamble and not preamble[-1].strip():
+            preamble.pop()
+        topology = cls(system_name=" ".join(name_lines) or "My System", molecules=molecules,
+                       preamble=preamble, trailer=trailer)
+        topology.path = top_path
+        return topology
+
+    @property
+    def includes(self):
+        """The #include paths of the preamble, in order."""
+        return [m.group(1) for m in (_INCLUDE_LINE.match(line) for line in self.preamble) if m]
+
+    def add_includes(self, paths):
+        """Adds #include lines (absolute paths) after the last one, skipping included files."""
+        present = {os.path.abspath(p) for p in self.includes}
+        new_lines = []
+        for path in paths:
+            abs_path = os.path.abspath(path)
+            if abs_path not in present:
+                present.add(abs_path)
+                new_lines.append(f'#include "{abs_path}"')
+        last = max((i for i, line in enumerate(self.preamble) if _INCLUDE_LINE.match(line)), default=-1)
+        self.preamble[last + 1:last + 1] = new_lines
+        return len(new_lines)
+
+    def counts(self):
+        """Molecule counts summed by name, in order of first appearance."""
+        counts = {}
+        for name, count in self.molecules:
+            counts[name] = counts.get(name, 0) + count
+        return counts
+
+    def set_molecules(self, molecule_counts):
+        """Replaces [ molecules ] with the given counts (dict, in order); zero counts are left out."""
+        self.molecules = [[name, int(count)] for name, count in molecule_counts.items() if count > 0]
+
+    def to_string(self):
+        lines = list(self.preamble)
+        lines += ["", "[ system ]", self.system_name, "", "[ molecules ]", "; Compound        #mols"]
+        lines += [f"{name:<15} {count}" for name, count in self.molecules]
+        if self.trailer:
+            lines += [""] + self.trailer
+        return "\n".join(lines) + "\n"
+
+    def write(self, top_path=None):
+        top_path = top_path or self.path
+        with open(top_path, 'w') as f:
+            f.write(self.to_string())
+        self.path = top_path
+        return top_path
+
+
+def create_system_topology(output_dir, top_path, itp_files, write=True):
+    """
+    Builds the system Topology with an #include (absolute path) for the config's
+    additional_itp_files and every file in itp_files, and an empty [ molecules ].
+    Written to top_path unless write is False.
+    """
     default_itps = Config.get_param('additional_itp_files')
-    all_itps = list(dict.fromkeys(default_itps + itp_files))
-    
-    for itp_file in all_itps:
-        # Always use absolute paths for include files as requested.
-        abs_path = os.path.abspath(itp_file)
-        top_content += f'#include "{abs_path}"\n'
-
-    top_content += "\n[ system ]\nMy System\n\n[ molecules ]\n; Compound        #mols\n"
-    with open(top_path, 'w') as f:
-        f.write(top_content)
-    print(f"성공적으로 토폴로지 파일 '{top_path}'을 생성했습니다.")
+    topology = Topology(includes=list(default_itps) + list(itp_files))
+    topology.path = top_path
+    if write:
+        topology.write()
+        print(f"성공적으로 토폴로지 파일 '{top_path}'을 생성했습니다.")
+    return topology
+
+def select_topology_includes(itp_files, required_names, library=None):
+    """
+    Chooses the .itp files a topology has to include for the given moleculetypes.
+
+    Files outside the library (config-provided and generated ones, such as the hydrogel
+    .itp) are always kept. Library files are kept if they define force-field parameters
+    ([ defaults ] or [ *types ]) or a required moleculetype that no kept file defines
+    yet; the #include dependencies of kept library files are kept with them. All other
+    library files are pruned.
+
+    Args:
+        itp_files (list): Candidate .itp paths, in include order.
+        required_names (iterable): Moleculetypes of [ molecules ], including those added later (ions).
+        library (MartiniLibrary): Index of the force-field directory; None keeps every file.
+
+    Returns:
+        tuple: (kept paths in the original order, {path: reason} of the kept files,
+                pruned paths, required names no file defines)
+    """
+    itp_files = list(dict.fromkeys(os.path.abspath(p) for p in itp_files))
+    if library is None:
+        return itp_files, {p: "included" for p in itp_files}, [], []
+    required = list(dict.fromkeys(required_names))
+    reasons = {}
+    defined = set()
+    for path in itp_files:
+        if not library.indexed(path):
+            reasons[path] = "explicit"
+            if os.path.isfile(path):
+                defined.update(parse_itp(path).moleculetypes)
+        elif library.defines_parameters(path):
+            reasons[path] = "force-field parameters"
+            defined.update(library.moleculetype_names(path))
+
+    candidates = [p for p in itp_files if p not in reasons]
+    for name in required:
+        if name in defined:
+            continue
+        provider = next((p for p in candidates if name in library.moleculetype_names(p)), None)
+        if provider is None:
+            continue
+        provided = sorted(set(library.moleculetype_names(provider)) & set(required))
+        reasons[provider] = "defines " + ", ".join(provided)
+        defined.update(library.moleculetype_names(provider))
+
+    pending = [p for p in reasons if library.indexed(p)]
+    while pending:
+        path = pending.pop()
+        for name in library.includes(path):
+            dependency = os.path.abspath(os.path.join(os.path.dirname(path), name))
+            if dependency in itp_files and dependency not in reasons:
+                reasons[dependency] = f"included by {os.path.basename(path)}"
+                pending.append(dependency)
+
+    kept = [p for p in itp_files if p in reasons]
+    pruned = [p for p in itp_files if p not in reasons]
+    missing = [name for name in required if name not in defined]
+    return kept, reasons, pruned, missing
+
+
+def print_include_report(kept, reasons, pruned, missing):
+    print(f"Topology includes: {len(kept)} kept, {len(pruned)} pruned")
+    for path in kept:
+        print(f"  + {os.path.basename(path):<45} {reasons[path]}")
+    for path in pruned:
+        print(f"  - {os.path.basename(path)}")
+    if missing:
+        print(f"경고: 다음 moleculetype을 정의하는 ITP 파일이 없습니다: {', '.join(missing)}")
 
 def update_topology_molecules(topology_file, molecule_counts, additional_itp_includes=None):
     """
@@ -31,65 +208,13 @@ def update_topology_molecules(topology_file, molecule_counts, additional_itp_inc
         print(f"경고: 토폴로지 파일 '{topology_file}'을(를) 찾을 수 없어 업데이트를 건너뜁니다.")
         return
 
-    with open(topology_file, 'r') as f:
-        lines = f.readlines()
-
-    # --- Include additional ITP files ---
-    if additional_itp_includes:
-        include_section_end_index = -1
-        for i, line in enumerate(lines):
-            if line.strip().startswith('#include'):
-                include_section_end_index = i
-            elif line.strip().startswith('[ system ]'):
-                break
-        
-        new_includes = []
-        for itp_path in additional_itp_includes:
-            include_line = f'#include "{itp_path}"\n'
-            # Avoid adding duplicate includes
-            if not any(include_line.strip() == l.strip() for l in lines):
-                new_includes.append(include_line)
-        
-        if new_includes:
-            insert_index = include_section_end_index + 1 if include_section_end_index != -1 else 0
-            lines[insert_index:insert_index] = new_includes
-            print(f"'{topology_file}'에 추가 ITP 파일들을 포함했습니다.")
-
-    # --- Update [ molecules ] section ---
     try:
-        molecules_section_start = -1
-        molecules_section_end = -1
-        for i, line in enumerate(lines):
-            if re.match(r'^\s*\[\s*molecules\s*\]', line):
-                molecules_section_start = i
-            elif molecules_section_start != -1 and line.strip().startswith('['):
-                molecules_section_end = i
-                break
-        
-        if molecules_section_start == -1:
-            # If no [molecules] section, add one at the end
-            lines.append("\n[ molecules ]\n")
-            lines.append("; Compound        #mols\n")
-            molecules_section_start = len(lines) - 2
-
-        if molecules_section_end == -1:
-            molecules_section_end = len(lines)
-
-        # Create the new molecules list
-        new_molecule_lines = [lines[molecules_section_start], "; Compound        #mols\n"]
-        for name, count in molecule_counts.items():
-            if count > 0:
-                new_molecule_lines.append(f"{name:<15} {count}\n")
-
-        # Replace the old molecules section with the new one
-        del lines[molecules_section_start+1:molecules_section_end]
-        lines[molecules_section_start+1:molecules_section_start+1] = new_molecule_lines[1:]
-
-        with open(topology_file, 'w') as f:
-            f.writelines(lines)
-        
+        topology = Topology.read(topology_file)
+        if additional_itp_includes and topology.add_includes(additional_itp_includes):
+            print(f"'{topology_file}'에 추가 ITP 파일들을 포함했습니다.")
+        topology.set_molecules(molecule_counts)
+        topology.write()
         print(f"'{topology_file}'의 [ molecules ] 섹션을 성공적으로 업데이트했습니다.")
-
     except Exception as e:
         print(f"토폴로지 파일 업데이트 중 오류 발생: {e}", file=os.sys.stderr)
         raise
@@ -4,8 +4,58 @@
 ##### 수정 이력 (2021/04/20) ######
 # .gro 파일 수정: atom type -> atom name
 
+import itertools
 import numpy as np
+import operator
 import os
+import tempfile
+
+from core_utils import bulk_format as bf
+from core_utils import itp_parser
+from core_utils import structure_io
+from core_utils.structure import Structure
+
+
+def _atom_columns(atoms, with_topology=False):
+    '''
+      World.Atoms 값(원자 리스트)에서 출력에 필요한 속성을 한 번에 열(column) 배열로 모읍니다.
+      원자 객체는 여기서 한 번만 참조되고, 이후의 포맷팅은 배열 단위로 처리됩니다.
+
+      Args:
+          atoms (list): Atom 객체 리스트 (출력 순서)
+          with_topology (bool): .itp 에 필요한 atom_type, cgnr, charge, mass 도 포함할지 여부
+    '''
+    def _column(attr, dtype):
+        values = list(map(operator.attrgetter(attr), atoms))
+        if dtype is str:
+            # 이름은 str() 결과를 그대로 씁니다 (대부분 이미 문자열).
+            return np.array(values if all(type(v) is str for v in values) else [str(v) for v in values], dtype=str)
+        # int(), float() 와 같은 변환 (실수 레지듀 번호는 0 방향으로 버림)
+        return np.array(values).astype(dtype).reshape(len(values))
+
+    columns = {
+        'atom_id': _column('atom_id', np.int64),
+        'residue_number': _column('residue_number', np.int64),
+        'residue_name': _column('residue_name', str),
+        'atom_name': _column('atom_name', str),
+        'position': np.array(list(map(operator.attrgetter('position'), atoms)), dtype=np.float64).reshape(-1, 3),
+    }
+    if with_topology:
+        columns['atom_type'] = _column('atom_type', str)
+        columns['cgnr'] = _column('cgnr', np.int64)
+        columns['charge'] = _column('charge', np.float64)
+        columns['mass'] = _column('mass', np.float64)
+    return columns
+
+
+def _name_field(values, width, align='<'):
+    '''
+      문자열 열을 bulk_format Field 로 만듭니다. str.format 은 문자 수 기준으로 폭을 채우므로
+      비 ASCII 이름이 있으면 미리 문자 단위로 채워 바이트 폭 차이를 없앱니다.
+    '''
+    if values.size and values.view(np.uint32).max() >= 128:
+        values = np.char.ljust(values, width) if align == '<' else np.char.rjust(values, width)
+    return bf.str_field(values)
 
 
 def write_to_xyz(object, filename='xyz.xyz'):
@@ -32,76 +82,216 @@ def write_to_xyz(object, filename='xyz.xyz'):
     f.close()
 
 
-def write_to_lammps(object, filename='lammps.data'):
+# LAMMPS 'real' 단위로 바꾸는 계수 (GROMACS: nm, kJ/mol -> LAMMPS: Å, kcal/mol)
+_NM_TO_ANGSTROM = 10.0
+_KJ_TO_KCAL = 1.0 / 4.184
+# .itp 의 RUBBER_BANDS 블록이 정의하는 기본 고무줄 힘 상수 (kJ/mol/nm^2)
+_RUBBER_FC = 500.0
+# GROMACS funct -> LAMMPS style
+_LAMMPS_BOND_STYLES = {1: 'harmonic'}
+_LAMMPS_ANGLE_STYLES = {1: 'harmonic', 2: 'cosine/squared'}
+_LAMMPS_DIHEDRAL_STYLES = {1: 'charmm', 9: 'charmm'}
+_LAMMPS_IMPROPER_STYLES = {2: 'harmonic'}
+
+
+def _checked_functs(values, styles, section):
+    '''
+      funct 열을 int64 배열로 만들고, LAMMPS style 이 없는 funct 가 있으면 ValueError 를 냅니다.
+      파라미터를 숫자로 바꾸기 전에 확인하므로, funct 마다 다른 파라미터 형식을 따로 다룰 수 있습니다.
+    '''
+    try:
+        functs = np.asarray(values, dtype=np.float64).astype(np.int64).reshape(len(values))
+    except (TypeError, ValueError):
+        raise ValueError(f"LAMMPS 로 내보낼 수 없는 {section} funct 가 있습니다 (숫자가 아닌 값)")
+    unsupported = sorted(set(np.unique(functs).tolist()) - set(styles))
+    if unsupported:
+        raise ValueError(f"LAMMPS 로 내보낼 수 없는 {section} funct: {unsupported} (지원: {sorted(styles)})")
+    return functs
+
+
+def _numeric_parameters(columns, section):
+    '''
+      파라미터 열들을 (n, k) float64 배열로 만듭니다. 숫자가 아닌 값(매크로 이름 등)은
+      LAMMPS 로 옮길 수 없으므로 ValueError 를 냅니다.
     '''
-      시스템 정보를 LAMMPS 데이터 파일 형식으로 저장합니다.
+    try:
+        return np.column_stack([np.asarray(column, dtype=np.float64) for column in columns]).reshape(-1, len(columns))
+    except (TypeError, ValueError):
+        raise ValueError(f"LAMMPS 로 내보낼 수 없는 {section} 파라미터가 있습니다 (숫자가 아닌 값)")
+
+
+def _lammps_types(parameters, styles):
+    '''
+      같은 (funct, 파라미터) 조합에 하나의 LAMMPS 타입 번호를 붙입니다.
+      funct 는 _checked_functs 로 미리 확인된 것이어야 합니다.
+
+      Returns:
+          tuple: (고유 조합 (t, k) 배열, 행별 타입 번호(1부터) int64 배열, 타입별 style 리스트)
+    '''
+    if not len(parameters):
+        return parameters, np.zeros(0, dtype=np.int64), []
+    # np.unique(axis=0) 과 같은 (사전식) 순서지만, 열마다 정수 순위로 바꿔 하나의 키로 합치는 편이 빠릅니다.
+    key = np.zeros(len(parameters), dtype=np.int64)
+    for column in parameters.T:
+        values, rank = np.unique(column, return_inverse=True)
+        _, key = np.unique(key * len(values) + rank.reshape(-1), return_inverse=True)
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    unique = parameters[first]
+    return unique, inverse.reshape(-1) + 1, [styles[int(funct)] for funct in unique[:, 0]]
+
+
+def _write_coeffs(f, title, styles, coefficients):
+    # 스타일이 하나면 '# style' 주석만, 여러 개면 hybrid 형식으로 줄마다 style 이름을 씁니다.
+    if not styles:
+        return
+    hybrid = len(set(styles)) > 1
+    f.write(f"\n{title} # {'hybrid' if hybrid else styles[0]}\n\n".encode('ascii'))
+    for number, (style, values) in enumerate(zip(styles, coefficients), start=1):
+        text = " ".join(values)
+        f.write((f"{number} {style} {text}\n" if hybrid else f"{number} {text}\n").encode('ascii'))
+
+
+def write_to_lammps(object, filename='lammps.data', constraint_fc=1000000.0):
+    '''
+      시스템 정보를 LAMMPS 데이터 파일 형식(atom_style full, units real)으로 저장합니다.
+
+      원자 타입은 (atom_type, mass) 조합마다, 결합/각도/이면각 타입은 (funct, 파라미터) 조합마다
+      np.unique 로 번호를 붙이고, 각 섹션은 배열에서 bulk_format 으로 한 번에 씁니다.
+      Coeffs 섹션은 GROMACS 파라미터를 LAMMPS 식에 맞게 바꿉니다 (Å, kcal/mol, 도):
+        - bonds funct 1 -> harmonic (K = kb/2)
+        - angles funct 1 -> harmonic, funct 2 -> cosine/squared (K = k/2)
+        - dihedrals funct 1, 9 -> charmm (K, n, d, 가중치 0)
+        - dihedrals funct 2 (improper) -> Impropers 섹션, harmonic (K = k/2, chi0)
+      고무줄 결합은 일반 결합으로 들어가고 (c1 이 'RUBBER_FC' 이면 500), constraints 는 힘 상수
+      constraint_fc 의 강한 조화 결합이 됩니다. exclusions 는 데이터 파일에 담을 수 없으므로
+      입력 스크립트(special_bonds 등)에서 따로 지정해야 합니다.
 
       Args:
           object (World): 시스템 정보를 포함하는 World 객체
           filename (str): 저장할 파일 이름
+          constraint_fc (float): constraints 를 대신하는 결합의 힘 상수 (kJ/mol/nm^2,
+              Martini 의 FLEXIBLE 값)
+
+      Raises:
+          ValueError: 지원하지 않는 funct 나 숫자가 아닌 파라미터가 있을 때
     '''
+    atoms = _atom_columns([object.Atoms[i][0] for i in range(len(object.Atoms))], with_topology=True)
+    n_atoms = len(atoms['atom_id'])
+
+    # 원자 타입: (atom_type, mass) 조합
+    type_keys = np.zeros(n_atoms, dtype=[('name', atoms['atom_type'].dtype), ('mass', np.float64)])
+    type_keys['name'], type_keys['mass'] = atoms['atom_type'], atoms['mass']
+    atom_types, atom_type_ids = np.unique(type_keys, return_inverse=True)
+    atom_type_ids = atom_type_ids.reshape(-1) + 1
+
+    # 결합 = 일반 결합 + 고무줄 결합 + constraints, 파라미터는 (funct, b0, kb)
+    bond_ids, (funct, c0, c1) = _interaction_table(object.Bonds, 2, ('bond_funct', 'bond_c0', 'bond_c1'))
+    network_ids, (n_funct, n_c0, n_c1) = _interaction_table(
+        object.Network_bonds, 2, ('network_bond_funct', 'network_bond_c0', 'network_bond_c1'))
+    n_c1 = [_RUBBER_FC if value == 'RUBBER_FC' else value for value in n_c1]
+    constraint_ids, (_, k_c0) = _interaction_table(object.Constraints, 2, ('constraint_funct', 'constraint_c0'))
+    bond_ids = np.concatenate([bond_ids, network_ids, constraint_ids])
+    _checked_functs(funct, _LAMMPS_BOND_STYLES, 'bonds')
+    _checked_functs(n_funct, _LAMMPS_BOND_STYLES, 'network bonds')
+    bond_types, bond_type_ids, bond_styles = _lammps_types(np.concatenate([
+        _numeric_parameters((funct, c0, c1), 'bonds'),
+        _numeric_parameters((n_funct, n_c0, n_c1), 'network bonds'),
+        _numeric_parameters(([1] * len(k_c0), k_c0, [constraint_fc] * len(k_c0)), 'constraints'),
+    ]), _LAMMPS_BOND_STYLES)
+
+    angle_ids, columns = _interaction_table(object.Angles, 3, ('angle_funct', 'angle_c0', 'angle_c1'))
+    _checked_functs(columns[0], _LAMMPS_ANGLE_STYLES, 'angles')
+    angle_types, angle_type_ids, angle_styles = _lammps_types(
+        _numeric_parameters(columns, 'angles'), _LAMMPS_ANGLE_STYLES)
+
+    # 이면각 키는 (i, j, m, n, c0) 이므로 앞의 네 원자 번호만 씁니다. funct 2 (improper) 는
+    # (funct, xi0, k) 만 있고 c2 가 비어 있으므로, funct 로 나눈 뒤 각자의 열만 숫자로 바꿉니다.
+    dihedral_ids, columns = _interaction_table(
+        object.Dihedrals, 4, ('dihedral_funct', 'dihedral_c0', 'dihedral_c1', 'dihedral_c2'))
+    functs = _checked_functs(columns[0], {**_LAMMPS_DIHEDRAL_STYLES, **_LAMMPS_IMPROPER_STYLES}, 'dihedrals')
+    is_improper = np.isin(functs, list(_LAMMPS_IMPROPER_STYLES))
+    improper_rows, dihedral_rows = np.flatnonzero(is_improper).tolist(), np.flatnonzero(~is_improper).tolist()
+    improper_ids, dihedral_ids = dihedral_ids[improper_rows], dihedral_ids[dihedral_rows]
+    dihedral_types, dihedral_type_ids, dihedral_styles = _lammps_types(_numeric_parameters(
+        [[column[i] for i in dihedral_rows] for column in columns], 'dihedrals'), _LAMMPS_DIHEDRAL_STYLES)
+    improper_types, improper_type_ids, improper_styles = _lammps_types(_numeric_parameters(
+        [[column[i] for i in improper_rows] for column in columns[:3]], 'impropers'), _LAMMPS_IMPROPER_STYLES)
+
     if os.path.dirname(filename):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-    f = open(filename, 'w')
+    f = open(filename, 'wb')
+
+    def _text(text):
+        f.write(text.encode('utf-8'))
+
+    def _index_records(ids, type_ids):
+        # 'ID type atom1 atom2 ...' 줄 (ID, 원자 번호는 1부터)
+        bf.write_records(f, lambda a, b: [
+            bf.fixed(bf.int_field(np.arange(a + 1, b + 1)), 0), b' ', bf.fixed(bf.int_field(type_ids[a:b]), 0),
+            *[part for k in range(ids.shape[1]) for part in (b' ', bf.fixed(bf.int_field(ids[a:b, k]), 0))],
+            b'\n',
+        ], len(ids))
+
+    _text('Hydrogel LAMMPS data file (atom_style full, units real)\n\n')
+
+    # 헤더 정보: 원자, 결합, 각도, 이면각, improper 의 개수와 타입 개수
+    _text(f'{n_atoms:d} atoms\n{len(bond_ids):d} bonds\n{len(angle_ids):d} angles\n{len(dihedral_ids):d} dihedrals\n')
+    _text(f'{len(improper_ids):d} impropers\n')
+    _text(f'{len(atom_types):d} atom types\n{len(bond_types):d} bond types\n')
+    _text(f'{len(angle_types):d} angle types\n{len(dihedral_types):d} dihedral types\n')
+    _text(f'{len(improper_types):d} improper types\n\n')
 
-    f.write('AuPS initial configuration\n\n') # 주석
-
-    # 헤더 정보: 원자, 결합, 각도 등의 개수와 타입 개수
-    f.write('{:d} atoms\n'.format(len(object.Atoms)))
-    f.write('{:d} bonds\n'.format(len(object.Bonds)))
-    f.write('{:d} angles\n'.format(len(object.Angles)))
-    f.write('{:d} atom types\n'.format(2)) # 원자 타입 개수 (하드코딩)
-    f.write('{:d} bond types\n'.format(2)) # 결합 타입 개수 (하드코딩)
-    f.write('{:d} angle types\n\n'.format(2)) # 각도 타입 개수 (하드코딩)
-
-    # 시뮬레이션 박스 크기 정보
-    xlo, xhi = 0.0, object.box_length
-    ylo, yhi = 0.0, object.box_length
-    zlo, zhi = 0.0, object.box_length
-
-    f.write('{:.8f} {:.8f} xlo xhi\n'.format(xlo, xhi))
-    f.write('{:.8f} {:.8f} ylo yhi\n'.format(ylo, yhi))
-    f.write('{:.8f} {:.8f} zlo zhi\n\n'.format(zlo, zhi))
-
-    # 질량 정보
-    f.write('Masses\n\n')
-    f.write('1 {:.8f}\n'.format(1.0))
-    f.write('2 {:.8f}\n\n'.format(1.0))
-
-    # 원자 정보: atom-ID, molecule-ID, atom-type, charge, x, y, z
-    f.write('Atoms\n\n')
-    for i in object.Atoms:
-        atom = object.Atoms[i][0]
-        tmp = 1 # molecule-ID (임시로 1로 설정)
-        f.write('{:<d}   {:d}    {:d}    {:.8}    {:.8f}   {:.8f}  {:.8f}\n'.
-                format(atom.atom_id + 1, tmp, 1, atom.charge, # atom-type도 임시로 1로 설정
-                       atom.position[0], atom.position[1], atom.position[2]))
-    
-    # 결합 정보: bond-ID, bond-type, atom1-ID, atom2-ID
-    f.write('\nBonds\n\n')
-    for j, b in enumerate(object.Bonds):
-        bond = object.Bonds[b][0]
-        f.write('{:d} {:d} {:d} {:d}\n'.
-                format(j + 1, bond.bond_type + 1, b[0] + 1, b[1] + 1))
-
-    # 각도 정보: angle-ID, angle-type, atom1-ID, atom2-ID, atom3-ID
-    f.write('\nAngles\n\n')
-    for k, z in enumerate(object.Angles):
-        angle = object.Angles[z][0]
-        f.write('{:d} {:d} {:d} {:d} {:d}\n'.format(k + 1, angle.angle_type + 1, z[0] + 1, z[1] + 1, z[2] + 1))
-
-    # 이면각 정보
-    f.write('\nDihedrals\n\n')
-    for p, q in enumerate(object.Dihedrals):
-        f.write('{} {} {} {} {} {}\n'.format(p + 1, 1, q[0] + 1, q[1] + 1, q[2] + 1, q[3] + 1))
+    # 시뮬레이션 박스 크기 정보 (Å)
+    box = object.box_length * _NM_TO_ANGSTROM
+    for axis in 'xyz':
+        _text(f'{0.0:.8f} {box:.8f} {axis}lo {axis}hi\n')
 
+    # 질량 정보: 타입 번호, 질량, 주석으로 원래 atom_type
+    _text('\nMasses\n\n')
+    for number, (name, mass) in enumerate(atom_types.tolist(), start=1):
+        _text(f'{number:d} {mass:.6f} # {name}\n')
+
+    _write_coeffs(f, 'Bond Coeffs', bond_styles, [
+        (f'{kb / 2 * _KJ_TO_KCAL / _NM_TO_ANGSTROM ** 2:.6f}', f'{b0 * _NM_TO_ANGSTROM:.6f}')
+        for _, b0, kb in bond_types.tolist()])
+    _write_coeffs(f, 'Angle Coeffs', angle_styles, [
+        (f'{k / 2 * _KJ_TO_KCAL:.6f}', f'{theta:.6f}') for _, theta, k in angle_types.tolist()])
+    _write_coeffs(f, 'Dihedral Coeffs', dihedral_styles, [
+        (f'{k * _KJ_TO_KCAL:.6f}', f'{int(n):d}', f'{int(round(phi)):d}', '0.0')
+        for _, phi, k, n in dihedral_types.tolist()])
+    _write_coeffs(f, 'Improper Coeffs', improper_styles, [
+        (f'{k / 2 * _KJ_TO_KCAL:.6f}', f'{xi:.6f}') for _, xi, k in improper_types.tolist()])
+
+    # 원자 정보: atom-ID, molecule-ID (하이드로젤 전체가 분자 1), atom-type, charge, x, y, z (Å)
+    _text('\nAtoms # full\n\n')
+    position = atoms['position'] * _NM_TO_ANGSTROM
+    bf.write_records(f, lambda a, b: [
+        bf.fixed(bf.int_field(atoms['atom_id'][a:b] + 1), 0), b' 1 ', bf.fixed(bf.int_field(atom_type_ids[a:b]), 0), b' ',
+        bf.fixed(bf.float_field(atoms['charge'][a:b], 6), 0), b' ', bf.fixed(bf.float_field(position[a:b, 0], 6), 0), b' ',
+        bf.fixed(bf.float_field(position[a:b, 1], 6), 0), b' ', bf.fixed(bf.float_field(position[a:b, 2], 6), 0), b'\n',
+    ], n_atoms)
+
+    for title, ids, type_ids in (('Bonds', bond_ids, bond_type_ids), ('Angles', angle_ids, angle_type_ids),
+                                 ('Dihedrals', dihedral_ids, dihedral_type_ids),
+                                 ('Impropers', improper_ids, improper_type_ids)):
+        if len(ids):
+            _text(f'\n{title}\n\n')
+            _index_records(ids, type_ids)
     f.close()
 
+    if len(object.Exclusions):
+        print(f"LAMMPS 데이터 파일에는 exclusions {len(object.Exclusions)}개가 들어가지 않습니다 (입력 스크립트에서 지정).")
+    return 1
+
 
 def write_to_gro(object, filename='gromacs.gro'):
     '''
       시스템 정보를 GROMACS .gro 파일 형식으로 저장합니다.
 
+      filename 이 .gz / .zst 로 끝나면 압축하며, 압축은 별도 스레드에서 포맷팅과 겹쳐 진행됩니다.
+      .g96 (압축 포함) 이나 .npz 이름이면 Structure 로 바꿔 structure_io 로 저장하고,
+      그 밖의 확장자는 모두 .gro 형식으로 씁니다.
+
       Args:
           object (World): 시스템 정보를 포함하는 World 객체
           DNA (DNAimport): DNA 정보 객체 (여기서는 사용되지 않음)
@@ -109,127 +299,238 @@ def write_to_gro(object, filename='gromacs.gro'):
     '''
     if os.path.dirname(filename):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-    f = open(filename, 'w')
-    f.write('Gromacs.gro file\n') # 주석
-    f.write(4 * ' ' + '{}\n'.format(len(object.Atoms))) # 전체 원자 수
-    
-    # 원자 정보: res-num, res-name, atom-name, atom-num, x, y, z
-    # GROMACS .gro 파일은 고정된 자릿수 형식을 따릅니다.
-    for i in object.Atoms:
-        atom = object.Atoms[i][0]
-        f.write('{:>5d}{:<5}{:<5}{:>5d}{:>8.3f}{:>8.3f}{:>8.3f}\n'.format(
-            int(atom.residue_number) % 100000, # 레지듀 번호
-            atom.residue_name, # 레지듀 이름
-            atom.atom_name, # 원자 이름
-            (atom.atom_id + 1) % 100000, # 원자 번호
-            atom.position[0], # x 좌표 (nm)
-            atom.position[1], # y 좌표 (nm)
-            atom.position[2]  # z 좌표 (nm)
-        ))
-        
-    # 마지막 줄: 시뮬레이션 박스 벡터 (x, y, z)
-    f.write('   {:.5f}    {:.5f}    {:.5f}\n'.format(object.box_length, object.box_length, object.box_length))
-    f.close()
+    if structure_io.structure_format(filename) in ('.g96', '.npz'):
+        columns = _atom_columns([object.Atoms[i][0] for i in object.Atoms])
+        structure = Structure(columns['residue_number'], columns['residue_name'], columns['atom_name'],
+                              columns['position'], [object.box_length] * 3, 'Gromacs.gro file')
+        structure_io.write_structure(filename, structure)
+        return 1
+    # 원자 속성을 열 배열로 모은 뒤 bulk_format 으로 고정 폭 레코드를 한꺼번에 만들어
+    # 큰 덩어리(chunk) 단위로 기록합니다. 출력은 한 줄씩
+    # '{:>5d}{:<5}{:<5}{:>5d}{:>8.3f}{:>8.3f}{:>8.3f}' 로 쓰던 것과 바이트 단위로 같습니다.
+    atoms = [object.Atoms[i][0] for i in object.Atoms]
+    columns = _atom_columns(atoms)
+    position = columns['position']
+
+    def _parts(start, stop):
+        return [
+            bf.fixed(bf.int_field(columns['residue_number'][start:stop] % 100000), 5), # 레지듀 번호
+            bf.fixed(_name_field(columns['residue_name'][start:stop], 5), 5, '<'), # 레지듀 이름
+            bf.fixed(_name_field(columns['atom_name'][start:stop], 5), 5, '<'), # 원자 이름
+            bf.fixed(bf.int_field((columns['atom_id'][start:stop] + 1) % 100000), 5), # 원자 번호
+            bf.fixed(bf.float_field(position[start:stop, 0], 3), 8), # x 좌표 (nm)
+            bf.fixed(bf.float_field(position[start:stop, 1], 3), 8), # y 좌표 (nm)
+            bf.fixed(bf.float_field(position[start:stop, 2], 3), 8), # z 좌표 (nm)
+            b'\n',
+        ]
+
+    with structure_io.open_output(filename) as f:
+        f.write(b'Gromacs.gro file\n') # 주석
+        f.write((4 * ' ' + '{}\n'.format(len(atoms))).encode('ascii')) # 전체 원자 수
+        # 원자 정보: res-num, res-name, atom-name, atom-num, x, y, z
+        bf.write_records(f, _parts, len(atoms))
+        # 마지막 줄: 시뮬레이션 박스 벡터 (x, y, z)
+        f.write('   {:.5f}    {:.5f}    {:.5f}\n'.format(object.box_length, object.box_length, object.box_length).encode('ascii'))
     return 1
 
-def write_to_itp(object, filename='gromacs.itp', moleculetype_name='HDGEL'):
+def _interaction_table(table, n_atoms, attrs):
+    '''
+      상호작용 사전(World.Bonds 등)을 원자 번호 배열과 파라미터 열 리스트로 바꿉니다.
+      원자 번호는 사전의 키(원자 ID 튜플)에서 바로 가져오므로 원자 객체를 참조하지 않습니다.
+
+      Returns:
+          tuple: ((n, n_atoms) int64 원자 번호(1부터), 속성별 값 리스트)
+    '''
+    keys = table.keys() if all(len(key) == n_atoms for key in table) else [key[:n_atoms] for key in table]
+    ids = np.fromiter(itertools.chain.from_iterable(keys), dtype=np.int64, count=len(table) * n_atoms)
+    records = [entry[0] for entry in table.values()]
+    return ids.reshape(-1, n_atoms) + 1, [list(map(operator.attrgetter(attr), records)) for attr in attrs]
+
+
+def _text_field(values):
+    # '{}' / '{:s}' 포맷: 값마다 str() 결과를 그대로 씁니다.
+    return bf.str_field(np.array([str(v) for v in values], dtype=str))
+
+
+def _parameter_groups(columns):
+    '''
+      파라미터 열들에서 같은 값 조합을 묶습니다.
+
+      Returns:
+          tuple: (고유 조합 리스트 (처음 나온 순서), 행별 조합 번호 int64 배열)
+    '''
+    groups = {}
+    keys = zip(*[np.asarray(column).tolist() for column in columns])
+    inverse = np.fromiter((groups.setdefault(key, len(groups)) for key in keys), dtype=np.int64, count=len(columns[0]))
+    return list(groups), inverse
+
+
+def write_to_itp(object, filename='gromacs.itp', moleculetype_name='HDGEL', parameter_macros=False):
     '''
       시스템의 토폴로지 정보를 GROMACS .itp 파일 형식으로 저장합니다.
       이 파일은 분자 내 상호작용(결합, 각도 등)을 정의합니다.
-    '''
-    # --- 파일 작성 전, 특정 원자 쌍들의 ID를 분석하여 별도의 파일로 저장하는 부분 (분석용) ---
-    # (PAAM 사슬의 양 끝단 쌍, MBA 가교의 특정 원자 쌍 등을 찾아 저장)
-    # 이 부분은 주석 처리가 길어지므로 상세 설명은 생략합니다.
-    # ...
 
+      각 섹션은 원자 번호 배열과 파라미터 배열로 만든 뒤 bulk_format 으로 덩어리 단위로
+      기록하며, 출력은 레코드마다 str.format 으로 쓰던 것과 바이트 단위로 같습니다.
+
+      Args:
+          parameter_macros (bool): True 이면 bonds, constraints, angles, dihedrals 의 같은
+              파라미터 조합을 섹션 앞에 '#define _<B|C|A|D><번호> ...' 로 한 번만 쓰고, 각 줄에는
+              funct 뒤에 짧은 매크로 이름만 씁니다. 매크로는 파일 끝에서 #undef 하므로 같은 이름을
+              쓰는 다른 .itp 와 겹치지 않습니다. grompp 가 읽는 파라미터는 같습니다
+              (verify_itp_parameters 로 확인). 고무줄 결합은 RUBBER_FC 를 이미 쓰므로 그대로 둡니다.
+    '''
     if os.path.dirname(filename):
         os.makedirs(os.path.dirname(filename), exist_ok=True)
-    f = open(filename, 'w')
-    f.write(';Gromacs.itp file\n')
-    
+    f = open(filename, 'wb')
+
+    def _text(text):
+        f.write(text.encode('utf-8'))
+
+    def _records(n, build):
+        bf.write_records(f, lambda a, b: build(slice(a, b)), n)
+
+    def _ints(values, rows):
+        return bf.int_field(np.asarray(values[rows], dtype=np.int64))
+
+    def _floats(values, rows, decimals=6):
+        return bf.float_field(np.asarray(values[rows], dtype=np.float64), decimals)
+
+    macro_names = []
+
+    def _parameters(section, columns, macro_text, explicit):
+        # parameter_macros 가 아니면 explicit(rows) 의 파라미터 열을 그대로 씁니다.
+        # 매크로 이름은 줄마다 반복되므로 '_' + 섹션 글자 + 번호로 짧게 짓습니다 (예: _B12).
+        if not parameter_macros or not len(columns[0]):
+            return explicit
+        groups, inverse = _parameter_groups(columns)
+        names = np.array([f'_{section}{k + 1}' for k in range(len(groups))], dtype=str)
+        for name, group in zip(names, groups):
+            _text(f'#define {name} {macro_text(*group)}\n')
+        macro_names.extend(names.tolist())
+        return lambda r: [bf.fixed(bf.str_field(names[inverse[r]]), 0)]
+
+    _text(';Gromacs.itp file\n')
+
     # --- [ moleculetype ] 섹션 ---
     # 분자 이름과 비결합 상호작용 제외 규칙(nrexcl)을 정의합니다.
-    f.write('[ moleculetype ]\n')
-    f.write('; name  nrexcl\n')
-    f.write(f'{moleculetype_name}           1\n') # 분자 이름: HDGEL, nrexcl: 1 (1-2 상호작용 제외)
-    f.write('#define RUBBER_BANDS\n\n') # 전처리기 지시문: Elastic network(고무줄) 결합을 활성화
+    _text('[ moleculetype ]\n')
+    _text('; name  nrexcl\n')
+    _text(f'{moleculetype_name}           1\n') # 분자 이름: HDGEL, nrexcl: 1 (1-2 상호작용 제외)
+    _text('#define RUBBER_BANDS\n\n') # 전처리기 지시문: Elastic network(고무줄) 결합을 활성화
 
     # --- [ atoms ] 섹션 ---
-    # 시스템의 모든 원자 정보를 정의합니다.
-    f.write('[ atoms ]\n')
-    f.write(';   nr    type    resnr   residu    atom    cgnr  charge  mass\n')
-    for i in range(len(object.Atoms)):
-        atom = object.Atoms[i][0]
-        f.write('{:<7d}{:<6}{:<6d}{:<6}{:<6}{:<6d}{:<8.4f}{:<8.4f}\n'.format(
-            atom.atom_id + 1, atom.atom_type, int(atom.residue_number),
-            atom.residue_name, atom.atom_name, int(atom.cgnr),
-            float(atom.charge), float(atom.mass)))
+    # 시스템의 모든 원자 정보를 정의합니다. ('{:<7d}{:<6}{:<6d}{:<6}{:<6}{:<6d}{:<8.4f}{:<8.4f}')
+    _text('[ atoms ]\n')
+    _text(';   nr    type    resnr   residu    atom    cgnr  charge  mass\n')
+    atoms = _atom_columns([object.Atoms[i][0] for i in range(len(object.Atoms))], with_topology=True)
+    nr = atoms['atom_id'] + 1
+    _records(len(nr), lambda r: [
+        bf.fixed(_ints(nr, r), 7, '<'),
+        bf.fixed(_name_field(atoms['atom_type'][r], 6), 6, '<'),
+        bf.fixed(_ints(atoms['residue_number'], r), 6, '<'),
+        bf.fixed(_name_field(atoms['residue_name'][r], 6), 6, '<'),
+        bf.fixed(_name_field(atoms['atom_name'][r], 6), 6, '<'),
+        bf.fixed(_ints(atoms['cgnr'], r), 6, '<'),
+        bf.fixed(_floats(atoms['charge'], r, 4), 8, '<'),
+        bf.fixed(_floats(atoms['mass'], r, 4), 8, '<'),
+        b'\n',
+    ])
 
     # --- [ bonds ] 섹션 ---
-    # 일반적인 결합 정보를 정의합니다.
-    f.write('\n[ bonds ]\n\n')
-    for j, b in enumerate(object.Bonds):
-        bond = object.Bonds[b][0]
-        f.write('{:d}  {:d}   {:d}  {:f} {:f}\n'.format(
-            bond.bond_atom_1.atom_id + 1, bond.bond_atom_2.atom_id + 1, 
-            bond.bond_funct, bond.bond_c0, bond.bond_c1))
-            
-    # Elastic network (RUBBER_BANDS) 결합 정보를 정의합니다.
-    f.write('#ifdef RUBBER_BANDS\n')
-    f.write('#ifndef RUBBER_FC\n')
-    f.write('#define RUBBER_FC 500.000000\n') # 힘 상수를 정의
-    f.write('#endif\n')
-    for i, n in enumerate(object.Network_bonds):
-        network_bond = object.Network_bonds[n][0]
-        f.write('{:d}  {:d}   {:d}  {:f} {:s}\n'.format(
-            network_bond.network_bond_atom_1.atom_id + 1, 
-            network_bond.network_bond_atom_2.atom_id + 1, 
-            network_bond.network_bond_funct, 
-            network_bond.network_bond_c0, 
-            network_bond.network_bond_c1))
-    f.write('#endif\n')
+    # 일반적인 결합 정보를 정의합니다. ('{:d}  {:d}   {:d}  {:f} {:f}')
+    ids, (funct, c0, c1) = _interaction_table(object.Bonds, 2, ('bond_funct', 'bond_c0', 'bond_c1'))
+    funct, c0, c1 = np.asarray(funct), np.asarray(c0), np.asarray(c1)
+    params = _parameters('B', (c0, c1), lambda a, b: f'{a:f} {b:f}', lambda r: [
+        bf.fixed(_floats(c0, r), 0), b' ', bf.fixed(_floats(c1, r), 0)])
+    _text('\n[ bonds ]\n\n')
+    _records(len(ids), lambda r: [
+        bf.fixed(bf.int_field(ids[r, 0]), 0), b'  ', bf.fixed(bf.int_field(ids[r, 1]), 0), b'   ',
+        bf.fixed(_ints(funct, r), 0), b'  ', *params(r), b'\n',
+    ])
+
+    # Elastic network (RUBBER_BANDS) 결합 정보를 정의합니다. ('{:d}  {:d}   {:d}  {:f} {:s}')
+    _text('#ifdef RUBBER_BANDS\n')
+    _text('#ifndef RUBBER_FC\n')
+    _text('#define RUBBER_FC 500.000000\n') # 힘 상수를 정의
+    _text('#endif\n')
+    ids, (funct, c0, c1) = _interaction_table(
+        object.Network_bonds, 2, ('network_bond_funct', 'network_bond_c0', 'network_bond_c1'))
+    funct, c0 = np.asarray(funct), np.asarray(c0)
+    _records(len(ids), lambda r: [
+        bf.fixed(bf.int_field(ids[r, 0]), 0), b'  ', bf.fixed(bf.int_field(ids[r, 1]), 0), b'   ',
+        bf.fixed(_ints(funct, r), 0), b'  ', bf.fixed(_floats(c0, r), 0), b' ', bf.fixed(_text_field(c1[r]), 0), b'\n',
+    ])
+    _text('#endif\n')
 
     # --- [ constraints ] 섹션 ---
-    # 두 원자 사이의 거리를 고정하는 제약조건 정보를 정의합니다.
-    f.write('\n[ constraints ]\n\n')
-    for i, c in enumerate(object.Constraints):
-        constraint = object.Constraints[c][0]
-        f.write('{:d}  {:d}  {:d}  {:f}\n'.format(
-            constraint.constraint_atom_1.atom_id + 1, constraint.constraint_atom_2.atom_id + 1, 
-            constraint.constraint_funct, constraint.constraint_c0))
+    # 두 원자 사이의 거리를 고정하는 제약조건 정보를 정의합니다. ('{:d}  {:d}  {:d}  {:f}')
+    ids, (funct, c0) = _interaction_table(object.Constraints, 2, ('constraint_funct', 'constraint_c0'))
+    funct, c0 = np.asarray(funct), np.asarray(c0)
+    params = _parameters('C', (c0,), lambda a: f'{a:f}', lambda r: [bf.fixed(_floats(c0, r), 0)])
+    _text('\n[ constraints ]\n\n')
+    _records(len(ids), lambda r: [
+        bf.fixed(bf.int_field(ids[r, 0]), 0), b'  ', bf.fixed(bf.int_field(ids[r, 1]), 0), b'  ',
+        bf.fixed(_ints(funct, r), 0), b'  ', *params(r), b'\n',
+    ])
 
     # --- [ exclusions ] 섹션 ---
-    # 비결합 상호작용 계산에서 제외할 원자 쌍을 정의합니다.
-    f.write('\n[ exclusions ]\n\n')
-    for i, e in enumerate(object.Exclusions):
-        exclusion = object.Exclusions[e][0]
-        f.write('{:d}  {:d}\n'.format(
-            exclusion.exclusion_atom_1.atom_id + 1, exclusion.exclusion_atom_2.atom_id + 1))
+    # 비결합 상호작용 계산에서 제외할 원자 쌍을 정의합니다. ('{:d}  {:d}')
+    _text('\n[ exclusions ]\n\n')
+    ids, _ = _interaction_table(object.Exclusions, 2, ())
+    _records(len(ids), lambda r: [
+        bf.fixed(bf.int_field(ids[r, 0]), 0), b'  ', bf.fixed(bf.int_field(ids[r, 1]), 0), b'\n',
+    ])
 
     # --- [ angles ] 섹션 ---
-    # 세 원자가 이루는 각도에 대한 포텐셜 정보를 정의합니다.
-    f.write('\n[ angles ]\n\n')
-    for k, z in enumerate(object.Angles):
-        angle = object.Angles[z][0]
-        f.write('{:5d}  {:5d}  {:5d}  {:5d}  {:f}  {:f}\n'.format(
-            angle.angle_atom_1.atom_id + 1, angle.angle_atom_2.atom_id + 1, angle.angle_atom_3.atom_id + 1, 
-            angle.angle_funct, angle.angle_c0, angle.angle_c1))
+    # 세 원자가 이루는 각도에 대한 포텐셜 정보를 정의합니다. ('{:5d}  {:5d}  {:5d}  {:5d}  {:f}  {:f}')
+    ids, (funct, c0, c1) = _interaction_table(object.Angles, 3, ('angle_funct', 'angle_c0', 'angle_c1'))
+    funct, c0, c1 = np.asarray(funct), np.asarray(c0), np.asarray(c1)
+    params = _parameters('A', (c0, c1), lambda a, b: f'{a:f}  {b:f}', lambda r: [
+        bf.fixed(_floats(c0, r), 0), b'  ', bf.fixed(_floats(c1, r), 0)])
+    _text('\n[ angles ]\n\n')
+    _records(len(ids), lambda r: [
+        bf.fixed(bf.int_field(ids[r, 0]), 5), b'  ', bf.fixed(bf.int_field(ids[r, 1]), 5), b'  ',
+        bf.fixed(bf.int_field(ids[r, 2]), 5), b'  ', bf.fixed(_ints(funct, r), 5), b'  ',
+        *params(r), b'\n',
+    ])
 
     # --- [ dihedrals ] 섹션 ---
-    # 네 원자가 이루는 이면각에 대한 포텐셜 정보를 정의합니다.
-    f.write('\n[ dihedrals ]\n\n')
-    for p, q in enumerate(object.Dihedrals):
-        dihedral = object.Dihedrals[q][0]
-        if dihedral.dihedral_c2 == ' ':
-            f.write('{} {} {} {} {} {} {}\n'.format(
-                dihedral.dihedral_atom_1.atom_id + 1, dihedral.dihedral_atom_2.atom_id + 1, 
-                dihedral.dihedral_atom_3.atom_id + 1, dihedral.dihedral_atom_4.atom_id + 1, 
-                dihedral.dihedral_funct, dihedral.dihedral_c0, dihedral.dihedral_c1))
-        else:
-            f.write('{} {} {} {} {} {} {} {}\n'.format(
-                dihedral.dihedral_atom_1.atom_id + 1, dihedral.dihedral_atom_2.atom_id + 1, 
-                dihedral.dihedral_atom_3.atom_id + 1, dihedral.dihedral_atom_4.atom_id + 1, 
-                dihedral.dihedral_funct, dihedral.dihedral_c0, dihedral.dihedral_c1, dihedral.dihedral_c2))
+    # 네 원자가 이루는 이면각에 대한 포텐셜 정보를 정의합니다. ('{} {} {} {} {} {} {}' [+ ' {}'])
+    # c2 가 ' ' 인 이면각은 c2 열 없이 씁니다.
+    ids, (funct, c0, c1, c2) = _interaction_table(
+        object.Dihedrals, 4, ('dihedral_funct', 'dihedral_c0', 'dihedral_c1', 'dihedral_c2'))
+    tail = np.array(['' if v == ' ' else f' {v}' for v in c2], dtype=str)
+    funct, c0, c1 = np.array(funct, dtype='O'), np.array(c0, dtype='O'), np.array(c1, dtype='O')
+    params = _parameters('D', (c0, c1, tail), lambda a, b, t: f'{a} {b}{t}', lambda r: [
+        bf.fixed(_text_field(c0[r]), 0), b' ', bf.fixed(_text_field(c1[r]), 0), bf.fixed(bf.str_field(tail[r]), 0)])
+    _text('\n[ dihedrals ]\n\n')
+    _records(len(ids), lambda r: [
+        bf.fixed(bf.int_field(ids[r, 0]), 0), b' ', bf.fixed(bf.int_field(ids[r, 1]), 0), b' ',
+        bf.fixed(bf.int_field(ids[r, 2]), 0), b' ', bf.fixed(bf.int_field(ids[r, 3]), 0), b' ',
+        bf.fixed(_text_field(funct[r]), 0), b' ', *params(r), b'\n',
+    ])
+    if macro_names:
+        _text('\n' + ''.join(f'#undef {name}\n' for name in macro_names))
     f.close()
 
-    return 1
\ No newline at end of file
+    return 1
+
+def verify_itp_parameters(object, filename, moleculetype_name='HDGEL'):
+    '''
+      parameter_macros 로 쓴 .itp 가 파라미터를 모두 적은 .itp 와 grompp 입장에서 같은지 확인합니다.
+      파라미터를 모두 적은 파일을 임시로 쓴 뒤, 두 파일을 매크로 치환 후 섹션 표 단위로 비교합니다.
+
+      Raises:
+          ValueError: 다른 섹션이 있으면 그 목록과 함께 발생합니다.
+    '''
+    fd, reference = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.itp')
+    os.close(fd)
+    try:
+        write_to_itp(object, filename=reference, moleculetype_name=moleculetype_name)
+        differences = itp_parser.compare_itp(reference, filename)
+    finally:
+        os.remove(reference)
+    if differences:
+        raise ValueError(f"{filename} 의 파라미터가 원래 값과 다릅니다: " + "; ".join(differences))
+    print(f"ITP 파라미터 확인 완료: {filename} (매크로 치환 후 모든 섹션 일치)")
@@ -499,7 +499,8 @@ class Hydrogel():
     def construct_chemical_detail(self):
         from main_components.Universe import World
         print(f"World.box_length in construct_chemical_detail: {World.box_length}")
-        from core_utils.martini_parser import read_itp_definitions
+        from core_utils import martini_library
+        from core_utils.martini_parser import moleculetype_definition, read_itp_definitions
         import os
 
         # --- 곁사슬 배치 전략 파라미터 ---
@@ -522,10 +523,20 @@ class Hydrogel():
         try:
             monomer_definitions = p.Config.get_param('monomer_definitions')
             # Load definitions from ITP files if specified
+            martini_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'martini_v300')
+            library = None
             for monomer in monomer_definitions['MONOMERS']:
                 if 'itp_file' in monomer and 'martini_id' in monomer:
-                    itp_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'martini_v300', monomer['itp_file'])
+                    itp_path = os.path.join(martini_dir, monomer['itp_file'])
                     print(f"Loading definition for '{monomer['martini_id']}' from '{itp_path}'...")
+                    if os.path.abspath(itp_path).startswith(os.path.abspath(martini_dir) + os.sep):
+                        # 색인된 라이브러리에서 해당 moleculetype 블록만 파싱합니다.
+                        library = library or martini_library.open_library(martini_dir)
+                        try:
+                            monomer['definition'] = moleculetype_definition(library.moleculetype(monomer['martini_id'], path=itp_path))
+                        except KeyError:
+                            print(f"Warning: '{monomer['martini_id']}' not found in '{monomer['itp_file']}'. Using inline definition.")
+                        continue
                     itp_definitions = read_itp_definitions(itp_path)
                     if monomer['martini_id'] in itp_definitions:
                         monomer['definition'] = itp_definitions[monomer['martini_id']]
@@ -17,4 +17,7 @@ setup(
     'scipy',
     'numba',
     ],
+    extras_require={
+    'zstd': ['zstandard'],  # .zst compressed structure files
+    },
 )